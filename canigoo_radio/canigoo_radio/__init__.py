@@ -12,22 +12,91 @@ from uuid import UUID
 from datetime import datetime
 
 from anyblok.blok import Blok
+from anyblok.config import Configuration
+from sqlalchemy import text
 from anyblok_pyramid.adapter import uuid_adapter, datetime_adapter
 
-from pyramid.renderers import JSON
 from pyramid.authentication import BasicAuthAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 
+from .playlog import create_partitions
+from .profiling import TimedRenderer, timed_view
+from .renderers import get_json_renderer
 from .views.validators import check_basic_auth_credentials, RootAcl
 
 
+def anyblok_init_config(unittest=False):
+    from . import config  # noqa import config definition
+
+
 class Canigoo_radio(Blok):
     """Canigoo radio's Blok class definition
     """
-    version = "0.1.0"
+    version = "0.2.0"
     author = "Franck Bret"
     required = ['anyblok-core']
 
+    def update(self, latest_version):
+        self.update_event_no_overlap()
+        self.update_event_notify()
+        self.update_playlog_partitions()
+
+    def update_event_no_overlap(self):
+        """Forbid overlapping events in the database
+
+        A generated ``during`` range column is indexed by a GiST exclusion
+        constraint, events sharing a bound do not overlap.
+        """
+        data_type = self.registry.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'event' AND column_name = 'start'")).scalar()
+        range_type = ('tstzrange' if data_type.endswith('with time zone')
+                      else 'tsrange')
+        self.registry.execute(text(
+            'ALTER TABLE event ADD COLUMN IF NOT EXISTS during %(range)s '
+            'GENERATED ALWAYS AS ('
+            '    CASE WHEN start IS NULL OR "end" IS NULL THEN NULL '
+            '    ELSE %(range)s(start, "end", \'[)\') END'
+            ') STORED' % dict(range=range_type)))
+        self.registry.execute(text(
+            "DO $$ BEGIN "
+            "    IF NOT EXISTS (SELECT 1 FROM pg_constraint "
+            "                   WHERE conname = 'event_no_overlap') THEN "
+            "        ALTER TABLE event ADD CONSTRAINT event_no_overlap "
+            "        EXCLUDE USING gist (during WITH &&); "
+            "    END IF; "
+            "END $$"))
+
+    def update_event_notify(self):
+        """Notify the ``canigoo_schedule`` channel when events or
+        recurrences change
+
+        The playout scheduler listens on it to reload the schedule, one
+        notification is sent by statement whatever the number of rows.
+        """
+        self.registry.execute(text(
+            "CREATE OR REPLACE FUNCTION canigoo_schedule_notify() "
+            "RETURNS trigger AS $$ BEGIN "
+            "    PERFORM pg_notify('canigoo_schedule', TG_OP); "
+            "    RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"))
+        for table in ('event', 'recurrence'):
+            self.registry.execute(text(
+                "DROP TRIGGER IF EXISTS %s_notify ON %s" % (table, table)))
+            self.registry.execute(text(
+                "CREATE TRIGGER %s_notify "
+                "AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %s "
+                "FOR EACH STATEMENT "
+                "EXECUTE PROCEDURE canigoo_schedule_notify()" % (
+                    table, table)))
+
+    def update_playlog_partitions(self):
+        """Create the monthly partitions of the play log ahead
+        """
+        create_partitions(
+            self.registry.execute, datetime.now(),
+            months=Configuration.get('playlog_months_ahead', 3))
+
     @classmethod
     def import_declaration_module(cls):
         """Python module to import in the given order at start-up
@@ -64,10 +133,18 @@ class Canigoo_radio(Blok):
         config.include("pyramid_jinja2")
 
         # Json api renderer
-        json_renderer = JSON()
+        json_renderer = get_json_renderer()
         json_renderer.add_adapter(UUID, uuid_adapter)
         json_renderer.add_adapter(datetime, datetime_adapter)
-        config.add_renderer('json', json_renderer)
+        json_renderer.add_adapter(bytes, lambda obj, request: os.fsdecode(obj))
+        if Configuration.get('profiling', False):
+            config.add_renderer('json', TimedRenderer(json_renderer))
+            config.add_view_deriver(
+                timed_view, under='rendered_view', over='mapped_view')
+            config.add_tween(
+                cls.__module__ + '.profiling.profiling_tween_factory')
+        else:
+            config.add_renderer('json', json_renderer)
 
         # radio homepage
         config.add_route('homepage', '/')
@@ -75,6 +152,8 @@ class Canigoo_radio(Blok):
                 '%s/canigoo_radio/canigoo_radio/static/' % os.getcwd(), cache_max_age=3600)
         # rest api / json
         config.add_route('canigoo_api_v1', '/api/v1/')
+        config.add_route('push', '/api/v1/push')
+        config.add_route('metrics', '/metrics')
 
         # Scan available views
         config.scan(cls.__module__ + '.views')
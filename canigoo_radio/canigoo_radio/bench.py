@@ -0,0 +1,396 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Benchmarks of the scheduling, REST api, Liquidsoap and library hot paths
+
+``canigoo_bench`` (``make bench``) runs the suites, writes the results as
+JSON and compares them with a baseline file written by a previous run. Each
+benchmark is timed with ``timeit``: the number of calls is chosen so a
+measure lasts at least 0.2 second, the measure is repeated and the median
+time per call is the compared value.
+
+The ``schedule`` suite inserts its events in a transaction rolled back at
+the end, the ``api`` and ``auth`` suites have to commit their data to serve
+it through the WSGI application and delete it afterwards. They are meant to
+run against the test database.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from base64 import b64encode
+from datetime import datetime, timedelta
+from logging import getLogger
+from uuid import uuid1
+
+import anyblok
+from anyblok.config import Configuration
+
+from .library import BeetsLibrary
+from .library_search import SearchIndex
+from .liquidsoap_client import LiquidsoapClient, LiquidsoapConnectionPool
+from .liquidsoap_fake import FakeLiquidsoap
+from .schedule import get_schedule_index
+
+
+logger = getLogger(__name__)
+
+SUITES = ('schedule', 'api', 'auth', 'liquidsoap', 'beets')
+DB_SUITES = ('schedule', 'api', 'auth')
+
+# events of the benchmarks are far in the future, out of the real schedule
+BENCH_START = datetime(2100, 1, 1)
+BENCH_NAME = 'canigoo bench'
+
+
+def measure(func, repeat=5, number=None):
+    """ Returns the statistics of the time per call of ``func`` in seconds
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+
+    samples = [total / number for total in timer.repeat(repeat, number)]
+    return dict(number=number, repeat=repeat, min=min(samples),
+                median=statistics.median(samples),
+                mean=statistics.mean(samples),
+                stdev=statistics.stdev(samples) if repeat > 1 else 0)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """ Compare the median of ``results`` with the ``baseline`` ones
+
+    Returns a list of ``(name, baseline, current, ratio, status)`` where
+    status is ``regression`` or ``improvement`` when the ratio is out of
+    ``1 +/- tolerance``, ``ok`` otherwise and ``new`` for a benchmark
+    missing from the baseline.
+    """
+    rows = []
+    for name, stats in sorted(results.items()):
+        if name not in baseline:
+            rows.append((name, None, stats['median'], None, 'new'))
+            continue
+
+        before = baseline[name]['median']
+        ratio = stats['median'] / before if before else float('inf')
+        if ratio > 1 + tolerance:
+            status = 'regression'
+        elif ratio < 1 - tolerance:
+            status = 'improvement'
+        else:
+            status = 'ok'
+
+        rows.append((name, before, stats['median'], ratio, status))
+
+    return rows
+
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if value >= scale:
+            return '%.2f%s' % (value / scale, unit)
+
+    return '%.0fns' % (value * 1e9)
+
+
+def format_comparison(rows):
+    lines = ['%-40s %10s %10s %8s  %s' % (
+        'benchmark', 'baseline', 'current', 'ratio', 'status')]
+    for name, before, current, ratio, status in rows:
+        lines.append('%-40s %10s %10s %8s  %s' % (
+            name, format_seconds(before), format_seconds(current),
+            '-' if ratio is None else '%.2f' % ratio, status))
+
+    return '\n'.join(lines)
+
+
+def write_results(path, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    data = dict(
+        meta=dict(date=datetime.now().isoformat(),
+                  python=platform.python_version(),
+                  platform=platform.platform()),
+        results=results)
+    with open(path, 'w', encoding='utf-8') as fileobj:
+        json.dump(data, fileobj, indent=2, sort_keys=True)
+
+
+def read_results(path):
+    with open(path, 'r', encoding='utf-8') as fileobj:
+        return json.load(fileobj)['results']
+
+
+def bench_events(count, start=BENCH_START):
+    """ Yield ``count`` contiguous events of one hour
+    """
+    for i in range(count):
+        event_start = start + timedelta(hours=i)
+        yield dict(name='%s %d' % (BENCH_NAME, i), start=event_start,
+                   end=event_start + timedelta(hours=1),
+                   created_at=event_start, edited_at=event_start)
+
+
+def insert_events(registry, count, chunk_size=10000):
+    table = registry.Event.__table__
+    chunk = []
+    for row in bench_events(count):
+        row['uuid'] = uuid1()
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            registry.execute(table.insert(), chunk)
+            chunk = []
+
+    if chunk:
+        registry.execute(table.insert(), chunk)
+
+
+def reset_schedule_index(registry):
+    get_schedule_index(registry).loaded = False
+
+
+def bench_schedule(registry, sizes, seed=0):
+    """ ``Event.get_current``, ``get_next`` and ``overlap`` with ``sizes``
+    events in the table
+    """
+    E = registry.Event
+    results = {}
+    for size in sizes:
+        randint = random.Random(seed).randint
+        span = size * 3600
+
+        def at():
+            return BENCH_START + timedelta(seconds=randint(0, span))
+
+        def overlap():
+            start = at()
+            return E.overlap(start, start + timedelta(minutes=30))
+
+        insert_events(registry, size)
+        try:
+            reset_schedule_index(registry)
+            results['schedule.index_load[%d]' % size] = measure(
+                lambda: (reset_schedule_index(registry),
+                         get_schedule_index(registry).sync(E)),
+                repeat=3, number=1)
+            results['schedule.get_current[%d]' % size] = measure(
+                lambda: E.get_current(at=at()))
+            results['schedule.get_next[%d]' % size] = measure(
+                lambda: E.get_next(at=at()))
+            results['schedule.overlap[%d]' % size] = measure(overlap)
+        finally:
+            registry.rollback()
+            reset_schedule_index(registry)
+
+    return results
+
+
+def basic_auth(username, password):
+    credentials = ('%s:%s' % (username, password)).encode('utf-8')
+    return {'Authorization': 'Basic %s' % b64encode(credentials).decode()}
+
+
+class WebFixture:
+    """ Committed user and events served by the WSGI application
+    """
+
+    username = 'canigoo-bench'
+    password = 'canigoo-bench'
+
+    def __init__(self, registry, events=0):
+        self.registry = registry
+        self.events = events
+
+    def __enter__(self):
+        # needs WebTest from the test requirements
+        from anyblok_pyramid.testing import init_web_server
+
+        registry = self.registry
+        self.user = registry.User.insert(
+            email='bench@canigoo.test', username=self.username,
+            password=self.password)
+        insert_events(registry, self.events)
+        registry.commit()
+        reset_schedule_index(registry)
+        self.webserver = init_web_server()
+        self.headers = basic_auth(self.username, self.password)
+        return self
+
+    def __exit__(self, *args):
+        registry = self.registry
+        registry.rollback()
+        E = registry.Event
+        E.query().filter(E.name.like(BENCH_NAME + ' %')).delete(
+            synchronize_session=False)
+        registry.User.query().filter_by(username=self.username).delete(
+            synchronize_session=False)
+        registry.commit()
+        reset_schedule_index(registry)
+
+
+def bench_api(registry, size):
+    """ Serialisation of the ``/api/v1/events`` collection
+    """
+    with WebFixture(registry, events=size) as fixture:
+        return {'api.events_collection[%d]' % size: measure(
+            lambda: fixture.webserver.get(
+                '/api/v1/events', headers=fixture.headers))}
+
+
+def bench_auth(registry):
+    """ Cost of the basic auth check on a small collection, anonymous
+    requests are denied before the view
+    """
+    results = {}
+    with WebFixture(registry) as fixture:
+        get = fixture.webserver.get
+        results['auth.anonymous'] = measure(
+            lambda: get('/api/v1/presenters', status=403))
+        results['auth.cached'] = measure(
+            lambda: get('/api/v1/presenters', headers=fixture.headers))
+        ttl = Configuration.get('auth_cache_ttl', 300)
+        Configuration.set('auth_cache_ttl', 0)
+        try:
+            results['auth.uncached'] = measure(
+                lambda: get('/api/v1/presenters', headers=fixture.headers))
+        finally:
+            Configuration.set('auth_cache_ttl', ttl)
+
+    return results
+
+
+def bench_liquidsoap(pipeline=10):
+    """ ``LiquidsoapClient`` round trips against a local fake server
+    """
+    directory = tempfile.mkdtemp()
+    fake = FakeLiquidsoap(os.path.join(directory, 'liquidsoap.sock')).start()
+    pool = LiquidsoapConnectionPool(fake.path)
+    try:
+        client = LiquidsoapClient(pool=pool, debug=False)
+        cmds = ['request.metadata %d' % i for i in range(pipeline)]
+        return {
+            'liquidsoap.send': measure(lambda: client.send('version')),
+            'liquidsoap.send_many[%d]' % pipeline: measure(
+                lambda: client.send_many(cmds)),
+        }
+    finally:
+        pool.close()
+        fake.stop()
+        shutil.rmtree(directory)
+
+
+def create_library(path, size, seed=0):
+    """ Create a Beets library of ``size`` generated items at ``path``
+    """
+    import beets.library
+
+    rnd = random.Random(seed)
+    genres = ['rock', 'jazz', 'soul', 'electro', 'reggae', 'folk']
+    library = beets.library.Library(path)
+    with library.transaction():
+        for i in range(size):
+            item = beets.library.Item(
+                path=('/music/%d.flac' % i).encode(),
+                artist='artist %d' % rnd.randint(0, size // 10),
+                album='album %d' % rnd.randint(0, size // 5),
+                title='title %d %s' % (i, rnd.choice(genres)),
+                year=rnd.randint(1950, 2017))
+            item.add(library)
+
+    library._close()
+
+
+def bench_beets(size):
+    """ Library search, paging and typeahead on a generated library
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'library.db')
+    try:
+        create_library(path, size)
+        library = BeetsLibrary(path, cache_size=0)
+        index = SearchIndex(path, path + '.fts')
+        index.sync()
+        results = {
+            'beets.search[%d]' % size: measure(
+                lambda: library.search('artist:artist 1'), repeat=3),
+            'beets.page[%d]' % size: measure(
+                lambda: library.page('year:1980..1990', limit=100)),
+            'beets.typeahead[%d]' % size: measure(
+                lambda: index.search('title 12', limit=10)),
+        }
+        library.library._close()
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def parse_sizes(value):
+    return [int(size) for size in str(value).split(',') if size.strip()]
+
+
+def run_suites(registry, suites):
+    results = {}
+    if 'schedule' in suites:
+        results.update(bench_schedule(registry, parse_sizes(
+            Configuration.get('bench_sizes', '10000,100000,1000000'))))
+    if 'api' in suites:
+        results.update(bench_api(
+            registry, Configuration.get('bench_api_size', 1000)))
+    if 'auth' in suites:
+        results.update(bench_auth(registry))
+    if 'liquidsoap' in suites:
+        results.update(bench_liquidsoap())
+    if 'beets' in suites:
+        results.update(bench_beets(
+            Configuration.get('bench_library_size', 10000)))
+
+    return results
+
+
+def run_bench():
+    """ Run the benchmarks, write their results and compare them with the
+    baseline, exits with status 1 on a regression
+    """
+    registry = anyblok.start(
+        'canigoo_bench',
+        configuration_groups=['config', 'database', 'logging',
+                              'canigoo-bench'],
+        loadwithoutmigration=True)
+    suites = Configuration.get('bench_suites') or list(SUITES)
+    if registry is None:
+        logger.warning("No database, the %s suites are skipped",
+                       ', '.join(DB_SUITES))
+        suites = [suite for suite in suites if suite not in DB_SUITES]
+
+    try:
+        results = run_suites(registry, suites)
+    finally:
+        if registry is not None:
+            registry.close()
+
+    output = Configuration.get('bench_output', 'bench/results.json')
+    write_results(output, results)
+    baseline = Configuration.get('bench_baseline')
+    if not baseline or not os.path.exists(baseline):
+        print(format_comparison(compare(results, {})))
+        return
+
+    rows = compare(results, read_results(baseline),
+                   tolerance=Configuration.get('bench_tolerance', 0.2))
+    print(format_comparison(rows))
+    if any(row[4] == 'regression' for row in rows):
+        sys.exit(1)
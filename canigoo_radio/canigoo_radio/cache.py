@@ -0,0 +1,101 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""In process caches
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """ A thread safe least recently used cache with an optional time to live
+
+    Entries are evicted when the cache grows over ``maxsize`` entries, over
+    ``maxweight`` when the entries are weighed by ``weigh`` or when their
+    time to live is over. A value weighing more than ``maxweight`` is not
+    stored.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, timer=time.monotonic,
+                 maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """ Returns the value cached for ``key`` or ``default``
+        """
+        with self._lock:
+            try:
+                value, expire_at, _ = self._data[key]
+            except KeyError:
+                return default
+
+            if expire_at is not None and expire_at <= self.timer():
+                self._remove(key)
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ Store ``value`` for ``key``, ``ttl`` overloads the cache one
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = self.timer() + ttl if ttl is not None else None
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            self._remove(key)
+            if self.maxweight is not None and weight > self.maxweight:
+                return
+
+            self._data[key] = (value, expire_at, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (
+                    self.maxweight is not None and
+                    self.weight > self.maxweight):
+                self.weight -= self._data.popitem(last=False)[1][2]
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+        return entry
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._remove(key)
+
+        return entry[0] if entry else default
+
+    def discard_if(self, predicate):
+        """ Remove every entry whose value matches ``predicate``
+        """
+        with self._lock:
+            keys = [k for k, (v, _, _) in self._data.items() if predicate(v)]
+            for key in keys:
+                self._remove(key)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,258 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Canigoo radio configuration options
+"""
+from anyblok.config import Configuration
+
+
+@Configuration.add('canigoo-auth', label="Canigoo radio authentication")
+def define_auth_options(group):
+    group.add_argument(
+        '--auth-cache-ttl', type=int, default=300,
+        help="Seconds a verified basic auth credential is kept in cache, "
+             "0 disables the cache")
+    group.add_argument(
+        '--auth-cache-size', type=int, default=1024,
+        help="Maximum number of verified credentials kept in cache")
+
+
+@Configuration.add('canigoo-liquidsoap', label="Canigoo radio Liquidsoap")
+def define_liquidsoap_options(group):
+    group.add_argument(
+        '--liquidsoap-socket', default='/tmp/liquidsoap.sock',
+        help="Path of the Liquidsoap telnet server unix socket")
+    group.add_argument(
+        '--liquidsoap-pool-size', type=int, default=2,
+        help="Number of idle Liquidsoap sessions kept open by a worker")
+    group.add_argument(
+        '--liquidsoap-timeout', type=float, default=5,
+        help="Seconds to wait for Liquidsoap before giving up a command")
+    group.add_argument(
+        '--liquidsoap-idle-timeout', type=float, default=20,
+        help="Seconds after which an idle session is not reused, must be "
+             "lower than Liquidsoap server.timeout")
+    group.add_argument(
+        '--liquidsoap-status-ttl', type=float, default=2,
+        help="Maximum age in seconds of the Liquidsoap status snapshot "
+             "served by the api")
+    group.add_argument(
+        '--liquidsoap-status-poll-interval', type=float, default=1,
+        help="Seconds between two background refreshes of the Liquidsoap "
+             "status snapshot, 0 disables the poller")
+    group.add_argument(
+        '--liquidsoap-debug', action='store_true', default=False,
+        help="Log every command sent to Liquidsoap and its reply")
+
+
+@Configuration.add('canigoo-schedule', label="Canigoo radio schedule")
+def define_schedule_options(group):
+    group.add_argument(
+        '--schedule-sync-interval', type=float, default=5,
+        help="Seconds between two synchronisations of the in memory "
+             "schedule index with events written by other workers")
+    group.add_argument(
+        '--recurrence-window-days', type=int, default=7,
+        help="Days of recurrence occurrences merged into the events "
+             "collection when no from/to window is given")
+
+
+@Configuration.add('canigoo-api', label="Canigoo radio api")
+def define_api_options(group):
+    group.add_argument(
+        '--json-renderer', choices=['json', 'orjson'], default='json',
+        help="Renderer of the api responses, orjson needs the fast extra "
+             "and falls back to json when missing")
+
+
+@Configuration.add('canigoo-website', label="Canigoo radio website")
+def define_website_options(group):
+    group.add_argument(
+        '--homepage-cache-ttl', type=int, default=60,
+        help="Maximum seconds the rendered homepage is kept in cache, it "
+             "bounds the delay before writes done by other workers are "
+             "shown")
+
+
+@Configuration.add('canigoo-push', label="Canigoo radio push channel")
+def define_push_options(group):
+    group.add_argument(
+        '--push-enabled', action='store_true', default=False,
+        help="Serve the push endpoint and let the homepage subscribe to "
+             "it, only with an async worker class (gevent) since every "
+             "subscriber holds a worker")
+    group.add_argument(
+        '--push-interval', type=float, default=1,
+        help="Seconds between two polls of the push channel producer")
+    group.add_argument(
+        '--push-queue-size', type=int, default=16,
+        help="Messages kept for a slow push subscriber, the oldest are "
+             "dropped")
+    group.add_argument(
+        '--push-keepalive', type=float, default=15,
+        help="Idle seconds before a keepalive comment is sent")
+
+
+@Configuration.add('canigoo-profiling', label="Canigoo radio profiling")
+def define_profiling_options(group):
+    group.add_argument(
+        '--profiling', action='store_true', default=False,
+        help="Time SQL, authentication, view, serialisation and rendering "
+             "of each request in a Server-Timing header")
+    group.add_argument(
+        '--profiling-sample-rate', type=float, default=0,
+        help="Share of the profiled requests run under cProfile, between "
+             "0 and 1")
+    group.add_argument(
+        '--profiling-dir', default=None,
+        help="Directory of the cProfile dumps, default to "
+             "canigoo-profiles in the temporary directory")
+
+
+@Configuration.add('canigoo-bench', label="Canigoo radio benchmarks")
+def define_bench_options(group):
+    group.add_argument(
+        '--bench-suite', dest='bench_suites', action='append', default=[],
+        choices=['schedule', 'api', 'auth', 'liquidsoap', 'beets'],
+        help="Benchmark suite to run, can be repeated, all by default")
+    group.add_argument(
+        '--bench-sizes', default='10000,100000,1000000',
+        help="Comma separated numbers of events of the schedule suite")
+    group.add_argument(
+        '--bench-api-size', type=int, default=1000,
+        help="Number of events served by the api suite")
+    group.add_argument(
+        '--bench-library-size', type=int, default=10000,
+        help="Number of items of the generated Beets library")
+    group.add_argument(
+        '--bench-output', default='bench/results.json',
+        help="Path of the JSON results")
+    group.add_argument(
+        '--bench-baseline', default=None,
+        help="JSON results of a previous run to compare with")
+    group.add_argument(
+        '--bench-tolerance', type=float, default=0.2,
+        help="Relative slowdown of a median reported as a regression")
+
+
+@Configuration.add('canigoo-playout', label="Canigoo radio playout")
+def define_playout_options(group):
+    group.add_argument(
+        '--playout-source-var', default='source',
+        help="Liquidsoap interactive string selecting the source, set to "
+             "auto, playlist or live")
+    group.add_argument(
+        '--playout-default-source', default='auto',
+        help="Source selected when no event is on air")
+    group.add_argument(
+        '--playout-queue', default='request',
+        help="Liquidsoap request queue receiving the playlist tracks")
+    group.add_argument(
+        '--playout-auto-queue', default='auto',
+        help="Liquidsoap request queue receiving the tracks generated for "
+             "the auto events")
+    group.add_argument(
+        '--playout-horizon', type=float, default=24,
+        help="Hours of upcoming events kept in the timer heap")
+    group.add_argument(
+        '--playout-sync-interval', type=float, default=60,
+        help="Seconds between two reloads of the schedule when no change "
+             "is notified")
+    group.add_argument(
+        '--playout-no-listen', dest='playout_listen', action='store_false',
+        default=True,
+        help="Do not LISTEN to the schedule changes, only reload the "
+             "schedule every playout-sync-interval seconds")
+
+
+@Configuration.add('canigoo-playlist', label="Canigoo radio auto playlists")
+def define_playlist_options(group):
+    group.add_argument(
+        '--playlist-days', type=float, default=7,
+        help="Days of auto events whose playlist is generated")
+    group.add_argument(
+        '--playlist-tolerance', type=float, default=5,
+        help="Seconds a generated playlist may differ from its event "
+             "duration")
+    group.add_argument(
+        '--playlist-regenerate', action='store_true', default=False,
+        help="Generate again the playlists already generated")
+    group.add_argument(
+        '--rotation-artist', type=float, default=60,
+        help="Minutes before an artist is played again, 0 disables the rule")
+    group.add_argument(
+        '--rotation-album', type=float, default=180,
+        help="Minutes before an album is played again, 0 disables the rule")
+    group.add_argument(
+        '--rotation-track', type=float, default=72,
+        help="Hours before a track is played again, 0 disables the rule")
+
+
+@Configuration.add('canigoo-playlog', label="Canigoo radio play log")
+def define_playlog_options(group):
+    group.add_argument(
+        '--playlog-batch-size', type=int, default=50,
+        help="Queued plays triggering a flush of the play log")
+    group.add_argument(
+        '--playlog-flush-interval', type=float, default=10,
+        help="Seconds between two flushes of the play log")
+    group.add_argument(
+        '--playlog-max-pending', type=int, default=10000,
+        help="Plays kept in memory while the database is unreachable, the "
+             "oldest are dropped")
+    group.add_argument(
+        '--playlog-months-ahead', type=int, default=3,
+        help="Monthly partitions of the play log created by the blok "
+             "update from the current month")
+
+
+@Configuration.add('canigoo-listeners', label="Canigoo radio listeners")
+def define_listeners_options(group):
+    group.add_argument(
+        '--icecast-status-url', default=None,
+        help="Url of the Icecast status-json.xsl page read by the listeners "
+             "sampler of canigoo_playout, no sampling when unset")
+    group.add_argument(
+        '--icecast-mount', default=None,
+        help="Mount point whose listeners are counted, all of them by "
+             "default")
+    group.add_argument(
+        '--listeners-dir', default='~/canigoo-listeners',
+        help="Directory of the listener counts files")
+    group.add_argument(
+        '--listeners-sample-interval', type=float, default=60,
+        help="Seconds between two samples of the listeners")
+
+
+@Configuration.add('canigoo-import', label="Canigoo radio schedule import")
+def define_import_options(group):
+    group.add_argument(
+        '--import-file', dest='import_files', action='append', default=[],
+        help="Schedule file (csv, json or ics) to import, can be repeated")
+    group.add_argument(
+        '--import-format', choices=['csv', 'json', 'ics'], default=None,
+        help="Format of the imported files, guessed from their extension "
+             "by default")
+
+
+@Configuration.add('canigoo-beets', label="Canigoo radio Beets library")
+def define_beets_options(group):
+    group.add_argument(
+        '--beets-db-path', default='~/canigoo.db',
+        help="Path of the Beets library database")
+    group.add_argument(
+        '--beets-cache-size', type=int, default=256,
+        help="Maximum number of library search results kept in cache, "
+             "0 disables the cache")
+    group.add_argument(
+        '--beets-cache-items', type=int, default=20000,
+        help="Maximum number of items of the library search results kept "
+             "in cache, a larger result is not cached")
+    group.add_argument(
+        '--beets-search-index', default=None,
+        help="Path of the full text search index of the library, default "
+             "to the Beets database path followed by .fts")
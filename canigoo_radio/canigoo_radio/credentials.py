@@ -0,0 +1,82 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Cache of verified basic auth credentials
+
+Verifying a ``pbkdf2_sha512`` password is expensive on purpose, this cache
+lets a repeated request skip both the user query and the password check.
+Entries are keyed on a HMAC of the credentials with a secret generated at
+start-up, so clear passwords are never kept in memory.
+
+The cache lives in the worker process and holds the uuid of the user with
+its stored password hash. A hit is confirmed by a primary key lookup of the
+username and hash, both cheap: once the password, the username or the user
+itself changed, committed by any worker, the entry is dropped and the
+credentials verified again.
+"""
+import hashlib
+import hmac
+import os
+
+from anyblok.config import Configuration
+
+from .cache import LRUCache
+
+
+_SECRET = os.urandom(32)
+_cache = None
+
+
+def credentials_digest(username, password):
+    """ Returns the keyed digest used to index ``username`` / ``password``
+    """
+    msg = b'\x00'.join((username.encode('utf-8'), password.encode('utf-8')))
+    return hmac.new(_SECRET, msg, hashlib.sha256).digest()
+
+
+def get_credentials_cache():
+    """ Returns the worker credentials cache, None if disabled
+    """
+    global _cache
+    ttl = Configuration.get('auth_cache_ttl', 300)
+    if not ttl:
+        return None
+
+    if _cache is None:
+        _cache = LRUCache(
+            maxsize=Configuration.get('auth_cache_size', 1024), ttl=ttl)
+
+    return _cache
+
+
+def password_stamp(password):
+    """ Returns the stored hash of a ``Model.User`` password, it changes with
+    each password change
+    """
+    return getattr(password, 'hash', password)
+
+
+def get_verified_user(username, password):
+    """ Returns the ``(uuid, password stamp)`` of the user if these
+    credentials were verified
+    """
+    cache = get_credentials_cache()
+    if cache is None:
+        return None
+
+    return cache.get(credentials_digest(username, password))
+
+
+def set_verified_user(username, password, uuid, stamp):
+    cache = get_credentials_cache()
+    if cache is not None:
+        cache.set(credentials_digest(username, password), (uuid, stamp))
+
+
+def forget_credentials(username, password):
+    if _cache is not None:
+        _cache.pop(credentials_digest(username, password))
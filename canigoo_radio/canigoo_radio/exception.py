@@ -8,4 +8,11 @@
 
 
 class EventOverlapException(Exception):
-        pass
+
+    def __init__(self, message, conflicts=None):
+        super(EventOverlapException, self).__init__(message)
+        self.conflicts = conflicts or []
+
+
+class LiquidsoapException(Exception):
+    pass
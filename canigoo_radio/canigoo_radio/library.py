@@ -0,0 +1,271 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Shared access to the Beets music library
+
+Each worker keeps one Beets library handle opened for its whole life
+instead of opening SQLite and checking its schema for each request. Its
+connections are read only so searches never take a write lock on a
+database Beets imports into. Search results are cached, keyed by the search
+string and the modification time of the database files, so an import done
+by Beets makes the cached results unreachable at once. The cache is bounded
+by its total number of items, a result larger than the bound is not cached.
+
+Large searches are read by pages of rows ordered by item id, the
+``after`` cursor being the id of the last item of the previous page. Only
+the requested columns are selected. Queries Beets can not express in sql are
+evaluated by Beets, ``iter_items`` then reads its results in a single pass.
+"""
+import os
+import sqlite3
+from heapq import nsmallest
+from threading import Lock
+
+import beets.library
+from anyblok.config import Configuration
+
+try:
+    from beets.dbcore.sort import FixedFieldSort
+except ImportError:  # beets < 2.3
+    from beets.dbcore.query import FixedFieldSort
+
+from .cache import LRUCache
+from .metrics import LIBRARY_CACHE, LIBRARY_SECONDS, timed
+
+
+class ReadOnlyLibrary(beets.library.Library):
+    """ A Beets library whose connections are opened with ``query_only``
+    once its schema is set up
+    """
+
+    read_only = False
+
+    def _create_connection(self):
+        conn = super(ReadOnlyLibrary, self)._create_connection()
+        if self.read_only:
+            conn.execute('PRAGMA query_only = ON')
+
+        return conn
+
+    def set_read_only(self):
+        self.read_only = True
+        # connections opened while setting up the schema are writable
+        self._close()
+
+
+def check_fields(fields):
+    """ Returns the item columns ``fields`` with ``id`` first, raise
+    ValueError for an unknown column
+    """
+    if not fields:
+        return None
+
+    unknown = [field for field in fields
+               if field not in beets.library.Item._fields]
+    if unknown:
+        raise ValueError("Unknown item fields %s" % ', '.join(unknown))
+
+    return ['id'] + [field for field in fields if field != 'id']
+
+
+def parse_query(query):
+    beets_query, _ = beets.library.parse_query_string(
+        query, beets.library.Item)
+    return beets_query
+
+
+def project(items, fields=None):
+    """ Yield the ``fields`` of the Beets ``items`` as dicts
+    """
+    fields = fields or list(beets.library.Item._fields)
+    for item in items:
+        yield {field: item.get(field) for field in fields}
+
+
+def count_items(value):
+    """ Returns the number of items of a cached search result or page
+    """
+    return len(value[0] if isinstance(value, tuple) else value)
+
+
+class BeetsLibrary:
+    """ A persistent library handle with a cache of search results
+    """
+
+    page_size = 500
+
+    def __init__(self, path, cache_size=256, cache_items=20000):
+        self.path = os.path.expanduser(path)
+        self.cache = LRUCache(
+            maxsize=cache_size, maxweight=cache_items,
+            weigh=count_items) if cache_size else None
+        self._library = None
+        self._lock = Lock()
+
+    @property
+    def library(self):
+        if self._library is None:
+            with self._lock:
+                if self._library is None:
+                    library = ReadOnlyLibrary(self.path)
+                    library.set_read_only()
+                    self._library = library
+
+        return self._library
+
+    def modification_key(self):
+        """ Returns the modification times of the database and its write
+        ahead log, any committed write changes one of them
+        """
+        key = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                key.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                key.append(None)
+
+        return tuple(key)
+
+    @timed(LIBRARY_SECONDS, 'search')
+    def search(self, query):
+        """ Returns the items matching the Beets ``query`` as a list of dict
+        """
+        if self.cache is None:
+            return self._search(query)
+
+        key = (query, self.modification_key())
+        items = self.cache.get(key)
+        if items is None:
+            LIBRARY_CACHE.inc('search', 'miss')
+            items = self._search(query)
+            self.cache.set(key, items)
+        else:
+            LIBRARY_CACHE.inc('search', 'hit')
+
+        return items
+
+    def _search(self, query):
+        return [dict(row) for row in self.library.items(query).rows]
+
+    @timed(LIBRARY_SECONDS, 'page')
+    def page(self, query, fields=None, after=None, limit=100):
+        """ Returns ``(items, next)``, at most ``limit`` items matching
+        ``query`` with an id greater than ``after`` and the cursor of the
+        next page or None
+        """
+        fields = check_fields(fields)
+        if self.cache is None:
+            return self._page(query, fields, after, limit)
+
+        key = (query, tuple(fields or ()), after, limit,
+               self.modification_key())
+        page = self.cache.get(key)
+        if page is None:
+            LIBRARY_CACHE.inc('page', 'miss')
+            page = self._page(query, fields, after, limit)
+            self.cache.set(key, page)
+        else:
+            LIBRARY_CACHE.inc('page', 'hit')
+
+        return page
+
+    def _page(self, query, fields, after, limit):
+        items = self.select(query, fields, after, limit + 1)
+        if len(items) > limit:
+            return items[:limit], items[limit - 1]['id']
+
+        return items, None
+
+    def iter_items(self, query, fields=None):
+        """ Yield every item matching ``query`` ordered by id, a page at a
+        time when the query is expressed in sql, in a single pass over the
+        Beets results otherwise
+        """
+        fields = check_fields(fields)
+        beets_query = parse_query(query)
+        after = None
+        while True:
+            items = self.select_sql(beets_query, fields, after, self.page_size)
+            if items is None:
+                yield from project(self.library.items(
+                    beets_query, FixedFieldSort('id')), fields)
+                return
+
+            yield from items
+            if len(items) < self.page_size:
+                return
+
+            after = items[-1]['id']
+
+    @timed(LIBRARY_SECONDS, 'select')
+    def select(self, query, fields=None, after=None, limit=None):
+        """ Returns the ``fields`` columns of the items matching ``query``
+        ordered by id
+
+        The Beets query is turned into a sql clause over the items table.
+        Queries Beets can not express in sql (flexible attributes, album
+        fields) are evaluated by Beets and filtered in python.
+        """
+        beets_query = parse_query(query)
+        items = self.select_sql(beets_query, fields, after, limit)
+        if items is not None:
+            return items
+
+        items = (item for item in self.library.items(beets_query)
+                 if after is None or item.id > after)
+        if limit is not None:
+            items = nsmallest(limit, items, key=lambda item: item.id)
+        else:
+            items = sorted(items, key=lambda item: item.id)
+
+        return list(project(items, fields))
+
+    def select_sql(self, beets_query, fields=None, after=None, limit=None):
+        """ Returns the items of ``select`` read by a sql query, None when
+        ``beets_query`` can not be expressed in sql
+        """
+        where, subvals = beets_query.clause()
+        if where is None:
+            return None
+
+        sql = 'SELECT %s FROM items WHERE (%s)' % (
+            ', '.join('items.%s' % field for field in fields)
+            if fields else 'items.*', where)
+        if after is not None:
+            sql += ' AND items.id > ?'
+            subvals = list(subvals) + [after]
+
+        sql += ' ORDER BY items.id'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+
+        try:
+            with self.library.transaction() as tx:
+                return [dict(row) for row in tx.query(sql, subvals)]
+        except sqlite3.OperationalError:
+            # the clause needs the albums table
+            return None
+
+
+_libraries = {}
+
+
+def get_beets_library(path=None):
+    """ Returns the Beets library of the current worker for ``path``,
+    default to the ``beets_db_path`` configuration
+    """
+    if path is None:
+        path = Configuration.get('beets_db_path', '~/canigoo.db')
+
+    key = (os.getpid(), path)
+    library = _libraries.get(key)
+    if library is None:
+        library = _libraries.setdefault(key, BeetsLibrary(
+            path, cache_size=Configuration.get('beets_cache_size', 256),
+            cache_items=Configuration.get('beets_cache_items', 20000)))
+
+    return library
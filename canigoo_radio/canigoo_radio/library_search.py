@@ -0,0 +1,201 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Full text search index of the Beets library
+
+The artist, album, title and genre of the library items are indexed in a
+SQLite FTS5 table stored in a sidecar database next to the Beets one. Beets
+never sees it, the index follows the library by comparing both tables each
+time the modification time of the Beets database changes: only the added,
+changed and removed items are written.
+"""
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+import beets.library
+from anyblok.config import Configuration
+
+from .metrics import LIBRARY_SECONDS, timed
+
+
+SEARCH_COLUMNS = ('artist', 'album', 'title', 'genre')
+
+# bm25 weight of each search column
+SEARCH_WEIGHTS = (4.0, 2.0, 4.0, 1.0)
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# shorter prefixes match most of the library and are not indexed
+MIN_PREFIX = 2
+
+
+def item_columns():
+    """ Returns the items table columns of the search columns, the genre
+    column is ``genres`` since beets 2
+    """
+    fields = beets.library.Item._fields
+    return tuple('genres' if column == 'genre' and 'genre' not in fields
+                 else column for column in SEARCH_COLUMNS)
+
+
+def match_expression(text):
+    """ Returns the FTS5 query matching the items containing every word of
+    ``text``, the last one as a prefix unless it is shorter than
+    ``MIN_PREFIX``
+    """
+    tokens = TOKEN.findall(text)
+    if tokens and len(tokens[-1]) < MIN_PREFIX:
+        tokens.pop()
+    if not tokens:
+        return None
+
+    terms = ['"%s"' % token for token in tokens]
+    terms[-1] += '*'
+    return ' AND '.join(terms)
+
+
+class SearchIndex:
+    """ FTS5 index of the library ``library_path`` stored in ``path``
+    """
+
+    def __init__(self, library_path, path=None):
+        self.library_path = os.path.expanduser(library_path)
+        self.path = os.path.expanduser(path or self.library_path + '.fts')
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._synced_key = None
+
+    def connection(self):
+        """ Returns the connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tracks USING fts5("
+                "%s, tokenize = 'unicode61 remove_diacritics 2', "
+                "prefix = '2 3')" % ', '.join(SEARCH_COLUMNS))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "key TEXT PRIMARY KEY, value TEXT)")
+            self._local.conn = conn
+
+        return conn
+
+    def library_key(self):
+        """ Returns the modification times of the Beets database and of its
+        write ahead log
+        """
+        key = []
+        for path in (self.library_path, self.library_path + '-wal'):
+            try:
+                key.append(str(os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                key.append('')
+
+        return ':'.join(key)
+
+    def sync(self, wait=True):
+        """ Apply the changes of the library to the index if its database
+        was modified since the last synchronisation
+
+        Without ``wait`` the call returns at once when another thread is
+        already synchronising. Returns the number of written rows.
+        """
+        key = self.library_key()
+        if key == self._synced_key:
+            return 0
+
+        if not self._sync_lock.acquire(blocking=wait):
+            return 0
+
+        try:
+            return self._sync(key)
+        finally:
+            self._sync_lock.release()
+
+    def _sync(self, key):
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'library'").fetchone()
+        if row and row[0] == key:
+            # synchronised by another worker
+            self._synced_key = key
+            return 0
+
+        columns = item_columns()
+        conn.execute('ATTACH DATABASE ? AS library',
+                     (Path(self.library_path).resolve().as_uri() +
+                      '?mode=ro',))
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute(
+                'DELETE FROM tracks WHERE rowid NOT IN '
+                '(SELECT id FROM library.items)').rowcount
+            changed = conn.execute(
+                'INSERT OR REPLACE INTO tracks (rowid, {columns}) '
+                'SELECT i.id, {values} FROM library.items i '
+                'WHERE NOT EXISTS (SELECT 1 FROM tracks t '
+                'WHERE t.rowid = i.id AND {same})'.format(
+                    columns=', '.join(SEARCH_COLUMNS),
+                    values=', '.join('i.%s' % c for c in columns),
+                    same=' AND '.join(
+                        't.%s IS i.%s' % (s, c)
+                        for s, c in zip(SEARCH_COLUMNS, columns)))
+            ).rowcount
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('library', ?)", (key,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.execute('DETACH DATABASE library')
+
+        self._synced_key = key
+        return removed + changed
+
+    @timed(LIBRARY_SECONDS, 'typeahead')
+    def search(self, text, limit=10):
+        """ Returns the best ``limit`` items matching ``text`` as dict with
+        the item ``id`` and the search columns
+        """
+        expression = match_expression(text)
+        if expression is None:
+            return []
+
+        self.sync(wait=self._synced_key is None)
+        cursor = self.connection().execute(
+            'SELECT rowid, {columns} FROM tracks WHERE tracks MATCH ? '
+            'ORDER BY bm25(tracks, {weights}) LIMIT ?'.format(
+                columns=', '.join(SEARCH_COLUMNS),
+                weights=', '.join(str(w) for w in SEARCH_WEIGHTS)),
+            (expression, limit))
+        return [dict(zip(('id',) + SEARCH_COLUMNS, row)) for row in cursor]
+
+
+_indexes = {}
+
+
+def get_search_index():
+    """ Returns the library search index of the current worker
+    """
+    library_path = Configuration.get('beets_db_path', '~/canigoo.db')
+    key = (os.getpid(), library_path)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes.setdefault(key, SearchIndex(
+            library_path, Configuration.get('beets_search_index')))
+
+    return index
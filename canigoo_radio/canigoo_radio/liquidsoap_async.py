@@ -0,0 +1,175 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""asyncio client of the Liquidsoap telnet server
+
+Same contract as ``LiquidsoapClient``: ``send`` and ``send_many`` return
+the parsed replies, or an ``error`` dict when Liquidsoap can not be reached
+or does not answer within the timeout. Every call is bounded by a timeout,
+can be cancelled and waits on a semaphore so at most ``concurrency``
+sessions are opened. It needs python 3.7 or later.
+"""
+import asyncio
+import time
+from logging import getLogger
+
+from anyblok.config import Configuration
+
+from .exception import LiquidsoapException
+from .metrics import record_liquidsoap
+from .liquidsoap_client import (
+    LiquidsoapClient, RECV_SIZE, parse_reply, split_reply)
+
+
+logger = getLogger(__name__)
+
+
+class AsyncLiquidsoapConnection:
+    """ A telnet protocol session on the Liquidsoap unix socket
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.buffer = bytearray()
+        self.reused = False
+
+    @classmethod
+    async def open(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    async def send(self, payload):
+        self.writer.write(payload)
+        await self.writer.drain()
+
+    async def read_reply(self):
+        start = 0
+        while True:
+            found = split_reply(self.buffer, start)
+            if found is not None:
+                reply, offset = found
+                del self.buffer[:offset]
+                return reply
+
+            start = len(self.buffer)
+            chunk = await self.reader.read(RECV_SIZE)
+            if not chunk:
+                raise LiquidsoapException(
+                    "liquidsoap closed the connection")
+
+            self.buffer.extend(chunk)
+
+    def is_alive(self):
+        return not (self.buffer or self.reader.at_eof() or
+                    self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncLiquidsoapClient:
+    """ asyncio counterpart of ``LiquidsoapClient``
+    """
+
+    encode = staticmethod(LiquidsoapClient.encode)
+    parse_metadatas = staticmethod(LiquidsoapClient.parse_metadatas)
+
+    def __init__(self, socket_path=None, timeout=None, concurrency=None):
+        self.path = socket_path or Configuration.get(
+            'liquidsoap_socket', '/tmp/liquidsoap.sock')
+        self.timeout = timeout or Configuration.get('liquidsoap_timeout', 5)
+        self.concurrency = concurrency or Configuration.get(
+            'liquidsoap_pool_size', 2)
+        self._semaphore = None
+        self._idle = []
+
+    @property
+    def semaphore(self):
+        # created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        return self._semaphore
+
+    async def send(self, cmd, timeout=None):
+        return (await self.send_many([cmd], timeout=timeout))[0]
+
+    async def send_many(self, cmds, timeout=None):
+        """ Send all ``cmds`` on the same session and returns their replies
+        in order, the whole exchange must end within ``timeout`` seconds
+        """
+        cmds = [self.encode(cmd) for cmd in cmds]
+        start = time.perf_counter()
+        try:
+            async with self.semaphore:
+                data = await asyncio.wait_for(
+                    self.execute_many(cmds), timeout or self.timeout)
+        except asyncio.TimeoutError as e:
+            record_liquidsoap(cmds, None, time.perf_counter() - start, e)
+            error = dict(error=("liquidsoap timeout", repr(cmds)))
+            logger.warning("socket timeout : {!r}".format(error))
+            return [error for _ in cmds]
+        except (OSError, LiquidsoapException) as e:
+            record_liquidsoap(cmds, None, time.perf_counter() - start, e)
+            error = dict(error=("liquidsoap socket error", str(e)))
+            logger.warning("socket error : {!r}".format(error))
+            return [error for _ in cmds]
+
+        record_liquidsoap(cmds, data, time.perf_counter() - start)
+        return [parse_reply(reply) for reply in data]
+
+    async def acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_alive():
+                conn.reused = True
+                return conn
+
+            conn.close()
+
+        return await AsyncLiquidsoapConnection.open(self.path)
+
+    def release(self, conn):
+        if len(self._idle) < self.concurrency:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    async def execute_many(self, payloads):
+        """ Pipeline ``payloads`` and returns the raw replies, a reused
+        session closed by Liquidsoap is replaced once
+        """
+        conn = await self.acquire()
+        try:
+            try:
+                replies = await self._pipeline(conn, payloads)
+            except (OSError, LiquidsoapException):
+                if not conn.reused:
+                    raise
+
+                conn.close()
+                conn = await AsyncLiquidsoapConnection.open(self.path)
+                replies = await self._pipeline(conn, payloads)
+        except BaseException:
+            # timeout or cancellation included: the session may hold a
+            # partial reply, it can not be reused
+            conn.close()
+            raise
+
+        self.release(conn)
+        return replies
+
+    @staticmethod
+    async def _pipeline(conn, payloads):
+        await conn.send(b"".join(payloads))
+        return [await conn.read_reply() for _ in payloads]
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
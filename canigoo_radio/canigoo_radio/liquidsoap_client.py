@@ -5,52 +5,315 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+import os
 import socket
+import time
+from threading import Lock
 from logging import getLogger
 
+from anyblok.config import Configuration
+
+from .exception import LiquidsoapException
+from .metrics import record_liquidsoap
+
 
 logger = getLogger(__name__)
 
+RECV_SIZE = 65536
+END = b"END\r\n"
+LINE_END = b"\r\n" + END
+
+
+def split_reply(buffer, start=0):
+    """ Look for a complete ``END`` terminated reply in ``buffer``
+
+    Returns a tuple ``(reply, offset)`` where ``offset`` is the start of the
+    next reply, or None if the reply is not complete yet. ``start`` is the
+    offset of the bytes not searched yet.
+    """
+    if buffer[:len(END)] == END:
+        return bytes(), len(END)
+
+    index = buffer.find(LINE_END, max(start - len(LINE_END), 0))
+    if index == -1:
+        return None
+
+    return bytes(buffer[:index]), index + len(LINE_END)
+
+
+def parse_reply(data):
+    """ Turn a raw reply into a dict of ``key : value`` lines, a list of
+    lines or a string
+    """
+    data = str(data, encoding='utf-8', errors='replace').strip()
+    if not data:
+        return dict()
+
+    data_dict = dict()
+    if "\r\n" in data:
+        data = data.split("\r\n")
+        for line in data:
+            if " : " in line:
+                k, v = line.split(" : ", 1)
+                data_dict[k] = v
+    return data_dict or data
+
+
+class LiquidsoapConnection:
+    """ A telnet protocol session on the Liquidsoap unix socket
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+
+        self.buffer = bytearray()
+        self.reused = False
+        self.last_used = time.monotonic()
+
+    def send(self, payload):
+        self.sock.sendall(payload)
+
+    def read_reply(self):
+        """ Read until the ``END`` terminator and returns the reply
+        """
+        start = 0
+        while True:
+            found = split_reply(self.buffer, start)
+            if found is not None:
+                reply, offset = found
+                del self.buffer[:offset]
+                self.last_used = time.monotonic()
+                return reply
+
+            start = len(self.buffer)
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                raise LiquidsoapException(
+                    "liquidsoap closed the connection")
+
+            self.buffer.extend(chunk)
+
+    def is_alive(self):
+        """ Cheap health check, an idle session must have nothing to read
+        """
+        if self.buffer:
+            return False
+
+        # a socket with a timeout waits for data even with MSG_DONTWAIT
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.settimeout(timeout)
+
+        # either EOF or unexpected data, in both case the session is unusable
+        return False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class LiquidsoapConnectionPool:
+    """ Keep a few long lived sessions to Liquidsoap for the worker
+
+    Idle sessions are health checked before being reused and dropped once
+    ``idle_timeout`` is over, as Liquidsoap closes idle telnet sessions on its
+    side. After a failed connection, new attempts are refused until an
+    exponential backoff delay is over so a dead Liquidsoap is not hammered.
+    """
+
+    def __init__(self, path, size=2, timeout=5, idle_timeout=20,
+                 backoff_min=0.5, backoff_max=30):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._idle = []
+        self._lock = Lock()
+        self._failures = 0
+        self._retry_at = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+
+            if conn is None:
+                break
+
+            if (time.monotonic() - conn.last_used < self.idle_timeout and
+                    conn.is_alive()):
+                conn.reused = True
+                return conn
+
+            conn.close()
+
+        return self.connect()
+
+    def connect(self):
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise LiquidsoapException(
+                "liquidsoap unreachable, next attempt in %.1fs" % (
+                    self._retry_at - now))
+
+        try:
+            conn = LiquidsoapConnection(self.path, timeout=self.timeout)
+        except OSError:
+            with self._lock:
+                self._failures += 1
+                delay = min(self.backoff_min * 2 ** (self._failures - 1),
+                            self.backoff_max)
+                self._retry_at = time.monotonic() + delay
+            raise
+
+        with self._lock:
+            self._failures = 0
+            self._retry_at = 0
+
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+
+        conn.close()
+
+    def execute(self, payload):
+        """ Send ``payload`` and returns the raw reply
+        """
+        return self.execute_many([payload])[0]
+
+    def execute_many(self, payloads):
+        """ Pipeline ``payloads`` on one session and returns the raw replies
+        in the same order
+
+        A reused session may have been closed by Liquidsoap since its last
+        health check, in this case the commands are sent again once on a new
+        session.
+        """
+        conn = self.acquire()
+        try:
+            try:
+                replies = self._pipeline(conn, payloads)
+            except socket.timeout:
+                raise
+            except (OSError, LiquidsoapException):
+                if not conn.reused:
+                    raise
+
+                conn.close()
+                conn = self.connect()
+                replies = self._pipeline(conn, payloads)
+        except BaseException:
+            conn.close()
+            raise
+
+        self.release(conn)
+        return replies
+
+    @staticmethod
+    def _pipeline(conn, payloads):
+        conn.send(b"".join(payloads))
+        return [conn.read_reply() for _ in payloads]
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_pool(path=None):
+    """ Returns the connection pool of the current worker for ``path``
+
+    Pools are never shared across a fork, each worker process opens its own
+    sessions.
+    """
+    path = path or Configuration.get(
+        'liquidsoap_socket', '/tmp/liquidsoap.sock')
+    key = (os.getpid(), path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = LiquidsoapConnectionPool(
+                    path,
+                    size=Configuration.get('liquidsoap_pool_size', 2),
+                    timeout=Configuration.get('liquidsoap_timeout', 5),
+                    idle_timeout=Configuration.get(
+                        'liquidsoap_idle_timeout', 20))
+
+    return pool
+
 
 class LiquidsoapClient:
     """ A class to interact with Liquisoap through linux socket
     """
 
+    def __init__(self, socket_path=None, pool=None, debug=None):
+        self.pool = pool or get_pool(socket_path)
+        if debug is None:
+            debug = Configuration.get('liquidsoap_debug', False)
+        self.debug = debug
+
+    @staticmethod
+    def encode(cmd):
+        if not isinstance(cmd, bytes):
+            cmd = str.encode(cmd + "\n")
+        return cmd
+
     def send(self, cmd):
+        return self.send_many([cmd])[0]
 
-        data = None
+    def send_many(self, cmds):
+        """ Send all ``cmds`` at once on the same session and returns their
+        replies in order, it costs one round trip whatever the number of
+        commands
+        """
+        cmds = [self.encode(cmd) for cmd in cmds]
 
+        start = time.perf_counter()
         try:
-            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            sock.connect("/tmp/liquidsoap.sock")
-            if type(cmd) != bytes:
-                cmd = str.encode(cmd + "\n")
-            logger.info("sending : {!r}".format(cmd))
-            sock.sendall(cmd)
-            data = sock.recv(4096)
-            logger.info("received : {!r}".format(data))
-        except:
-            error = dict(error=("liquidsoap socket error", "socket communication failed"))
-            logger.warn("socket error : {!r}".format(error))
-            return error
-        finally:
-            logger.info("closing socket")
-            sock.close()
-            logger.info("socket closed")
-
-        if not data:
-            return dict()
-        else:
-            data = str(
-                data.split(b"\r\nEND")[0], encoding='utf-8').lstrip().rstrip()
-            data_dict = dict()
-            if "\r\n" in data:
-                data = data.split("\r\n")
-                for line in data:
-                    if " : " in line:
-                        k, v = line.split(" : ")
-                        data_dict[k] = v
-            return data_dict or data
+            if self.debug:
+                logger.info("sending : {!r}".format(cmds))
+            data = self.pool.execute_many(cmds)
+            if self.debug:
+                logger.info("received : {!r}".format(data))
+        except (OSError, LiquidsoapException) as e:
+            record_liquidsoap(cmds, None, time.perf_counter() - start, e)
+            error = dict(error=("liquidsoap socket error", str(e)))
+            logger.warning("socket error : {!r}".format(error))
+            return [error for _ in cmds]
+
+        record_liquidsoap(cmds, data, time.perf_counter() - start)
+
+        return [parse_reply(reply) for reply in data]
 
     @staticmethod
     def parse_metadatas(metadatas):
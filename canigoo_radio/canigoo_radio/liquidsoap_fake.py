@@ -0,0 +1,254 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""A stand-in for the Liquidsoap telnet server
+
+``FakeLiquidsoap`` listens on a unix socket and answers the commands used by
+the radio (``version``, ``uptime``, ``list``, ``request.on_air``,
+``request.metadata``, ``icecast.status``) like Liquidsoap does. Its
+failures are configurable to load test the endpoints and reproduce the
+failure modes of the client:
+
+* ``latency`` and ``jitter`` delay every reply,
+* ``metadata_size`` pads the metadata replies up to a few KB,
+* ``chunk_size`` and ``chunk_delay`` split the replies in partial writes,
+* ``drop_rate`` closes the connection in the middle of a reply,
+* ``hang_rate`` never answers and keeps the connection open.
+
+Random draws use ``seed`` so a run can be replayed.
+``canigoo_fake_liquidsoap`` runs it from the command line.
+"""
+import argparse
+import os
+import random
+import socketserver
+import time
+from threading import Event, Lock, Thread
+
+
+END = b"END\r\n"
+
+DEFAULT_METADATA = dict(
+    artist="Canigoo test artist", title="Canigoo test title",
+    album="Canigoo test album", genre="Test", year="2017",
+    filename="/music/canigoo/test.flac", source="request",
+    status="playing", on_air="2017/01/01 00:00:00")
+
+UNKNOWN_COMMAND = ('ERROR: unknown command, type "help" to get a list of '
+                   'commands.')
+
+
+class FakeLiquidsoapHandler(socketserver.StreamRequestHandler):
+    """ A telnet session, one command per line
+    """
+
+    def handle(self):
+        fake = self.server.fake
+        for line in self.rfile:
+            cmd = line.decode('utf-8', 'replace').strip()
+            if not cmd:
+                continue
+
+            if cmd in ('quit', 'exit'):
+                self.wfile.write(b"Bye!\r\n")
+                return
+
+            if not fake.respond(self.wfile, cmd):
+                return
+
+
+class FakeLiquidsoapServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, fake):
+        self.fake = fake
+        super(FakeLiquidsoapServer, self).__init__(
+            fake.path, FakeLiquidsoapHandler)
+
+
+class FakeLiquidsoap:
+    """ The fake telnet server on the unix socket ``path``
+    """
+
+    def __init__(self, path, latency=0, jitter=0, metadata_size=0,
+                 chunk_size=0, chunk_delay=0, drop_rate=0, hang_rate=0,
+                 seed=None, metadata=None, version="1.3.3"):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.metadata_size = metadata_size
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.drop_rate = drop_rate
+        self.hang_rate = hang_rate
+        self.metadata = dict(metadata or DEFAULT_METADATA)
+        self.version = version
+        self.rid = 1
+        self.started_at = time.monotonic()
+        self.commands = 0
+        self.dropped = 0
+        self.hung = 0
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._stopped = Event()
+        self._server = None
+        self._thread = None
+
+    def uptime(self):
+        seconds = int(time.monotonic() - self.started_at)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        return "%dd %02dh %02dm %02ds" % (days, hours, minutes, seconds)
+
+    def metadata_reply(self):
+        metadata = dict(self.metadata)
+        lines = ['%s="%s"' % item for item in sorted(metadata.items())]
+        padding = self.metadata_size - sum(len(line) + 1 for line in lines)
+        if padding > 0:
+            lines.append('comment="%s"' % ('x' * padding))
+
+        return "\n".join(lines)
+
+    def reply(self, cmd):
+        """ Returns the reply of the command line ``cmd`` without the
+        ``END`` terminator
+        """
+        name, _, arg = cmd.partition(' ')
+        if name == 'version':
+            return "Liquidsoap %s" % self.version
+        if name == 'uptime':
+            return self.uptime()
+        if name == 'list':
+            return "icecast : output.icecast\r\nrequest : request.queue"
+        if name == 'icecast.status':
+            return "on"
+        if name == 'request.on_air':
+            return str(self.rid)
+        if name == 'request.metadata':
+            if arg.strip() != str(self.rid):
+                return "No such request."
+            return self.metadata_reply()
+        if name == 'help':
+            return "\r\n".join([
+                "Available commands:", "| exit", "| help", "| icecast.status",
+                "| list", "| quit", "| request.metadata <rid>",
+                "| request.on_air", "| uptime", "| version"])
+
+        return UNKNOWN_COMMAND
+
+    def respond(self, wfile, cmd):
+        """ Write the reply of ``cmd`` with the configured failures, returns
+        False when the connection must be closed
+        """
+        with self._lock:
+            self.commands += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+
+        reply = self.reply(cmd).encode('utf-8')
+        payload = reply + b"\r\n" + END if reply else END
+        if roll < self.hang_rate:
+            with self._lock:
+                self.hung += 1
+            self._stopped.wait()
+            return False
+
+        if roll < self.hang_rate + self.drop_rate:
+            with self._lock:
+                self.dropped += 1
+            wfile.write(payload[:len(payload) // 2])
+            return False
+
+        if not self.chunk_size:
+            wfile.write(payload)
+            return True
+
+        for i in range(0, len(payload), self.chunk_size):
+            wfile.write(payload[i:i + self.chunk_size])
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+
+        return True
+
+    def start(self):
+        """ Serve in a daemon thread
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._stopped.clear()
+        self._server = FakeLiquidsoapServer(self)
+        self._thread = Thread(target=self._server.serve_forever,
+                              kwargs=dict(poll_interval=0.05), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread.join()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def run_fake_liquidsoap(argv=None):
+    """ Run a fake Liquidsoap telnet server until interrupted
+    """
+    parser = argparse.ArgumentParser(description=run_fake_liquidsoap.__doc__)
+    parser.add_argument('--socket', default='/tmp/liquidsoap.sock',
+                        help="Path of the unix socket")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Seconds before each reply")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="Random extra seconds before each reply")
+    parser.add_argument('--metadata-size', type=int, default=0,
+                        help="Bytes of the request.metadata replies")
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help="Bytes of each partial write, 0 writes the "
+                             "replies at once")
+    parser.add_argument('--chunk-delay', type=float, default=0,
+                        help="Seconds between two partial writes")
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help="Share of the replies truncated by a closed "
+                             "connection")
+    parser.add_argument('--hang-rate', type=float, default=0,
+                        help="Share of the commands never answered")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed of the random draws")
+    args = parser.parse_args(argv)
+    fake = FakeLiquidsoap(
+        args.socket, latency=args.latency, jitter=args.jitter,
+        metadata_size=args.metadata_size, chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay, drop_rate=args.drop_rate,
+        hang_rate=args.hang_rate, seed=args.seed)
+    fake.start()
+    print("fake liquidsoap listening on %s" % args.socket)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+        print("%d commands, %d dropped, %d hung" % (
+            fake.commands, fake.dropped, fake.hung))
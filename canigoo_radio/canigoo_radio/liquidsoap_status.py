@@ -0,0 +1,178 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Shared snapshot of the Liquidsoap status
+
+Http views read the status of Liquidsoap from a snapshot refreshed at most
+every ``liquidsoap_status_ttl`` seconds instead of querying the telnet
+server for each request. Concurrent requests hitting an outdated snapshot
+wait for a single refresh, and a background thread of each worker keeps the
+snapshot warm every ``liquidsoap_status_poll_interval`` seconds.
+"""
+import os
+import time
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+from anyblok.config import Configuration
+
+from .liquidsoap_client import LiquidsoapClient
+
+
+logger = getLogger(__name__)
+
+STATUS_COMMANDS = ["icecast.status", "version", "uptime", "list",
+                   "request.on_air"]
+
+
+def fetch_status(client):
+    """ Query Liquidsoap and returns a status snapshot dict
+    """
+    icecast_status, version, uptime, operators, current = client.send_many(
+        STATUS_COMMANDS)
+    replies = [icecast_status, version, uptime, operators, current]
+    on_air = dict()
+    if isinstance(current, str):
+        meta = client.send('request.metadata %s' % current)
+        replies.append(meta)
+        if isinstance(meta, list):
+            meta = "\n".join(meta)
+        if meta and isinstance(meta, str):
+            on_air = client.parse_metadatas(meta)
+
+    error = any(isinstance(reply, dict) and "error" in reply
+                for reply in replies)
+    return dict(version=version,
+                icecast_status=icecast_status,
+                uptime=uptime,
+                operators=operators,
+                on_air=on_air,
+                error=error)
+
+
+class LiquidsoapStatus:
+    """ A status snapshot with single flight refresh
+    """
+
+    def __init__(self, ttl=2, client_factory=LiquidsoapClient,
+                 timer=time.monotonic):
+        self.ttl = ttl
+        self.client_factory = client_factory
+        self.timer = timer
+        self._snapshot = None
+        self._fetched_at = None
+        self._inflight = None
+        self._lock = Lock()
+        self._poller = None
+        self._stop = Event()
+        self.listeners = []
+
+    def get(self, max_age=None):
+        """ Returns a tuple ``(snapshot, age)``, the snapshot is refreshed
+        if it is older than ``max_age`` (default to the ttl)
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if (self._snapshot is not None and
+                    self.timer() - self._fetched_at <= max_age):
+                return self._snapshot, self.timer() - self._fetched_at
+
+            inflight = self._inflight
+            if inflight is None:
+                inflight = self._inflight = Event()
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            self._refresh(inflight)
+        else:
+            inflight.wait()
+
+        with self._lock:
+            return self._snapshot, self.timer() - self._fetched_at
+
+    def add_listener(self, callback):
+        """ Call ``callback(snapshot)`` after each refresh, from the thread
+        doing it, so it must not block
+        """
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def refresh(self):
+        """ Force a refresh unless one is already running
+        """
+        with self._lock:
+            if self._inflight is not None:
+                return
+
+            inflight = self._inflight = Event()
+
+        self._refresh(inflight)
+
+    def _refresh(self, inflight):
+        try:
+            snapshot = fetch_status(self.client_factory())
+        except Exception:
+            logger.exception("liquidsoap status refresh failed")
+            snapshot = dict(version=None, icecast_status=None, uptime=None,
+                            operators=None, on_air=dict(), error=True)
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._fetched_at = self.timer()
+            self._inflight = None
+
+        inflight.set()
+        for callback in list(self.listeners):
+            try:
+                callback(snapshot)
+            except Exception:
+                logger.exception("liquidsoap status listener failed")
+
+    def start_poller(self, interval):
+        """ Refresh the snapshot every ``interval`` seconds in a daemon
+        thread
+        """
+        if self._poller is not None:
+            return
+
+        def poll():
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._poller = Thread(target=poll, name="liquidsoap-status",
+                              daemon=True)
+        self._poller.start()
+
+    def stop_poller(self):
+        self._stop.set()
+
+
+_status = None
+_status_pid = None
+_status_lock = Lock()
+
+
+def get_liquidsoap_status():
+    """ Returns the status snapshot of the current worker, its poller is
+    started on first use so it never runs in a gunicorn master
+    """
+    global _status, _status_pid
+    if _status is None or _status_pid != os.getpid():
+        with _status_lock:
+            if _status is None or _status_pid != os.getpid():
+                status = LiquidsoapStatus(
+                    ttl=Configuration.get('liquidsoap_status_ttl', 2))
+                interval = Configuration.get(
+                    'liquidsoap_status_poll_interval', 1)
+                if interval:
+                    status.start_poller(interval)
+
+                _status, _status_pid = status, os.getpid()
+
+    return _status
@@ -0,0 +1,410 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Listener counts history
+
+The ``icecast.status`` command of Liquidsoap only tells if the output is
+connected, the number of listeners is read from the ``status-json.xsl``
+page of the Icecast server every minute by the sampler of
+``canigoo_playout``.
+
+Samples are stored in ``listeners_dir``, one set of files per year, all of
+them created at their full size and memory mapped:
+
+* ``YYYY.minutes``, the listeners of each minute of the year as int32,
+  -1 when the minute was not sampled,
+* ``YYYY.hours`` and ``YYYY.days``, the sum, number and maximum of the
+  samples of each hour and day, updated with each sample.
+
+Minutes, hours, days and years are indexed in UTC so that the hours
+repeated or skipped by the daylight saving changes are sampled like the
+others. Naive datetimes are local time, the series are returned in local
+time.
+
+A year of minutes is 2MB, a sample writes one slot of each file in place.
+The api reads the same files, the statistics of the events of a window are
+computed by numpy with cumulative sums over the minutes of the window: a
+year long query reads a few MB and no database table of samples.
+"""
+import json
+import os
+import time
+from calendar import isleap
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from threading import Event, Lock, Thread
+from urllib.request import urlopen
+
+import numpy as np
+from anyblok.config import Configuration
+
+from .metrics import LISTENERS_SAMPLES
+
+
+logger = getLogger(__name__)
+
+MISSING = -1
+
+MINUTE_DTYPE = np.dtype('<i4')
+
+ROLLUP_DTYPE = np.dtype([('sum', '<i8'), ('count', '<i4'), ('max', '<i4')])
+
+# resolution name: (file suffix, minutes per slot)
+RESOLUTIONS = dict(minute=('minutes', 1), hour=('hours', 60),
+                   day=('days', 1440))
+
+
+def year_days(year):
+    return 366 if isleap(year) else 365
+
+
+def year_start(year):
+    """ Returns the start of the UTC ``year`` as a naive UTC datetime
+    """
+    return datetime(year, 1, 1)
+
+
+def utc_time(value):
+    """ Returns ``value`` as a naive UTC datetime, a naive ``value`` being
+    local time
+    """
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def minute_of_year(at):
+    return int((at - year_start(at.year)).total_seconds() // 60)
+
+
+def icecast_listeners(url, mount=None, timeout=5):
+    """ Returns the listeners of the sources of the Icecast status page
+    ``url``, of the source of ``mount`` only when given
+    """
+    with urlopen(url, timeout=timeout) as response:
+        icestats = json.loads(response.read().decode('utf-8'))['icestats']
+
+    sources = icestats.get('source') or []
+    if isinstance(sources, dict):
+        sources = [sources]
+
+    return sum(int(source.get('listeners') or 0) for source in sources
+               if not mount or
+               (source.get('listenurl') or '').endswith(mount))
+
+
+class ListenerStats:
+    """ The listener counts files of ``directory``, opened read only unless
+    ``writable``
+    """
+
+    def __init__(self, directory, writable=False):
+        self.directory = os.path.expanduser(directory)
+        self.writable = writable
+        self.years = {}
+        self._lock = Lock()
+
+    def path(self, year, suffix):
+        return os.path.join(self.directory, '%04d.%s' % (year, suffix))
+
+    def create(self, year):
+        """ Create the files of ``year``, each one written aside and renamed
+        so that readers never see a partial file
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        days = year_days(year)
+        for suffix, empty in (
+                ('minutes', np.full(days * 1440, MISSING, MINUTE_DTYPE)),
+                ('hours', np.zeros(days * 24, ROLLUP_DTYPE)),
+                ('days', np.zeros(days, ROLLUP_DTYPE))):
+            path = self.path(year, suffix)
+            if os.path.exists(path):
+                continue
+
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            empty.tofile(tmp)
+            os.replace(tmp, path)
+
+    def open(self, year):
+        """ Returns the ``(minutes, hours, days)`` arrays of ``year``, None
+        when a read only year was not sampled yet
+        """
+        arrays = self.years.get(year)
+        if arrays is not None:
+            return arrays
+
+        with self._lock:
+            arrays = self.years.get(year)
+            if arrays is not None:
+                return arrays
+
+            if self.writable:
+                self.create(year)
+            elif not os.path.exists(self.path(year, 'days')):
+                return None
+
+            mode = 'r+' if self.writable else 'r'
+            arrays = self.years[year] = tuple(
+                np.memmap(self.path(year, suffix), dtype=dtype, mode=mode)
+                for suffix, dtype in (('minutes', MINUTE_DTYPE),
+                                      ('hours', ROLLUP_DTYPE),
+                                      ('days', ROLLUP_DTYPE)))
+
+        return arrays
+
+    def record(self, at, listeners):
+        """ Store ``listeners`` as the sample of the minute of ``at`` and
+        update its hour and day, a new sample of the minute replaces the
+        previous one
+        """
+        at = utc_time(at)
+        minutes, hours, days = self.open(at.year)
+        minute = minute_of_year(at)
+        previous = int(minutes[minute])
+        minutes[minute] = listeners
+        for rollup, index in ((hours, minute // 60), (days, minute // 1440)):
+            if previous == MISSING:
+                rollup['sum'][index] += listeners
+                rollup['count'][index] += 1
+            else:
+                rollup['sum'][index] += listeners - previous
+
+            if listeners > rollup['max'][index]:
+                rollup['max'][index] = listeners
+
+        for array in (minutes, hours, days):
+            array.flush()
+
+    def read(self, start, end, resolution='minute'):
+        """ Returns the array of the slots of ``resolution`` from the one of
+        ``start`` to the one of ``end`` excluded, the years not sampled are
+        filled with missing values
+        """
+        return self._read(utc_time(start), utc_time(end), resolution)
+
+    def _read(self, start, end, resolution='minute'):
+        suffix, size = RESOLUTIONS[resolution]
+        index = ('minutes', 'hours', 'days').index(suffix)
+        dtype = MINUTE_DTYPE if suffix == 'minutes' else ROLLUP_DTYPE
+        parts = []
+        for year in range(start.year, end.year + 1):
+            first = max(start, year_start(year))
+            last = min(end, year_start(year + 1))
+            i0 = minute_of_year(first) // size
+            i1 = -(-int((last - year_start(year)).total_seconds() // 60)
+                   // size)
+            if i1 <= i0:
+                continue
+
+            arrays = self.open(year)
+            if arrays is not None:
+                parts.append(arrays[index][i0:i1])
+            elif dtype == MINUTE_DTYPE:
+                parts.append(np.full(i1 - i0, MISSING, dtype))
+            else:
+                parts.append(np.zeros(i1 - i0, dtype))
+
+        if not parts:
+            return np.empty(0, dtype)
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def series(self, start, end, resolution='hour'):
+        """ Returns the listeners from ``start`` to ``end`` by
+        ``resolution``: the start of the first slot as an aware local
+        datetime, the slot seconds and the lists of the mean and maximum of
+        each slot, None when not sampled. Days are UTC days.
+        """
+        start, end = utc_time(start), utc_time(end)
+        _, size = RESOLUTIONS[resolution]
+        values = self._read(start, end, resolution)
+        if resolution == 'minute':
+            sampled = values != MISSING
+            mean = maximum = values
+        else:
+            sampled = values['count'] > 0
+            mean = np.round(
+                values['sum'] / np.maximum(values['count'], 1), 2)
+            maximum = values['max']
+
+        first = year_start(start.year) + timedelta(
+            minutes=minute_of_year(start) // size * size)
+        sampled = sampled.tolist()
+        return dict(
+            start=first.replace(tzinfo=timezone.utc).astimezone(),
+            step=size * 60,
+            mean=[value if ok else None
+                  for value, ok in zip(mean.tolist(), sampled)],
+            max=[value if ok else None
+                 for value, ok in zip(maximum.tolist(), sampled)])
+
+    def audience(self, intervals):
+        """ Returns the arrays of the sum, number and maximum of the minute
+        samples of each ``(start, end)`` of ``intervals``, the maximum is
+        -1 when no minute was sampled
+        """
+        if not len(intervals):
+            empty = np.zeros(0, np.int64)
+            return empty, empty, empty
+
+        intervals = [(utc_time(start), utc_time(end))
+                     for start, end in intervals]
+        origin = min(start for start, _ in intervals)
+        origin = origin.replace(second=0, microsecond=0)
+        end = max(end for _, end in intervals)
+        values = self._read(origin, end)
+        offsets = np.array(
+            [((start - origin).total_seconds(), (end - origin).total_seconds())
+             for start, end in intervals]) // 60
+        starts = np.clip(offsets[:, 0].astype(np.int64), 0, len(values))
+        ends = np.clip(offsets[:, 1].astype(np.int64), starts, len(values))
+
+        sampled = values != MISSING
+        sums = np.concatenate(
+            ([0], np.cumsum(np.where(sampled, values, 0), dtype=np.int64)))
+        counts = np.concatenate(
+            ([0], np.cumsum(sampled, dtype=np.int64)))
+
+        # the maximum of the segments [start, end) are the even results of a
+        # reduceat over the start and end indices, a trailing missing value
+        # keeps the end indices in bounds
+        bounds = np.empty(2 * len(starts), np.int64)
+        bounds[0::2] = starts
+        bounds[1::2] = ends
+        padded = np.append(values, np.array([MISSING], MINUTE_DTYPE))
+        maxima = np.maximum.reduceat(padded, bounds)[0::2].astype(np.int64)
+        maxima[ends <= starts] = MISSING
+
+        return sums[ends] - sums[starts], counts[ends] - counts[starts], maxima
+
+
+def audience_stats(stats, rows, group='event'):
+    """ Returns the audience of the timeline ``rows`` (see
+    ``Model.Event.timeline``) by ``event`` or by ``show``
+    """
+    sums, counts, maxima = stats.audience([(row[2], row[3]) for row in rows])
+    if group == 'show':
+        keys = []
+        index = {}
+        for row in rows:
+            if row[4] is not None and row[4] not in index:
+                index[row[4]] = len(keys)
+                keys.append((row[4], row[5]))
+
+        shows = np.array([index.get(row[4], -1) for row in rows], np.int64)
+        kept = shows >= 0
+        shows = shows[kept]
+        sums = np.bincount(shows, weights=sums[kept], minlength=len(keys))
+        counts = np.bincount(shows, weights=counts[kept], minlength=len(keys))
+        events = np.bincount(shows, minlength=len(keys))
+        grouped = np.full(len(keys), MISSING, np.int64)
+        np.maximum.at(grouped, shows, maxima[kept])
+        maxima = grouped
+    else:
+        keys = [(row[0], row[1]) for row in rows]
+        events = np.ones(len(keys), np.int64)
+
+    means = np.round(sums / np.maximum(counts, 1), 2)
+    return [dict(uuid=key[0], name=key[1], events=int(nb),
+                 mean=float(mean) if count else None,
+                 max=int(maximum) if maximum != MISSING else None,
+                 listener_minutes=int(total), sampled_minutes=int(count))
+            for key, nb, mean, maximum, total, count in zip(
+                keys, events, means, maxima, sums, counts)]
+
+
+class ListenerSampler:
+    """ Record the listeners returned by ``fetch()`` in ``stats`` every
+    ``interval`` seconds
+    """
+
+    def __init__(self, stats, fetch, interval=60, now=utc_now):
+        self.stats = stats
+        self.fetch = fetch
+        self.interval = interval
+        self.now = now
+        self.failing = False
+        self._stop = Event()
+        self._thread = None
+
+    def sample(self):
+        """ Record the listeners of now, returns their number or None when
+        Icecast did not answer
+        """
+        at = self.now()
+        try:
+            listeners = self.fetch()
+        except Exception as e:
+            LISTENERS_SAMPLES.inc('error')
+            if not self.failing:
+                logger.warning("listeners not sampled: %s", e)
+            self.failing = True
+            return None
+
+        self.failing = False
+        self.stats.record(at, listeners)
+        LISTENERS_SAMPLES.inc('ok')
+        return listeners
+
+    def start(self):
+        """ Sample in a daemon thread, at the start of the intervals
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(
+                    self.interval - time.time() % self.interval):
+                self.sample()
+
+        self._thread = Thread(target=run, name="listener-sampler",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def get_listener_sampler():
+    """ Returns the listener sampler configured by the canigoo-listeners
+    options, None when no Icecast status url is set
+    """
+    url = Configuration.get('icecast_status_url')
+    if not url:
+        return None
+
+    stats = ListenerStats(
+        Configuration.get('listeners_dir', '~/canigoo-listeners'),
+        writable=True)
+    mount = Configuration.get('icecast_mount')
+    return ListenerSampler(
+        stats, lambda: icecast_listeners(url, mount),
+        interval=Configuration.get('listeners_sample_interval', 60))
+
+
+_stats = {}
+_stats_lock = Lock()
+
+
+def get_listener_stats():
+    """ Returns the read only listener counts of the current worker
+    """
+    key = os.getpid()
+    stats = _stats.get(key)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.get(key)
+            if stats is None:
+                stats = _stats[key] = ListenerStats(
+                    Configuration.get('listeners_dir', '~/canigoo-listeners'))
+
+    return stats
@@ -0,0 +1,300 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Counters and latency histograms exposed in the Prometheus text format
+
+Recording a value costs a lock and a bisection, cheap enough to stay on for
+every Liquidsoap command, schedule lookup and library search. Values are
+kept per worker process, every worker answers ``/metrics`` with its own
+labelled by its ``pid``: each worker is a series of its own and a scrape
+hitting another worker is not seen as a counter reset, ``sum without
+(pid)`` aggregates the workers.
+"""
+import asyncio
+import socket
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+
+from .exception import LiquidsoapException
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value))
+                             for name, value in zip(names, values))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ A named metric with one value per set of label values
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def check_labels(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s expects the labels %r, got %r" % (
+                self.name, self.labelnames, labels))
+
+        return tuple(labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """ Yield ``(name, labels, value)`` tuples, labels are a tuple of
+        ``(name, value)``
+        """
+        raise NotImplementedError
+
+    def expose(self, labels=()):
+        """ Returns the metric in the Prometheus text format, ``labels``
+        are ``(name, value)`` added to every sample
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for name, sample_labels, value in self.samples():
+            sample_labels = tuple(labels) + sample_labels
+            lines.append('%s%s %s' % (
+                name, format_labels([label[0] for label in sample_labels],
+                                    [label[1] for label in sample_labels]),
+                format_value(value)))
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """ A value which only goes up
+    """
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        labels = self.check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(tuple(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for labels, value in values:
+            yield self.name, tuple(zip(self.labelnames, labels)), value
+
+
+class Histogram(Metric):
+    """ Observations counted in cumulative ``buckets`` with their sum
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        labels = self.check_labels(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # one count per bucket and one for +Inf, then the sum
+                state = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+
+            state[0][i] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """ Observe the seconds spent in the ``with`` block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def get_count(self, *labels):
+        state = self._values.get(tuple(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(state[0]), state[1]))
+                            for labels, state in self._values.items())
+
+        bounds = self.buckets + (float('inf'),)
+        for labels, (counts, total) in values:
+            labels = tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       labels + (('le', format_value(bound)),), cumulative)
+
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """ The metrics of the process, in declaration order
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def expose(self, labels=()):
+        """ Returns the metrics in the Prometheus text format
+        """
+        return ''.join(metric.expose(labels) + '\n'
+                       for metric in self.metrics)
+
+
+REGISTRY = MetricsRegistry()
+
+LIQUIDSOAP_SECONDS = REGISTRY.histogram(
+    'canigoo_liquidsoap_command_seconds',
+    "Round trip of the Liquidsoap commands", ('command',))
+LIQUIDSOAP_BYTES_SENT = REGISTRY.counter(
+    'canigoo_liquidsoap_sent_bytes_total',
+    "Bytes sent to Liquidsoap", ('command',))
+LIQUIDSOAP_BYTES_RECEIVED = REGISTRY.counter(
+    'canigoo_liquidsoap_received_bytes_total',
+    "Bytes of the replies received from Liquidsoap", ('command',))
+LIQUIDSOAP_FAILURES = REGISTRY.counter(
+    'canigoo_liquidsoap_failures_total',
+    "Liquidsoap commands answered by an error", ('command', 'cause'))
+SCHEDULE_SECONDS = REGISTRY.histogram(
+    'canigoo_schedule_lookup_seconds',
+    "Duration of the current, next and previous event lookups",
+    ('lookup',))
+LIBRARY_SECONDS = REGISTRY.histogram(
+    'canigoo_library_lookup_seconds',
+    "Duration of the Beets library lookups", ('operation',))
+LIBRARY_CACHE = REGISTRY.counter(
+    'canigoo_library_cache_requests_total',
+    "Beets library lookups answered from cache or not",
+    ('operation', 'result'))
+PLAYOUT_LATENESS = REGISTRY.histogram(
+    'canigoo_playout_lateness_seconds',
+    "Delay between the scheduled time of a playout transition and its "
+    "dispatch to Liquidsoap", ('transition',))
+PLAYOUT_TRANSITIONS = REGISTRY.counter(
+    'canigoo_playout_transitions_total',
+    "Playout transitions sent to Liquidsoap", ('transition', 'result'))
+PLAYLOG_ROWS = REGISTRY.counter(
+    'canigoo_playlog_rows_total',
+    "Play log rows written, failed to be written and dropped",
+    ('result',))
+LISTENERS_SAMPLES = REGISTRY.counter(
+    'canigoo_listeners_samples_total',
+    "Samples of the Icecast listeners", ('result',))
+
+
+def timed(histogram, *labels):
+    """ Decorator observing the duration of the calls in ``histogram``
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+def command_name(payloads):
+    """ Returns the metric label of a pipeline of encoded commands, the
+    name of the command without its arguments
+    """
+    if len(payloads) != 1:
+        return 'pipeline'
+
+    name = payloads[0].split(None, 1)
+    return name[0].decode('utf-8', 'replace') if name else ''
+
+
+def failure_cause(error):
+    """ Returns the metric label of an exception raised by a Liquidsoap
+    exchange
+    """
+    if isinstance(error, (socket.timeout, TimeoutError, asyncio.TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (ConnectionRefusedError, FileNotFoundError)):
+        return 'unreachable'
+    if isinstance(error, LiquidsoapException):
+        return 'unreachable' if 'unreachable' in str(error) else 'closed'
+    return 'socket_error'
+
+
+def record_liquidsoap(payloads, replies, seconds, error=None):
+    """ Record a Liquidsoap exchange, ``replies`` are the raw replies or
+    None when ``error`` interrupted it
+    """
+    command = command_name(payloads)
+    LIQUIDSOAP_SECONDS.observe(seconds, command)
+    LIQUIDSOAP_BYTES_SENT.inc(command, amount=sum(map(len, payloads)))
+    if replies is not None:
+        LIQUIDSOAP_BYTES_RECEIVED.inc(command, amount=sum(map(len, replies)))
+    if error is not None:
+        LIQUIDSOAP_FAILURES.inc(command, failure_cause(error))
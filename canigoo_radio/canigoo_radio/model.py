@@ -10,18 +10,36 @@
 from datetime import datetime
 from uuid import uuid1
 
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, tuple_, Index
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
 
 from anyblok import Declarations
-from anyblok.column import (Integer, String, DateTime, Password, UUID)
+from anyblok.column import (
+    Integer, String, Text, DateTime, Password, UUID, Json)
 from anyblok.relationship import Many2One
 
+from .playlog import PARTITION_BY
 from .exception import EventOverlapException
+from .metrics import SCHEDULE_SECONDS, timed
+from .pages import invalidate_pages
+from .recurrence import get_recurrence_set, parse_rule
+from .schedule import get_schedule_index, find_overlaps, to_utc
 
 
 Mixin = Declarations.Mixin
 Model = Declarations.Model
 
+# postgresql error code of an exclusion constraint violation
+EXCLUSION_VIOLATION = '23P01'
+
+
+def overlap_message(conflicts):
+    return "%d overlap(s) found:\n%s" % (len(conflicts), "\n".join(
+        "%r (%s / %s) overlap %r (%s / %s)" % (
+            a['name'], a['start'], a['end'], b['name'], b['start'], b['end'])
+        for a, b in conflicts))
+
 
 @Declarations.register(Mixin)
 class IdColumn:
@@ -71,6 +89,18 @@ class Presenter(UuidColumn):
     """
     name = String(nullable=False)
 
+    @classmethod
+    def after_insert_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
+    @classmethod
+    def after_update_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
+    @classmethod
+    def after_delete_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
     def __str__(self):
         return ('{self.name}').format(self=self)
 
@@ -90,6 +120,18 @@ class Show(UuidColumn):
     presenter = Many2One(
         label="Presenter", model=Model.Presenter, one2many="shows")
 
+    @classmethod
+    def after_insert_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
+    @classmethod
+    def after_update_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
+    @classmethod
+    def after_delete_orm_event(cls, mapper, connection, target):
+        invalidate_pages()
+
     def __str__(self):
         return ('{self.name}').format(self=self)
 
@@ -107,12 +149,16 @@ class Event(UuidColumn, TrackModel):
         dict(auto=dict(query=""),
         playlist=dict(tracklisting=list("trk1", "trk2")),
         live=dict()
+
+    The properties select the Liquidsoap source switched on by the playout
+    scheduler when the event starts.
     """
     name = String(nullable=False)
     start = DateTime(label="Start")
     end = DateTime(label="End")
     show = Many2One(
         label="Show", model=Model.Show, one2many="events")
+    properties = Json(label="Playout properties", default=dict)
 
     def get_duration(self):
         """ Returns a timedelta duration object
@@ -123,29 +169,162 @@ class Event(UuidColumn, TrackModel):
             return None
 
     @classmethod
+    def define_table_args(cls):
+        table_args = super(Event, cls).define_table_args()
+        return table_args + (
+            Index('ix_event_start_end', cls.start, cls.end),
+            Index('ix_event_end_start', cls.end, cls.start),
+            Index('ix_event_edited_at', cls.edited_at),
+        )
+
+    @classmethod
+    @timed(SCHEDULE_SECONDS, 'current')
     def get_current(cls, at=None):
+        """Returns the event or the occurrence of a recurrence on air at
+        ``at``, events take precedence over occurrences
+        """
         E = cls.registry.Event
         if not at:
             at = datetime.now()
-        return E.query().filter(
-            E.start < at, E.end > at).order_by(E.start.desc()).first() or None
+        index = get_schedule_index(cls.registry)
+        event = index.lookup(E, 'current', at, lambda: cls.query_current(at))
+        if event is None:
+            event = get_recurrence_set(cls.registry).current(
+                cls.registry, at)
+            if event and index.overlaps(event.start, event.end):
+                event = None
+        return event
 
     @classmethod
+    @timed(SCHEDULE_SECONDS, 'next')
     def get_next(cls, at=None):
         E = cls.registry.Event
         if not at:
             at = datetime.now()
-        return E.query().filter(
-            E.start > at).order_by(E.start.asc()).first() or None
+        index = get_schedule_index(cls.registry)
+        event = index.lookup(E, 'next', at, lambda: cls.query_next(at))
+        occurrence = get_recurrence_set(cls.registry).next(
+            cls.registry, at,
+            skip=lambda o: index.overlaps(o.start, o.end))
+        if occurrence and (event is None or occurrence.start < event.start):
+            return occurrence
+        return event
 
     @classmethod
+    @timed(SCHEDULE_SECONDS, 'previous')
     def get_previous(cls, at=None):
         E = cls.registry.Event
         if not at:
             at = datetime.now()
+        index = get_schedule_index(cls.registry)
+        event = index.lookup(
+            E, 'previous', at, lambda: cls.query_previous(at))
+        occurrence = get_recurrence_set(cls.registry).previous(
+            cls.registry, at,
+            skip=lambda o: index.overlaps(o.start, o.end))
+        if occurrence and (event is None or occurrence.start > event.start):
+            return occurrence
+        return event
+
+    @classmethod
+    def get_occurrences(cls, start, end):
+        """Returns the occurrences of the recurrences overlapping
+        ``[start, end]`` which are not replaced by an event
+        """
+        index = get_schedule_index(cls.registry)
+        index.sync(cls.registry.Event)
+        return [
+            occurrence
+            for occurrence in get_recurrence_set(cls.registry).expand(
+                cls.registry, start, end)
+            if not index.overlaps(occurrence.start, occurrence.end)]
+
+    @classmethod
+    def timeline(cls, start, end, after=None, limit=200):
+        """Returns the rows of the events and occurrences overlapping
+        ``[start, end]`` ordered by ``(start, uuid)`` and a bool telling if
+        more rows follow
+
+        Rows are tuples ``(uuid, name, start, end, show_uuid, show,
+        presenter_uuid, presenter, recurrence_uuid)``, show and presenter
+        are fetched by the same query. ``after`` is the ``(start, uuid)``
+        key of the last row of the previous page.
+        """
+        E = cls.registry.Event
+        S = cls.registry.Show
+        P = cls.registry.Presenter
+        query = E.query(
+            E.uuid, E.name, E.start, E.end, S.uuid, S.name, P.uuid, P.name
+        ).outerjoin(S, E.show_uuid == S.uuid).outerjoin(
+            P, S.presenter_uuid == P.uuid
+        ).filter(E.start < end, E.end > start)
+        occurrences = cls.get_occurrences(start, end)
+        if after:
+            after = (to_utc(after[0]), after[1])
+            query = query.filter(or_(
+                E.start > after[0],
+                and_(E.start == after[0], E.uuid > after[1])))
+            occurrences = [o for o in occurrences
+                           if (o.start, o.uuid) > tuple(after)]
+
+        rows = [tuple(row) + (None,) for row in query.order_by(
+            E.start, E.uuid).limit(limit + 1).all()]
+        occurrences = occurrences[:limit + 1]
+        shows = {}
+        show_uuids = {o.show_uuid for o in occurrences if o.show_uuid}
+        if show_uuids:
+            shows = {row[0]: tuple(row) for row in S.query(
+                S.uuid, S.name, P.uuid, P.name
+            ).outerjoin(P, S.presenter_uuid == P.uuid).filter(
+                S.uuid.in_(list(show_uuids))).all()}
+
+        rows.extend(
+            (o.uuid, o.name, o.start, o.end) +
+            shows.get(o.show_uuid, (None, None, None, None)) +
+            (o.recurrence_uuid,)
+            for o in occurrences)
+        rows.sort(key=lambda row: (row[2], row[0]))
+        return rows[:limit], len(rows) > limit
+
+    @classmethod
+    def query_current(cls, at):
+        E = cls.registry.Event
+        return E.query().filter(
+            E.start < at, E.end > at).order_by(E.start.desc()).first() or None
+
+    @classmethod
+    def query_next(cls, at):
+        E = cls.registry.Event
+        return E.query().filter(
+            E.start > at).order_by(E.start.asc()).first() or None
+
+    @classmethod
+    def query_previous(cls, at):
+        E = cls.registry.Event
         return E.query().filter(
             E.end < at).order_by(E.start.desc()).first() or None
 
+    @classmethod
+    def after_insert_orm_event(cls, mapper, connection, target):
+        index = get_schedule_index(cls.registry)
+        index.written(object_session(target))
+        index.add(target)
+        invalidate_pages()
+
+    @classmethod
+    def after_update_orm_event(cls, mapper, connection, target):
+        index = get_schedule_index(cls.registry)
+        index.written(object_session(target))
+        index.add(target)
+        invalidate_pages()
+
+    @classmethod
+    def after_delete_orm_event(cls, mapper, connection, target):
+        index = get_schedule_index(cls.registry)
+        index.written(object_session(target))
+        index.remove(target)
+        invalidate_pages()
+
     @classmethod
     def overlap(cls, start=None, end=None):
         E = cls.registry.Event
@@ -162,13 +341,122 @@ class Event(UuidColumn, TrackModel):
     def insert(cls, *args, **kwargs):
         """Overload insert method in order to raise on event creation if any
         overlap with other events is detected
+
+        Overlaps are forbidden by the ``event_no_overlap`` exclusion
+        constraint, the insert is done in a savepoint so the session stays
+        usable when the constraint is violated.
+        """
+        savepoint = cls.registry.begin_nested()
+        try:
+            event = super(Event, cls).insert(*args, **kwargs)
+        except IntegrityError as e:
+            savepoint.rollback()
+            if getattr(e.orig, 'pgcode', None) == EXCLUSION_VIOLATION:
+                cls.raise_if_overlap(
+                    e, dict(uuid=kwargs.get('uuid'), name=kwargs.get('name'),
+                            start=kwargs.get('start'), end=kwargs.get('end')))
+            raise
+
+        savepoint.commit()
+        return event
+
+    def update(self, **values):
+        """Overload update method in order to raise if the new bounds
+        overlap with other events
         """
-        overlap = cls.overlap(start=kwargs['start'], end=kwargs['end'])
-        if overlap:
+        savepoint = self.registry.begin_nested()
+        try:
+            res = super(Event, self).update(**values)
+            self.registry.flush()
+        except IntegrityError as e:
+            savepoint.rollback()
+            self.raise_if_overlap(
+                e, dict(uuid=self.uuid, name=values.get('name', self.name),
+                        start=values.get('start', self.start),
+                        end=values.get('end', self.end)))
+            raise
+
+        savepoint.commit()
+        return res
+
+    @classmethod
+    def raise_if_overlap(cls, error, event):
+        """Raise ``EventOverlapException`` if ``error`` is a violation of
+        the ``event_no_overlap`` constraint by the ``event`` dict
+        """
+        if getattr(error.orig, 'pgcode', None) != EXCLUSION_VIOLATION:
+            return
+
+        others = cls.overlap(start=event['start'], end=event['end']) or []
+        conflicts = [
+            (event, dict(uuid=other.uuid, name=other.name,
+                         start=other.start, end=other.end))
+            for other in others if other.uuid != event['uuid']]
+        raise EventOverlapException(
+            overlap_message(conflicts), conflicts=conflicts)
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        """Insert many events in one statement
+
+        ``rows`` is a list of dict with ``name``, ``start``, ``end`` and
+        ``show`` (a ``Model.Show`` uuid), naive datetimes are local time.
+        Overlaps inside the batch and with existing events are found in a
+        single pass over the batch and the events of the range it covers,
+        all of them are reported at once by the raised
+        ``EventOverlapException``.
+
+        Returns the uuids of the inserted events.
+        """
+        E = cls.registry.Event
+        if not rows:
+            return []
+
+        rows = [dict(row, start=to_utc(row['start']), end=to_utc(row['end']))
+                for row in rows]
+        for row in rows:
+            if not row['start'] < row['end']:
+                raise ValueError(
+                    "The event %r must end after it starts" % row['name'])
+
+        rows.sort(key=lambda row: row['start'])
+        first_start = rows[0]['start']
+        last_end = max(row['end'] for row in rows)
+        existing = E.query('uuid', 'name', 'start', 'end').filter(
+            E.start < last_end, E.end > first_start).all()
+        conflicts = find_overlaps(
+            [(row['start'], row['end'], row) for row in rows],
+            [(event.start, event.end, dict(uuid=event.uuid, name=event.name,
+                                           start=event.start, end=event.end))
+             for event in existing])
+        if conflicts:
             raise EventOverlapException(
-                """The event you want to create starting at %r and ending at %r
-                overlap with %r""" % (kwargs['start'], kwargs['end'], overlap))
-        return super(Event, cls).insert(*args, **kwargs)
+                overlap_message(conflicts), conflicts=conflicts)
+
+        now = datetime.now()
+        values = [dict(uuid=uuid1(), name=row['name'], start=row['start'],
+                       end=row['end'], show_uuid=row.get('show'),
+                       created_at=now, edited_at=now)
+                  for row in rows]
+        savepoint = cls.registry.begin_nested()
+        try:
+            cls.registry.execute(E.__table__.insert().values(values))
+        except IntegrityError as e:
+            savepoint.rollback()
+            if getattr(e.orig, 'pgcode', None) == EXCLUSION_VIOLATION:
+                raise EventOverlapException(
+                    "Events overlapping the imported ones were created "
+                    "concurrently")
+            raise
+
+        savepoint.commit()
+        index = get_schedule_index(cls.registry)
+        index.written(cls.registry.session)
+        for value in values:
+            index.add_interval(value['uuid'], value['start'], value['end'])
+        invalidate_pages()
+
+        return [value['uuid'] for value in values]
 
     def __str__(self):
         return ('{self.name}').format(self=self)
@@ -179,3 +467,111 @@ class Event(UuidColumn, TrackModel):
             self=self,
             start=self.start.strftime('%Y-%m-%d %H:%M:%S'),
             end=self.end.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+@Declarations.register(Model)
+class Recurrence(UuidColumn, TrackModel):
+    """Recurring show template
+
+    Occurrences are expanded from a RFC 5545 rule instead of being stored as
+    events, rrule sample:
+        FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20181231T000000Z
+    the occurrences keep the local hour of ``dtstart``, UNTIL is in UTC.
+    The properties are the playout properties of the occurrences, as the
+    ones of ``Model.Event``.
+    """
+    name = String(nullable=False)
+    show = Many2One(label="Show", model=Model.Show)
+    rrule = Text(label="Recurrence rule", nullable=False)
+    dtstart = DateTime(label="First occurrence start", nullable=False)
+    duration = Integer(label="Duration in seconds", nullable=False)
+    exdates = Json(label="Start of the cancelled occurrences", default=list)
+    properties = Json(label="Playout properties", default=dict)
+
+    @classmethod
+    def before_insert_orm_event(cls, mapper, connection, target):
+        parse_rule(target.rrule, target.dtstart)
+
+    @classmethod
+    def before_update_orm_event(cls, mapper, connection, target):
+        parse_rule(target.rrule, target.dtstart)
+
+    @classmethod
+    def after_insert_orm_event(cls, mapper, connection, target):
+        get_recurrence_set(cls.registry).invalidate(target.uuid)
+        invalidate_pages()
+
+    @classmethod
+    def after_update_orm_event(cls, mapper, connection, target):
+        get_recurrence_set(cls.registry).invalidate(target.uuid)
+        invalidate_pages()
+
+    @classmethod
+    def after_delete_orm_event(cls, mapper, connection, target):
+        get_recurrence_set(cls.registry).invalidate(target.uuid)
+        invalidate_pages()
+
+    def __str__(self):
+        return ('{self.name}').format(self=self)
+
+    def __repr__(self):
+        msg = ('<Recurrence: {self.name} ({self.rrule})>')
+
+        return msg.format(self=self)
+
+
+@Declarations.register(Model)
+class PlayLog(UuidColumn):
+    """As-run log of the tracks played by Liquidsoap
+
+    Rows are written by batches by the ``playlog`` writer. The table is
+    range partitioned by month on ``played_at``, the partitions are created
+    ahead by the blok update and by the writer.
+    """
+    played_at = DateTime(label="Played at", primary_key=True,
+                         nullable=False)
+    artist = Text(label="Artist")
+    title = Text(label="Title")
+    album = Text(label="Album")
+    filename = Text(label="Filename")
+    source = String(label="Liquidsoap source")
+    meta = Json(label="Liquidsoap metadata")
+
+    @classmethod
+    def define_table_args(cls):
+        table_args = super(PlayLog, cls).define_table_args()
+        return table_args + (
+            Index('ix_playlog_played_at_uuid', cls.played_at, cls.uuid),
+            Index('uq_playlog_played_at_filename', cls.played_at,
+                  cls.filename, unique=True),
+        )
+
+    @classmethod
+    def define_table_kwargs(cls):
+        table_kwargs = super(PlayLog, cls).define_table_kwargs()
+        table_kwargs.update(postgresql_partition_by=PARTITION_BY)
+        return table_kwargs
+
+    @classmethod
+    def recent(cls, before=None, limit=50):
+        """Returns the plays before the ``(played_at, uuid)`` key ``before``,
+        the most recent first, and a bool telling if more rows follow
+        """
+        P = cls.registry.PlayLog
+        query = P.query(
+            'uuid', 'played_at', 'artist', 'title', 'album', 'source')
+        if before:
+            query = query.filter(
+                tuple_(P.played_at, P.uuid) < tuple_(*before))
+
+        rows = query.order_by(
+            P.played_at.desc(), P.uuid.desc()).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+
+    def __str__(self):
+        return ('{self.artist} - {self.title}').format(self=self)
+
+    def __repr__(self):
+        msg = ('<PlayLog: {self.artist} - {self.title} ({self.played_at})>')
+
+        return msg.format(self=self)
@@ -0,0 +1,86 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Cache of rendered pages
+
+The homepage only changes when an event starts or ends, it is rendered once
+and kept until the next boundary of the schedule. Writes on events, shows,
+presenters or recurrences done by this worker drop it at once through their
+ORM events, the ones done by other workers are seen after ``ttl`` seconds.
+
+Expiry dates are kept as timestamps: the schedule boundaries read from the
+database are timezone aware while the clock of the views is naive.
+"""
+import os
+from datetime import datetime
+from threading import Lock
+
+from anyblok.config import Configuration
+
+from .schedule import to_timestamp
+
+
+class Page:
+    """ A rendered page and the timestamp it expires at
+    """
+
+    def __init__(self, html, expires):
+        self.html = html
+        self.expires = expires
+
+
+class PageCache:
+    """ Rendered pages by name, valid until their expiry datetime
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._pages = {}
+        self._lock = Lock()
+
+    def get(self, name, now=None):
+        page = self._pages.get(name)
+        if page is None or page.expires <= to_timestamp(
+                now or datetime.now()):
+            return None
+
+        return page
+
+    def set(self, name, html, expires=None, now=None):
+        """ Store the page ``name`` until ``expires``, at most ``ttl``
+        seconds from now, datetimes are naive (local) or timezone aware
+        """
+        limit = to_timestamp(now or datetime.now()) + self.ttl
+        page = Page(html, min(to_timestamp(expires), limit)
+                    if expires else limit)
+        with self._lock:
+            self._pages[name] = page
+
+        return page
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+
+
+_cache = None
+_cache_pid = None
+
+
+def get_page_cache():
+    """ Returns the page cache of the current worker
+    """
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = PageCache(ttl=Configuration.get('homepage_cache_ttl', 60))
+        _cache_pid = os.getpid()
+
+    return _cache
+
+
+def invalidate_pages():
+    get_page_cache().invalidate()
@@ -0,0 +1,336 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Playlists of the auto events fitted to their duration
+
+The tracks matching the Beets query of an ``auto`` event are drawn in a
+random order and appended while more than ``window`` seconds of the slot
+are left. The end of the slot is filled by a subset sum over the lengths of
+the next ``candidates`` drawn tracks, rounded to the second: the reachable
+sums are the bits of an integer, so adding a track is one shift and one or.
+The subset closest to the time left, overrunning it by ``tolerance``
+seconds at most, is kept, the tracks are drawn again with a wider window
+when it misses the time left by more than ``tolerance``. Candidates
+breaking the rotation rules (see ``rotation``) are skipped.
+
+``canigoo_generate_playlists`` stores the playlists of the auto events of
+the coming days in their properties, the playout scheduler pushes them to
+Liquidsoap in one batch when the event starts. An occurrence of a recurring
+auto show is stored as an event with its playlist, which replaces it. The
+tracks of a Beets query are read once per run whatever the number of
+events using it.
+"""
+import os
+import random
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+from logging import getLogger
+
+import anyblok
+from anyblok.config import Configuration
+
+from .exception import EventOverlapException
+from .library import get_beets_library
+from .rotation import RotationRules
+from .schedule import to_timestamp
+
+
+logger = getLogger(__name__)
+
+Playlist = namedtuple('Playlist', ['tracks', 'length'])
+
+
+def shuffled(items, rng):
+    """ Yield ``items`` in a random order, a lazy Fisher-Yates shuffle
+    drawing only the consumed items
+    """
+    items = list(items)
+    for i in range(len(items) - 1, -1, -1):
+        j = rng.randint(0, i)
+        items[i], items[j] = items[j], items[i]
+        yield items[i]
+
+
+def closest_sum(lengths, target, capacity):
+    """ Returns the indexes of the ``lengths`` (integers) whose sum is the
+    closest to ``target`` without exceeding ``capacity``
+    """
+    mask = (1 << (capacity + 1)) - 1
+    reachable = [1]
+    for length in lengths:
+        reachable.append(
+            (reachable[-1] | (reachable[-1] << length)) & mask)
+
+    bits = reachable[-1]
+    best = None
+    for delta in range(capacity + 1):
+        for total in (target + delta, target - delta):
+            if 0 <= total <= capacity and bits >> total & 1:
+                best = total
+                break
+        if best is not None:
+            break
+
+    chosen = []
+    for i in range(len(lengths), 0, -1):
+        if not reachable[i - 1] >> best & 1:
+            chosen.append(i - 1)
+            best -= lengths[i - 1]
+
+    return chosen[::-1]
+
+
+def draw_tracks(tracks, duration, tolerance, window, candidates, rng,
+                rules, start):
+    """ Returns the ``(at, length, track)`` of one draw of ``fit_tracks``
+    """
+    chosen = []
+    remaining = duration
+    tail = []
+    tail_keys = set()
+    for length, track in shuffled(tracks, rng):
+        if length is None or length <= 0:
+            continue
+
+        at = start + duration - remaining
+        if remaining > window:
+            if length > remaining:
+                continue
+            if rules is not None:
+                if not rules.allows(track, at):
+                    continue
+                rules.add(track, at)
+
+            chosen.append((at, length, track))
+            remaining -= length
+        elif length <= remaining + tolerance:
+            if rules is not None:
+                # rules only get looser as time goes on, a track allowed at
+                # the start of the tail is allowed anywhere in it
+                keys = rules.keys(track)
+                if tail_keys.intersection(keys) or not rules.allows(
+                        track, at):
+                    continue
+                tail_keys.update(keys)
+
+            tail.append((length, track))
+            if len(tail) >= candidates:
+                break
+
+    if tail and remaining > 0:
+        target = int(round(remaining))
+        indexes = closest_sum([int(round(length)) for length, _ in tail],
+                              target, target + int(tolerance))
+        at = start + duration - remaining
+        for i in indexes:
+            length, track = tail[i]
+            if rules is not None:
+                rules.add(track, at)
+            chosen.append((at, length, track))
+            at += length
+
+    return chosen
+
+
+def fit_tracks(tracks, duration, tolerance=5, window=1200, candidates=200,
+               rng=random, rules=None, start=0, attempts=3):
+    """ Returns a ``Playlist`` of ``tracks`` lasting ``duration`` seconds
+
+    ``tracks`` is a sequence of ``(length, track)``, the playlist is shorter
+    when the tracks are not enough to fill the slot. With ``rules``, tracks
+    are dict of Beets item fields checked against the ``RotationRules`` at
+    the time they would start, ``start`` being the timestamp of the slot,
+    and the chosen ones are added to the rules.
+
+    The tracks of the greedy start may leave a tail no subset of the
+    candidates fills within ``tolerance``, the tracks are then drawn again
+    with a ``window`` one more time as long, giving greedy picks back to the
+    subset sum, ``attempts`` times at most. The closest draw is kept.
+    """
+    snapshot = rules.snapshot() if rules is not None else None
+    best = last = None
+    for attempt in range(max(attempts, 1)):
+        if last is not None and rules is not None:
+            rules.restore(snapshot)
+
+        last = draw_tracks(tracks, duration, tolerance,
+                           window * (attempt + 1), candidates, rng, rules,
+                           start)
+        gap = abs(duration - sum(length for _, length, _ in last))
+        if best is None or gap < best[0]:
+            best = (gap, last)
+        if gap < tolerance:
+            break
+
+    chosen = best[1]
+    if rules is not None and chosen is not last:
+        # the rules hold the plays of the last draw
+        rules.restore(snapshot)
+        for at, _, track in chosen:
+            rules.add(track, at)
+
+    return Playlist([track for _, _, track in chosen],
+                    sum(length for _, length, _ in chosen))
+
+
+class PlaylistGenerator:
+    """ Fit playlists to auto events with the tracks of a Beets library,
+    following the rotation ``rules`` across the generated events
+    """
+
+    # the rotation rules read the artist, album and id (see ``rotation``)
+    fields = ['id', 'path', 'length', 'artist', 'album']
+
+    def __init__(self, library, tolerance=5, window=1200, candidates=200,
+                 rules=None):
+        self.library = library
+        self.tolerance = tolerance
+        self.window = window
+        self.candidates = candidates
+        self.rules = rules
+        self._tracks = {}
+        self._paths = {}
+
+    @property
+    def history(self):
+        """ Seconds of past plays the rules look at
+        """
+        return self.rules.span if self.rules is not None else 0
+
+    def tracks(self, query):
+        """ Returns the ``(length, item)`` of the items matching ``query``,
+        items are dict of ``fields``
+        """
+        tracks = self._tracks.get(query)
+        if tracks is None:
+            tracks = self._tracks[query] = []
+            for item in self.library.select(query, self.fields):
+                if item['length'] and item['path']:
+                    item['path'] = os.fsdecode(item['path'])
+                    tracks.append((item['length'], item))
+                    self._paths[item['path']] = tracks[-1]
+
+        return tracks
+
+    def generate(self, event):
+        """ Returns the ``Playlist`` of ``event``, the draw is seeded by its
+        uuid so it is reproducible
+        """
+        query = (event.properties or {}).get('auto', {}).get('query') or ''
+        playlist = fit_tracks(
+            self.tracks(query), event.get_duration().total_seconds(),
+            tolerance=self.tolerance, window=self.window,
+            candidates=self.candidates, rng=random.Random(str(event.uuid)),
+            rules=self.rules, start=event.start.timestamp())
+        return Playlist([item['path'] for item in playlist.tracks],
+                        playlist.length)
+
+    def replay(self, event):
+        """ Add the stored playlist of the auto ``event`` to the rules
+        """
+        auto = (event.properties or {}).get('auto') or {}
+        if self.rules is None or not auto.get('tracklisting'):
+            return
+
+        self.tracks(auto.get('query') or '')
+        at = event.start.timestamp()
+        for path in auto['tracklisting']:
+            track = self._paths.get(path)
+            if track is not None:
+                self.rules.add(track[1], at)
+                at += track[0]
+
+
+def generate_playlists(registry, generator, start, end, regenerate=False):
+    """ Store the playlists of the auto events starting in ``[start, end]``,
+    events having a playlist already are skipped unless ``regenerate``
+
+    The playlists of the events before ``start`` within the rotation rules
+    history and of the skipped events are replayed in the rules first.
+    Returns the number of generated playlists, ``start`` may be naive or
+    timezone aware. The occurrences of the recurrences starting in
+    ``[start, end]`` are stored as events when their playlist is generated.
+    """
+    since = to_timestamp(start)
+    E = registry.Event
+    events = E.query().filter(
+        E.start >= start - timedelta(seconds=generator.history),
+        E.start < end, E.end.isnot(None)).all()
+    events.extend(occurrence for occurrence in E.get_occurrences(start, end)
+                  if to_timestamp(occurrence.start) >= since)
+    events.sort(key=lambda event: to_timestamp(event.start))
+    generated = 0
+    for event in events:
+        properties = event.properties or {}
+        auto = properties.get('auto')
+        if not isinstance(auto, dict) or 'live' in properties or (
+                'playlist' in properties):
+            continue
+        if to_timestamp(event.start) < since or (
+                auto.get('tracklisting') and not regenerate):
+            generator.replay(event)
+            continue
+
+        playlist = generator.generate(event)
+        if playlist.length < event.get_duration().total_seconds() - (
+                generator.tolerance):
+            logger.warning("%r: %d tracks of %r last %ds only", event.name,
+                           len(playlist.tracks), auto.get('query') or '',
+                           playlist.length)
+
+        auto = dict(auto, tracklisting=playlist.tracks,
+                    length=round(playlist.length, 3),
+                    generated_at=datetime.now().isoformat())
+        if getattr(event, 'is_occurrence', False):
+            try:
+                E.insert(name=event.name, start=event.start, end=event.end,
+                         show_uuid=event.show_uuid,
+                         properties=dict(properties, auto=auto))
+            except EventOverlapException as e:
+                logger.warning("%r: playlist not stored, %s", event.name, e)
+                continue
+        else:
+            event.properties = dict(properties, auto=auto)
+        generated += 1
+
+    registry.flush()
+    return generated
+
+
+def run_generate_playlists():
+    """ Generate the playlists of the auto events of the coming days
+    """
+    registry = anyblok.start(
+        'canigoo_generate_playlists',
+        configuration_groups=['config', 'database', 'logging',
+                              'canigoo-beets', 'canigoo-playlist'],
+        loadwithoutmigration=True)
+    if not registry:
+        sys.exit("No database to read the schedule from, check db_name")
+
+    generator = PlaylistGenerator(
+        get_beets_library(),
+        tolerance=Configuration.get('playlist_tolerance', 5),
+        rules=RotationRules(
+            artist=Configuration.get('rotation_artist', 60) * 60,
+            album=Configuration.get('rotation_album', 180) * 60,
+            track=Configuration.get('rotation_track', 72) * 3600))
+    start = datetime.now()
+    end = start + timedelta(days=Configuration.get('playlist_days', 7))
+    try:
+        count = generate_playlists(
+            registry, generator, start, end,
+            regenerate=Configuration.get('playlist_regenerate', False))
+        registry.commit()
+    except Exception:
+        registry.rollback()
+        raise
+    finally:
+        registry.close()
+
+    logger.info("%d playlist(s) generated", count)
@@ -0,0 +1,226 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""As-run log of the played tracks
+
+The writer is run by ``canigoo_playout`` (see ``playout``), the web workers
+only read the log. It listens to the refreshes of the Liquidsoap status
+snapshot. When the track on air changes a row is queued in memory, a
+background thread inserts the queued rows by batches every
+``playlog_flush_interval`` seconds or as soon as ``playlog_batch_size``
+rows are waiting: the status poller never waits for an INSERT. While the
+database is down rows are kept, up to ``playlog_max_pending`` of them.
+
+A play is keyed by the ``on_air`` time set by Liquidsoap and the file name
+and inserted with ``ON CONFLICT DO NOTHING`` so it is logged once, even
+when the daemon is restarted during the track.
+
+``Model.PlayLog`` is range partitioned by month, the partition of a month
+is created before the first row of this month is inserted.
+"""
+import os
+from collections import deque
+from datetime import datetime
+from logging import getLogger
+from threading import Event, Lock, Thread
+from uuid import uuid1
+
+from anyblok.config import Configuration
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from .liquidsoap_status import get_liquidsoap_status
+from .metrics import PLAYLOG_ROWS
+
+
+logger = getLogger(__name__)
+
+PARTITION_BY = 'RANGE (played_at)'
+
+ON_AIR_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'playlog_y%04dm%02d' % (month.year, month.month)
+
+
+def partition_ddl(month):
+    """ Returns the statement creating the partition of ``month``
+    """
+    return (
+        "CREATE TABLE IF NOT EXISTS %s PARTITION OF playlog "
+        "FOR VALUES FROM ('%s') TO ('%s')" % (
+            partition_name(month), month.isoformat(' '),
+            next_month(month).isoformat(' ')))
+
+
+def create_partitions(execute, start, months=1):
+    """ Create the partitions of ``months`` months from ``start``
+    """
+    month = month_start(start)
+    for _ in range(months):
+        execute(text(partition_ddl(month)))
+        month = next_month(month)
+
+
+def play_row(on_air, now):
+    """ Returns the ``Model.PlayLog`` row of the Liquidsoap metadata
+    ``on_air``, played at ``now`` when Liquidsoap did not set it
+    """
+    try:
+        played_at = datetime.strptime(on_air['on_air'], ON_AIR_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        played_at = now.replace(microsecond=0)
+
+    return dict(uuid=uuid1(), played_at=played_at,
+                artist=on_air.get('artist'), title=on_air.get('title'),
+                album=on_air.get('album'),
+                filename=on_air.get('filename') or on_air.get('initial_uri'),
+                source=(on_air.get('source') or '')[:64] or None,
+                meta=dict(on_air))
+
+
+class PlayLogWriter:
+    """ Buffer the plays and insert them by batches in ``table``
+    """
+
+    def __init__(self, engine, table, batch_size=50, flush_interval=10,
+                 max_pending=10000, now=datetime.now):
+        self.engine = engine
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.now = now
+        self.pending = deque()
+        self.last_key = None
+        self.months = set()
+        self._lock = Lock()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def on_status(self, snapshot):
+        """ Listener of the Liquidsoap status, queue a row when the track
+        on air changed
+        """
+        on_air = snapshot.get('on_air')
+        if not on_air:
+            return
+
+        key = (on_air.get('on_air'), on_air.get('filename'))
+        if key == self.last_key:
+            return
+
+        self.last_key = key
+        self.record(play_row(on_air, self.now()))
+
+    def record(self, row):
+        with self._lock:
+            self.pending.append(row)
+            while len(self.pending) > self.max_pending:
+                self.pending.popleft()
+                PLAYLOG_ROWS.inc('dropped')
+
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """ Insert the queued rows, returns their number
+        """
+        with self._lock:
+            rows = list(self.pending)
+            self.pending.clear()
+
+        if not rows:
+            return 0
+
+        try:
+            months = {month_start(row['played_at']) for row in rows}
+            for month in sorted(months - self.months):
+                with self.engine.begin() as conn:
+                    create_partitions(conn.execute, month)
+                self.months.add(month)
+
+            with self.engine.begin() as conn:
+                conn.execute(
+                    insert(self.table).values(rows).on_conflict_do_nothing())
+        except Exception:
+            logger.exception("%d play(s) not logged yet", len(rows))
+            PLAYLOG_ROWS.inc('failed', amount=len(rows))
+            with self._lock:
+                self.pending.extendleft(reversed(rows))
+                while len(self.pending) > self.max_pending:
+                    self.pending.popleft()
+                    PLAYLOG_ROWS.inc('dropped')
+            return 0
+
+        PLAYLOG_ROWS.inc('written', amount=len(rows))
+        return len(rows)
+
+    def start(self):
+        """ Flush in a daemon thread
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                self.flush()
+
+        self._thread = Thread(target=run, name="playlog-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the thread and flush the queued rows
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+
+
+_writers = {}
+_writers_lock = Lock()
+
+
+def get_playlog_writer(registry):
+    """ Returns the play log writer of the current process for
+    ``registry``, listening to the Liquidsoap status from its first use
+    """
+    key = (os.getpid(), registry.db_name)
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = PlayLogWriter(
+                    registry.engine, registry.PlayLog.__table__,
+                    batch_size=Configuration.get('playlog_batch_size', 50),
+                    flush_interval=Configuration.get(
+                        'playlog_flush_interval', 10),
+                    max_pending=Configuration.get(
+                        'playlog_max_pending', 10000))
+                writer.start()
+                get_liquidsoap_status().add_listener(writer.on_status)
+
+    return writer
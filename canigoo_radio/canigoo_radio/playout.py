@@ -0,0 +1,387 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Playout scheduler driving Liquidsoap at the event boundaries
+
+``canigoo_playout`` loads the events and the occurrences of the
+recurrences of the next ``playout_horizon`` hours and keeps their starts
+and ends in a heap of monotonic clock deadlines. It sleeps until the first
+deadline and sends the commands of the transition to Liquidsoap:
+
+* the start of an event selects its source, the first of ``live``,
+  ``playlist`` and ``auto`` found in its properties (``var.set source =
+  "live"``), the tracks of a ``playlist`` are pushed to the request queue
+  just before, the tracks generated for an ``auto`` event (see
+  ``playlist``) to the auto queue,
+* the end of an event not followed by another one selects the
+  ``playout_default_source``.
+
+The Liquidsoap script is expected to switch its sources on an
+``interactive.string`` named ``playout_source_var``.
+
+The delay between the scheduled time of a transition and its dispatch is
+observed by the ``canigoo_playout_lateness_seconds`` histogram. Schedule
+edits are notified on the ``canigoo_schedule`` postgresql channel and wake
+the scheduler up, the schedule is reloaded anyway every
+``playout_sync_interval`` seconds.
+
+Event bounds, naive or timezone aware, are compared as epoch seconds.
+
+The daemon also logs the played tracks (see ``playlog``) and samples the
+Icecast listeners when ``icecast_status_url`` is set (see ``listeners``).
+"""
+import select
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from heapq import heapify, heappop
+from itertools import count
+from logging import getLogger
+from threading import Event
+
+import anyblok
+from anyblok.config import Configuration
+
+from .liquidsoap_client import LiquidsoapClient
+from .listeners import get_listener_sampler
+from .metrics import PLAYOUT_LATENESS, PLAYOUT_TRANSITIONS
+from .playlog import get_playlog_writer
+from .recurrence import get_recurrence_set
+from .schedule import IntervalIndex, to_timestamp
+
+
+logger = getLogger(__name__)
+
+SOURCES = ('live', 'playlist', 'auto')
+
+CHANNEL = 'canigoo_schedule'
+
+Transition = namedtuple(
+    'Transition', ['at', 'kind', 'uuid', 'name', 'properties'])
+
+# the state of Liquidsoap is not known before the first command
+UNKNOWN = object()
+
+
+def source_of(properties, default='auto'):
+    """ Returns the source selected by the properties of an event
+    """
+    for source in SOURCES:
+        if source in (properties or {}):
+            return source
+
+    return default
+
+
+def plan_transitions(events, since):
+    """ Returns the transitions of ``events`` after the timestamp ``since``
+    ordered by time, an end followed by the start of another event is
+    dropped. The ``at`` of a transition is a timestamp.
+    """
+    starts = {to_timestamp(event.start) for event in events}
+    transitions = []
+    for event in events:
+        start, end = to_timestamp(event.start), to_timestamp(event.end)
+        if start > since:
+            transitions.append(Transition(
+                start, 'start', event.uuid, event.name,
+                event.properties or {}))
+        if end > since and end not in starts:
+            transitions.append(Transition(
+                end, 'end', event.uuid, event.name, {}))
+
+    return sorted(transitions, key=lambda t: (t.at, t.kind == 'start'))
+
+
+def current_event(events, at):
+    """ Returns the event of ``events`` on air at the timestamp ``at``
+    """
+    for event in events:
+        if to_timestamp(event.start) <= at < to_timestamp(event.end):
+            return event
+
+    return None
+
+
+def is_error(reply):
+    if isinstance(reply, dict):
+        return 'error' in reply
+
+    return isinstance(reply, str) and reply.startswith('ERROR')
+
+
+class PlayoutScheduler:
+    """ Fire the transitions of the events loaded by ``load(start, end)``
+
+    ``load`` returns the events overlapping ``[start, end]`` with their
+    ``uuid``, ``name``, ``start``, ``end`` and ``properties``.
+    """
+
+    def __init__(self, load, client, source_var='source',
+                 default_source='auto', queue='request', auto_queue='auto',
+                 horizon=24 * 3600, sync_interval=60, retry_interval=5,
+                 clock=time.monotonic, now=datetime.now):
+        self.load = load
+        self.client = client
+        self.source_var = source_var
+        self.default_source = default_source
+        self.queue = queue
+        self.auto_queue = auto_queue
+        self.horizon = timedelta(seconds=horizon)
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.now = now
+        self.heap = []
+        self.fired = {}
+        self.on_air = UNKNOWN
+        self.planned_from = None
+        self.reload_at = None
+        self._seq = count()
+        self._stop = Event()
+
+    def select(self, source):
+        return 'var.set %s = "%s"' % (self.source_var, source)
+
+    def commands(self, transition):
+        """ Returns the Liquidsoap commands of ``transition``
+        """
+        if transition.kind == 'end':
+            return [self.select(self.default_source)]
+
+        source = source_of(transition.properties, self.default_source)
+        queue = dict(playlist=self.queue, auto=self.auto_queue).get(source)
+        cmds = []
+        if queue:
+            tracks = (transition.properties.get(source) or {}).get(
+                'tracklisting') or []
+            cmds.extend('%s.push %s' % (queue, track)
+                        for track in tracks if '\n' not in str(track))
+
+        cmds.append(self.select(source))
+        return cmds
+
+    def reload(self):
+        """ Load the events of the horizon and rebuild the heap
+
+        Transitions between the previous reload and now which were not fired
+        yet are kept, they are due at once.
+        """
+        now = self.now()
+        clock = self.clock()
+        events = self.load(now, now + self.horizon)
+        now = to_timestamp(now)
+        since = now if self.planned_from is None else min(
+            self.planned_from, now)
+        heap = [
+            (clock + transition.at - now, next(self._seq), transition)
+            for transition in plan_transitions(events, since)
+            if transition[:3] not in self.fired]
+        heapify(heap)
+        self.heap = heap
+        self.planned_from = now
+        self.reload_at = clock + self.sync_interval
+        self.fired = {key: at for key, at in self.fired.items()
+                      if at > since}
+        if not self.heap or self.heap[0][0] > clock:
+            self.reconcile(current_event(events, now))
+
+    def reconcile(self, event):
+        """ Select the source of the ``event`` on air if Liquidsoap may not
+        play it, after a restart, a failed transition or an edit of the
+        event on air
+        """
+        if event is None:
+            state = (None, self.default_source)
+        else:
+            state = (event.uuid, source_of(
+                event.properties, self.default_source))
+
+        if state == self.on_air:
+            return
+
+        logger.info("on air: %s, source %s",
+                    event.name if event else "no event", state[1])
+        self.send([self.select(state[1])], state, 'reconcile')
+
+    def send(self, cmds, state, transition):
+        replies = self.client.send_many(cmds)
+        if any(is_error(reply) for reply in replies):
+            logger.warning("playout %s failed: %r", transition, replies)
+            PLAYOUT_TRANSITIONS.inc(transition, 'error')
+            self.on_air = UNKNOWN
+            self.reload_at = min(self.reload_at,
+                                 self.clock() + self.retry_interval)
+            return False
+
+        PLAYOUT_TRANSITIONS.inc(transition, 'ok')
+        self.on_air = state
+        return True
+
+    def fire(self, transition):
+        lateness = to_timestamp(self.now()) - transition.at
+        PLAYOUT_LATENESS.observe(lateness, transition.kind)
+        self.fired[transition[:3]] = transition.at
+        logger.info("%s of %r, %.3fs late", transition.kind, transition.name,
+                    lateness)
+        if transition.kind == 'end':
+            state = (None, self.default_source)
+        else:
+            state = (transition.uuid, source_of(
+                transition.properties, self.default_source))
+
+        return self.send(self.commands(transition), state, transition.kind)
+
+    def run_pending(self):
+        """ Fire the due transitions
+        """
+        while self.heap and self.heap[0][0] <= self.clock():
+            _, _, transition = heappop(self.heap)
+            self.fire(transition)
+
+    def timeout(self):
+        """ Returns the seconds until the next deadline
+        """
+        deadline = self.reload_at
+        if self.heap:
+            deadline = min(deadline, self.heap[0][0])
+
+        return max(deadline - self.clock(), 0)
+
+    def run(self, wait):
+        """ Fire the transitions until ``stop`` is called
+
+        ``wait(timeout)`` sleeps at most ``timeout`` seconds and returns
+        True when the schedule was changed.
+        """
+        self.reload()
+        self.run_pending()
+        while not self._stop.is_set():
+            changed = wait(self.timeout())
+            self.run_pending()
+            if changed or self.clock() >= self.reload_at:
+                self.reload()
+                self.run_pending()
+
+    def stop(self):
+        self._stop.set()
+
+
+class ScheduleListener:
+    """ Wait for the notifications of the schedule changes on a dedicated
+    psycopg2 connection
+    """
+
+    def __init__(self, connection, channel=CHANNEL):
+        self.connection = connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN %s' % channel)
+
+    def wait(self, timeout):
+        if select.select([self.connection], [], [], timeout)[0]:
+            self.connection.poll()
+
+        notified = bool(self.connection.notifies)
+        del self.connection.notifies[:]
+        return notified
+
+    def close(self):
+        self.connection.close()
+
+
+def sleep(timeout):
+    time.sleep(timeout)
+    return False
+
+
+def load_events(registry, start, end):
+    """ Returns the events of ``registry`` and the occurrences of its
+    recurrences not replaced by an event overlapping ``[start, end]``,
+    ordered by start
+    """
+    E = registry.Event
+    events = E.query(
+        'uuid', 'name', 'start', 'end', 'properties'
+    ).filter(E.start < end, E.end > start).order_by(E.start).all()
+    index = IntervalIndex()
+    for event in events:
+        index.add(event.uuid, to_timestamp(event.start),
+                  to_timestamp(event.end))
+
+    # a notification may come from a recurrence edited by another process
+    recurrences = get_recurrence_set(registry)
+    recurrences.invalidate()
+    occurrences = [
+        occurrence
+        for occurrence in recurrences.expand(registry, start, end)
+        if index.overlapping(to_timestamp(occurrence.start),
+                             to_timestamp(occurrence.end)) is None]
+    return sorted(events + occurrences,
+                  key=lambda event: to_timestamp(event.start))
+
+
+def event_loader(registry):
+    """ Returns a ``load`` function of ``PlayoutScheduler`` reading the
+    events of ``registry``
+    """
+
+    def load(start, end):
+        try:
+            return load_events(registry, start, end)
+        finally:
+            # do not keep a transaction open while sleeping
+            registry.rollback()
+
+    return load
+
+
+def run_playout():
+    """ Drive Liquidsoap at the event boundaries until interrupted
+    """
+    registry = anyblok.start(
+        'canigoo_playout',
+        configuration_groups=['config', 'database', 'logging',
+                              'canigoo-liquidsoap', 'canigoo-playout',
+                              'canigoo-playlog', 'canigoo-listeners'],
+        loadwithoutmigration=True)
+    if not registry:
+        sys.exit("No database to read the schedule from, check db_name")
+
+    scheduler = PlayoutScheduler(
+        event_loader(registry), LiquidsoapClient(),
+        source_var=Configuration.get('playout_source_var', 'source'),
+        default_source=Configuration.get('playout_default_source', 'auto'),
+        queue=Configuration.get('playout_queue', 'request'),
+        auto_queue=Configuration.get('playout_auto_queue', 'auto'),
+        horizon=Configuration.get('playout_horizon', 24) * 3600,
+        sync_interval=Configuration.get('playout_sync_interval', 60))
+    # the as-run log is written by the playout daemon only
+    writer = get_playlog_writer(registry)
+    sampler = get_listener_sampler()
+    if sampler is not None:
+        sampler.start()
+
+    listener = None
+    wait = sleep
+    if Configuration.get('playout_listen', True):
+        listener = ScheduleListener(
+            registry.engine.raw_connection().dbapi_connection)
+        wait = listener.wait
+
+    try:
+        scheduler.run(wait)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if listener is not None:
+            listener.close()
+        writer.stop()
+        if sampler is not None:
+            sampler.stop()
+        registry.close()
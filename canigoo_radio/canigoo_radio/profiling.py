@@ -0,0 +1,187 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Per request profiling
+
+When ``profiling`` is set in the configuration a tween times each request
+and answers a ``Server-Timing`` header with the time spent in SQL (and the
+number of queries), authentication, the view, the schema serialisation and
+the rendering. A ``profiling_sample_rate`` share of the requests is run
+under cProfile and its stats dumped in ``profiling_dir``.
+
+The timings of a request are kept in a thread local (a greenlet local under
+gevent), ``timing`` is a no-op outside of a profiled request.
+"""
+import cProfile
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging import getLogger
+
+from anyblok.config import Configuration
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """ Durations and counts of the measured parts of a request
+    """
+
+    def __init__(self):
+        self.durations = OrderedDict()
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def server_timing(self):
+        """ Returns the value of the ``Server-Timing`` header, durations in
+        milliseconds
+        """
+        metrics = []
+        for name, seconds in self.durations.items():
+            metric = '%s;dur=%.2f' % (name, seconds * 1000)
+            if name == 'sql':
+                metric += ';desc="%d queries"' % self.counts[name]
+            metrics.append(metric)
+
+        return ', '.join(metrics)
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timing(name):
+    """ Add the time spent in the ``with`` block to the ``name`` duration of
+    the profiled request
+    """
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('canigoo_query_start', []).append(
+            time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    profile = current_profile()
+    starts = conn.info.get('canigoo_query_start')
+    if profile is not None and starts:
+        profile.add('sql', time.perf_counter() - starts.pop())
+
+
+def listen_sql():
+    """ Time the queries of every engine, once per process
+    """
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def timed_view(view, info):
+    """ View deriver timing the view callable, without the permission check
+    and the rendering
+    """
+    def wrapper(context, request):
+        with timing('view'):
+            return view(context, request)
+
+    return wrapper
+
+
+class TimedRenderer:
+    """ Wrap a renderer factory to time the rendering
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, info):
+        render = self.factory(info)
+
+        def timed_render(value, system):
+            with timing('render'):
+                return render(value, system)
+
+        return timed_render
+
+
+def profile_path(directory, request):
+    name = re.sub(r'[^\w.-]+', '_', request.path.strip('/')) or 'root'
+    return os.path.join(directory, '%s-%s-%d-%d.prof' % (
+        request.method, name[:100], os.getpid(), time.time() * 1000000))
+
+
+def profiling_tween_factory(handler, registry):
+    """ Pyramid tween timing each request, see the module documentation
+    """
+    sample_rate = Configuration.get('profiling_sample_rate', 0)
+    directory = Configuration.get('profiling_dir') or os.path.join(
+        tempfile.gettempdir(), 'canigoo-profiles')
+    if sample_rate:
+        os.makedirs(directory, exist_ok=True)
+
+    listen_sql()
+
+    def profiling_tween(request):
+        profile = _local.profile = RequestProfile()
+        profiler = None
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is active in this thread
+                profiler = None
+
+        start = time.perf_counter()
+        try:
+            response = handler(request)
+        finally:
+            total = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            _local.profile = None
+
+        profile.add('total', total)
+        response.headers['Server-Timing'] = profile.server_timing()
+        if profiler is not None:
+            path = profile_path(directory, request)
+            try:
+                profiler.dump_stats(path)
+            except OSError as e:
+                logger.warning("profile %r not written: %s", path, e)
+
+        return response
+
+    return profiling_tween
@@ -0,0 +1,210 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Server-Sent Events broadcast of the now playing track and of the schedule
+
+One producer per worker polls the Liquidsoap status snapshot and the current
+event every ``push_interval`` seconds and publishes what changed to every
+subscriber, so N listeners cost one poll instead of N.
+
+Each subscriber has a bounded queue. Messages are full states, not deltas,
+so a slow client only loses the oldest ones and always ends on the latest
+state, it never slows down the producer nor the other subscribers.
+
+A subscriber holds a connection for its whole life: serve the push endpoint
+with an async gunicorn worker class (``make run-gunicorn-async``).
+"""
+import json
+import os
+from collections import deque
+from itertools import count
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+from anyblok.config import Configuration
+
+from .liquidsoap_status import get_liquidsoap_status
+
+
+logger = getLogger(__name__)
+
+
+def format_message(kind, data, message_id):
+    """ Returns the ``text/event-stream`` encoded message
+    """
+    return ('id: %d\nevent: %s\ndata: %s\n\n' % (
+        message_id, kind, json.dumps(data, default=str))).encode('utf-8')
+
+
+def current_event(registry):
+    """ Returns the event on air as a dict or None
+    """
+    try:
+        event = registry.Event.get_current()
+        if event is None:
+            return None
+
+        show = event.show
+        return dict(uuid=str(event.uuid),
+                    name=event.name,
+                    start=event.start.isoformat(),
+                    end=event.end.isoformat(),
+                    show=show.name if show else None,
+                    presenter=show.presenter.name
+                    if show and show.presenter else None)
+    finally:
+        # never keep a transaction open between two polls
+        registry.rollback()
+
+
+class Subscriber:
+    """ The bounded queue of messages of one client
+    """
+
+    def __init__(self, maxsize=16):
+        self.messages = deque(maxlen=maxsize)
+        self.dropped = 0
+        self._ready = Event()
+
+    def put(self, message):
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+
+        self.messages.append(message)
+        self._ready.set()
+
+    def get(self, timeout=None):
+        """ Returns the pending messages, waits for at most ``timeout``
+        seconds if there is none
+        """
+        if not self.messages:
+            self._ready.wait(timeout)
+
+        self._ready.clear()
+        messages = []
+        while self.messages:
+            messages.append(self.messages.popleft())
+
+        return messages
+
+
+class Broadcaster:
+    """ Publish the state changes of ``sources`` to every subscriber
+
+    ``sources`` maps a message kind to a callable returning the current
+    state, a message is published when the state differs from the last
+    one. New subscribers receive the last state of each kind at once.
+    """
+
+    def __init__(self, sources, interval=1, queue_size=16):
+        self.sources = sources
+        self.interval = interval
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.states = {}
+        self.messages = {}
+        self._ids = count(1)
+        self._lock = Lock()
+        self._poller = None
+        self._stop = Event()
+
+    def subscribe(self):
+        subscriber = Subscriber(self.queue_size)
+        with self._lock:
+            for message in self.messages.values():
+                subscriber.put(message)
+
+            self.subscribers.add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, kind, state):
+        with self._lock:
+            if kind in self.states and self.states[kind] == state:
+                return
+
+            message = format_message(kind, state, next(self._ids))
+            self.states[kind] = state
+            self.messages[kind] = message
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def poll(self):
+        for kind, source in self.sources.items():
+            try:
+                state = source()
+            except Exception:
+                logger.exception("push source %r failed", kind)
+                continue
+
+            self.publish(kind, state)
+
+    def start(self):
+        """ Poll the sources every ``interval`` seconds in a daemon thread
+        """
+        if self._poller is not None:
+            return
+
+        def run():
+            self.poll()
+            while not self._stop.wait(self.interval):
+                self.poll()
+
+        self._poller = Thread(target=run, name="push-broadcaster",
+                              daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def event_stream(broadcaster, subscriber, keepalive=15):
+    """ Yield the messages of ``subscriber``, a comment is sent after
+    ``keepalive`` idle seconds so proxies keep the connection open and a
+    gone client is noticed
+    """
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            messages = subscriber.get(timeout=keepalive)
+            if not messages:
+                yield b': keepalive\n\n'
+
+            for message in messages:
+                yield message
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+_broadcaster = None
+_broadcaster_pid = None
+_broadcaster_lock = Lock()
+
+
+def get_broadcaster(registry):
+    """ Returns the broadcaster of the current worker, started on first use
+    """
+    global _broadcaster, _broadcaster_pid
+    if _broadcaster is None or _broadcaster_pid != os.getpid():
+        with _broadcaster_lock:
+            if _broadcaster is None or _broadcaster_pid != os.getpid():
+                status = get_liquidsoap_status()
+                broadcaster = Broadcaster(
+                    dict(on_air=lambda: status.get()[0]['on_air'],
+                         event=lambda: current_event(registry)),
+                    interval=Configuration.get('push_interval', 1),
+                    queue_size=Configuration.get('push_queue_size', 16))
+                broadcaster.start()
+                _broadcaster, _broadcaster_pid = broadcaster, os.getpid()
+
+    return _broadcaster
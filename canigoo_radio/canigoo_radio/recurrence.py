@@ -0,0 +1,282 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Occurrences of recurring shows
+
+A ``Model.Recurrence`` stores a RFC 5545 RRULE instead of one
+``Model.Event`` per broadcast. Its occurrences are never stored, they are
+expanded on demand inside the requested window and the expanded windows are
+cached until the rule changes. Cached windows are aligned on whole days, so
+the windows starting at "now" share the same entry for a day.
+
+Rules are expanded in local time, a show keeps its hour across the daylight
+saving changes. Occurrences and exdates are aware UTC datetimes, the bounds
+of the lookups may be naive (local) or aware.
+"""
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from threading import Lock
+from uuid import uuid5
+
+from anyblok.config import Configuration
+from dateutil.rrule import rrulestr
+from dateutil.tz import tzlocal
+
+from .cache import LRUCache
+from .schedule import to_utc
+from .schedule_import import parse_datetime
+
+
+class Occurrence:
+    """ An occurrence of a ``Model.Recurrence``, it can be used where a
+    ``Model.Event`` is expected in read only
+    """
+
+    is_occurrence = True
+
+    def __init__(self, rule, start, registry):
+        self.rule = rule
+        self.registry = registry
+        self.uuid = uuid5(rule.uuid, start.isoformat())
+        self.name = rule.name
+        self.start = start
+        self.end = start + rule.duration
+        self.show_uuid = rule.show_uuid
+        self.recurrence_uuid = rule.uuid
+        self.properties = rule.properties
+
+    @property
+    def show(self):
+        if self.show_uuid is None:
+            return None
+
+        return self.registry.Show.query().get(self.show_uuid)
+
+    def get_duration(self):
+        return self.end - self.start
+
+    def __eq__(self, other):
+        return isinstance(other, Occurrence) and other.uuid == self.uuid
+
+    def __hash__(self):
+        return hash(self.uuid)
+
+    def __str__(self):
+        return ('{self.name}').format(self=self)
+
+    def __repr__(self):
+        msg = ('<Occurrence: {self.name} ({start} / {end})>')
+        return msg.format(
+            self=self,
+            start=self.start.strftime('%Y-%m-%d %H:%M:%S'),
+            end=self.end.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def day_bounds(start, end):
+    """ Returns the window of whole days containing ``[start, end]``
+    """
+    first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    last = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if last < end:
+        last += timedelta(days=1)
+
+    return first, last
+
+
+def parse_rule(rrule, dtstart):
+    """ Returns the dateutil rule of the RRULE ``rrule`` expanded in local
+    time from ``dtstart``, raise ValueError if it is not valid. An UNTIL
+    must be in UTC (``20181231T000000Z``).
+    """
+    return rrulestr(rrule, dtstart=dtstart.astimezone(tzlocal()), cache=True)
+
+
+class RecurrenceRule:
+    """ A parsed ``Model.Recurrence`` row
+    """
+
+    def __init__(self, uuid, name, rrule, dtstart, duration, exdates,
+                 show_uuid, edited_at, properties=None):
+        self.uuid = uuid
+        self.name = name
+        self.rule = parse_rule(rrule, dtstart)
+        self.duration = timedelta(seconds=duration)
+        self.exdates = {to_utc(parse_datetime(exdate))
+                        for exdate in exdates or ()}
+        self.show_uuid = show_uuid
+        self.edited_at = edited_at
+        self.properties = properties or {}
+
+    def iter_between(self, start, end):
+        """ Yield the start of the occurrences overlapping ``[start, end]``
+        """
+        start, end = to_utc(start), to_utc(end)
+        for occurrence in self.rule.xafter(start - self.duration):
+            occurrence = to_utc(occurrence)
+            if occurrence >= end:
+                return
+
+            if occurrence not in self.exdates:
+                yield occurrence
+
+    def before(self, at):
+        """ Returns the start of the last occurrence starting before ``at``
+        """
+        occurrence = self.rule.before(to_utc(at))
+        while occurrence is not None and occurrence in self.exdates:
+            occurrence = self.rule.before(occurrence)
+
+        return occurrence and to_utc(occurrence)
+
+    def after(self, at):
+        """ Returns the start of the first occurrence starting after ``at``
+        """
+        occurrence = self.rule.after(to_utc(at))
+        while occurrence is not None and occurrence in self.exdates:
+            occurrence = self.rule.after(occurrence)
+
+        return occurrence and to_utc(occurrence)
+
+
+class RecurrenceSet:
+    """ The recurrences of a registry and their expanded windows
+
+    The rules are reloaded every ``sync_interval`` seconds to see the ones
+    written by other workers, the writes done by this worker invalidate them
+    at once through the ORM events of ``Model.Recurrence``.
+    """
+
+    max_skipped = 1000
+
+    def __init__(self, sync_interval=5, cache_size=256):
+        self.sync_interval = sync_interval
+        self.rules = None
+        self.loaded_at = None
+        self.windows = LRUCache(maxsize=cache_size)
+        self._lock = Lock()
+
+    def invalidate(self, uuid=None):
+        self.rules = None
+        if uuid is not None:
+            self.windows.discard_if(lambda value: value[0] == uuid)
+
+    def get_rules(self, registry):
+        rules = self.rules
+        if (rules is not None and
+                time.monotonic() - self.loaded_at < self.sync_interval):
+            return rules
+
+        with self._lock:
+            R = registry.Recurrence
+            rows = R.query(
+                'uuid', 'name', 'rrule', 'dtstart', 'duration', 'exdates',
+                'show_uuid', 'edited_at', 'properties').all()
+            rules = [RecurrenceRule(*row) for row in rows]
+            self.rules, self.loaded_at = rules, time.monotonic()
+
+        return rules
+
+    def expand(self, registry, start, end):
+        """ Returns the occurrences overlapping ``[start, end]`` sorted by
+        start
+        """
+        start, end = to_utc(start), to_utc(end)
+        first, last = day_bounds(start, end)
+        occurrences = []
+        for rule in self.get_rules(registry):
+            key = (rule.uuid, rule.edited_at, first, last)
+            cached = self.windows.get(key)
+            if cached is None:
+                cached = (rule.uuid, tuple(rule.iter_between(first, last)))
+                self.windows.set(key, cached)
+
+            starts = cached[1]
+            occurrences.extend(
+                Occurrence(rule, occurrence, registry)
+                for occurrence in starts[
+                    bisect_right(starts, start - rule.duration):
+                    bisect_left(starts, end)])
+
+        occurrences.sort(key=lambda occurrence: occurrence.start)
+        return occurrences
+
+    def current(self, registry, at):
+        at = to_utc(at)
+        for rule in self.get_rules(registry):
+            start = rule.before(at)
+            if start is not None and start + rule.duration > at:
+                return Occurrence(rule, start, registry)
+
+        return None
+
+    def next(self, registry, at, skip=None):
+        """ Returns the first occurrence starting after ``at``, occurrences
+        for which ``skip`` returns True are ignored up to ``max_skipped``
+        per rule
+        """
+        at = to_utc(at)
+        found = None
+        for rule in self.get_rules(registry):
+            start = rule.after(at)
+            for _ in range(self.max_skipped):
+                if start is None:
+                    break
+
+                occurrence = Occurrence(rule, start, registry)
+                if not skip or not skip(occurrence):
+                    break
+
+                start = rule.after(start)
+            else:
+                start = None
+
+            if start is not None and (found is None or start < found.start):
+                found = occurrence
+
+        return found
+
+    def previous(self, registry, at, skip=None):
+        """ Returns the last occurrence ended before ``at``, occurrences
+        for which ``skip`` returns True are ignored
+        """
+        at = to_utc(at)
+        found = None
+        for rule in self.get_rules(registry):
+            start = rule.before(at - rule.duration)
+            for _ in range(self.max_skipped):
+                if start is None:
+                    break
+
+                occurrence = Occurrence(rule, start, registry)
+                if not skip or not skip(occurrence):
+                    break
+
+                start = rule.before(start)
+            else:
+                start = None
+
+            if start is not None and (found is None or start > found.start):
+                found = occurrence
+
+        return found
+
+
+_sets = {}
+
+
+def get_recurrence_set(registry):
+    """ Returns the recurrence set of the current worker for ``registry``
+    """
+    key = (os.getpid(), registry.db_name)
+    recurrences = _sets.get(key)
+    if recurrences is None:
+        recurrences = _sets.setdefault(key, RecurrenceSet(
+            sync_interval=Configuration.get('schedule_sync_interval', 5)))
+
+    return recurrences
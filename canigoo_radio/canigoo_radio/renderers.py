@@ -0,0 +1,84 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""JSON renderers of the api
+
+``json_renderer = orjson`` in the configuration selects ``OrjsonRenderer``:
+dicts, lists, strings, numbers and UUIDs are encoded by orjson without
+calling back into python. UUIDs are written in their canonical form, as the
+marshmallow schemas do, instead of the hex form of the stock adapter.
+Datetimes still go through the adapter so naive values keep the server
+timezone offset of the stock renderer. When orjson is not installed, or a
+value can not be encoded by it, the stock pyramid ``JSON`` renderer is used.
+"""
+from logging import getLogger
+
+from anyblok.config import Configuration
+from pyramid.renderers import JSON
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+logger = getLogger(__name__)
+
+
+class OrjsonRenderer:
+    """ Renderer factory with the ``add_adapter`` api of pyramid ``JSON``
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.adapters = []
+
+    def add_adapter(self, cls, adapter):
+        self.adapters.append((cls, adapter))
+        self.fallback.add_adapter(cls, adapter)
+
+    def __call__(self, info):
+        fallback = self.fallback(info)
+        adapters = tuple(self.adapters)
+        options = orjson.OPT_PASSTHROUGH_DATETIME
+
+        def _render(value, system):
+            request = system.get('request')
+            if request is not None:
+                response = request.response
+                if response.content_type == response.default_content_type:
+                    response.content_type = 'application/json'
+
+            def default(obj):
+                if hasattr(obj, '__json__'):
+                    return obj.__json__(request)
+
+                for cls, adapter in adapters:
+                    if isinstance(obj, cls):
+                        return adapter(obj, request)
+
+                raise TypeError(type(obj))
+
+            try:
+                return orjson.dumps(value, default=default, option=options)
+            except orjson.JSONEncodeError:
+                return fallback(value, system)
+
+        return _render
+
+
+def get_json_renderer():
+    """ Returns the renderer factory selected by ``json_renderer``
+    """
+    name = Configuration.get('json_renderer', 'json')
+    if name == 'orjson':
+        if orjson is not None:
+            return OrjsonRenderer(JSON())
+
+        logger.warning("orjson is not installed, the json renderer is used")
+
+    return JSON()
@@ -0,0 +1,120 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Rotation rules of the auto programming
+
+A rule forbids to play twice the same artist, album or track within a
+number of seconds ("no same artist within 60 min"). Each rule keeps the
+plays of its window in a deque ordered by time and the number of plays of
+each key in a ``Counter``: checking a candidate is a dict lookup, plays
+leaving the window are popped from the left of the deque as time goes on.
+
+Plays must be added in chronological order, as the playlists of the auto
+events are generated.
+"""
+from collections import Counter, deque
+
+
+# rotation rules keys and the Beets item field they read
+FIELDS = dict(artist='artist', album='album', track='id')
+
+
+def rotation_key(item, field):
+    value = item.get(field)
+    if isinstance(value, str):
+        value = value.strip().lower()
+
+    return value or None
+
+
+class SlidingWindow:
+    """ The keys played during the last ``span`` seconds
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.plays = deque()
+        self.counts = Counter()
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __len__(self):
+        return len(self.plays)
+
+    def expire(self, at):
+        """ Forget the plays of ``span`` seconds or more before ``at``
+        """
+        limit = at - self.span
+        plays = self.plays
+        counts = self.counts
+        while plays and plays[0][0] <= limit:
+            _, key = plays.popleft()
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+
+    def add(self, at, key):
+        self.plays.append((at, key))
+        self.counts[key] += 1
+
+
+class RotationRules:
+    """ Separation rules in seconds by ``artist``, ``album`` and ``track``,
+    a rule of 0 second is disabled
+    """
+
+    def __init__(self, artist=0, album=0, track=0):
+        spans = dict(artist=artist, album=album, track=track)
+        self.windows = [(FIELDS[name], SlidingWindow(span))
+                        for name, span in spans.items() if span]
+        self.span = max(spans.values())
+        self.rejected = 0
+
+    def allows(self, item, at):
+        """ True if ``item`` (a dict of Beets item fields) may be played at
+        the timestamp ``at``
+        """
+        for field, window in self.windows:
+            window.expire(at)
+            key = rotation_key(item, field)
+            if key is not None and key in window:
+                self.rejected += 1
+                return False
+
+        return True
+
+    def keys(self, item):
+        """ Returns the keys of ``item`` checked by the rules
+        """
+        keys = []
+        for field, _ in self.windows:
+            key = rotation_key(item, field)
+            if key is not None:
+                keys.append((field, key))
+
+        return keys
+
+    def snapshot(self):
+        """ Returns the plays of the rules, see ``restore``
+        """
+        return [(window.plays.copy(), window.counts.copy())
+                for _, window in self.windows]
+
+    def restore(self, snapshot):
+        """ Forget the plays added since ``snapshot`` was taken
+        """
+        for (_, window), (plays, counts) in zip(self.windows, snapshot):
+            window.plays, window.counts = plays.copy(), counts.copy()
+
+    def add(self, item, at):
+        """ Record the play of ``item`` at the timestamp ``at``
+        """
+        for field, window in self.windows:
+            key = rotation_key(item, field)
+            if key is not None:
+                window.add(at, key)
@@ -0,0 +1,287 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""In memory index of the schedule
+
+``Model.Event`` rows never overlap, so sorted by start they are sorted by end
+too and the questions "what is on air at t", "what is next" and "what was
+previous" are answered by a bisection over sorted arrays.
+"""
+import os
+import time
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+from datetime import timedelta, timezone
+from threading import RLock
+
+from anyblok.config import Configuration
+from sqlalchemy import event
+
+# ``Session.info`` keys of the index
+LISTENED = 'canigoo_schedule_listened'
+WRITTEN = 'canigoo_schedule_written'
+
+
+def to_timestamp(value):
+    """ Returns a comparable float for naive (local) or aware datetimes
+    """
+    return value.timestamp()
+
+
+def to_utc(value):
+    """ Returns the aware UTC datetime of naive (local) or aware datetimes
+    """
+    return value.astimezone(timezone.utc)
+
+
+def find_overlaps(intervals, existing=()):
+    """ Returns every pair of overlapping intervals in one sweep
+
+    ``intervals`` and ``existing`` are iterables of ``(start, end, item)``,
+    a pair made only of ``existing`` intervals is not reported. Intervals
+    sharing a bound do not overlap.
+    """
+    tagged = sorted(
+        [(start, end, item, True) for start, end, item in intervals] +
+        [(start, end, item, False) for start, end, item in existing],
+        key=lambda interval: interval[0])
+    active = []
+    overlaps = []
+    for seq, (start, end, item, new) in enumerate(tagged):
+        while active and active[0][0] <= start:
+            heappop(active)
+
+        for _, _, other, other_new in active:
+            if new or other_new:
+                overlaps.append((other, item))
+
+        heappush(active, (end, seq, item, new))
+
+    return overlaps
+
+
+class IntervalIndex:
+    """ Non overlapping ``[start, end]`` intervals kept sorted by start
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        self.intervals = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.intervals
+
+    def add(self, key, start, end):
+        """ Add or move the interval ``key``
+        """
+        if key in self.intervals:
+            if self.intervals[key] == (start, end):
+                return
+
+            self.remove(key)
+
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.keys.insert(i, key)
+        self.intervals[key] = (start, end)
+
+    def remove(self, key):
+        interval = self.intervals.pop(key, None)
+        if interval is None:
+            return
+
+        i = bisect_left(self.starts, interval[0])
+        while self.keys[i] != key:
+            i += 1
+
+        del self.starts[i]
+        del self.ends[i]
+        del self.keys[i]
+
+    def current(self, at):
+        """ Returns the key of the interval with ``start < at < end``
+        """
+        i = bisect_left(self.starts, at) - 1
+        if i >= 0 and self.ends[i] > at:
+            return self.keys[i]
+
+        return None
+
+    def next(self, at):
+        """ Returns the key of the first interval starting after ``at``
+        """
+        i = bisect_right(self.starts, at)
+        if i < len(self.keys):
+            return self.keys[i]
+
+        return None
+
+    def overlapping(self, start, end):
+        """ Returns the key of an interval overlapping ``[start, end]``
+        """
+        i = bisect_left(self.starts, end) - 1
+        if i >= 0 and self.ends[i] > start:
+            return self.keys[i]
+
+        return None
+
+    def previous(self, at):
+        """ Returns the key of the last interval ended before ``at``
+        """
+        i = bisect_left(self.ends, at) - 1
+        if i >= 0:
+            return self.keys[i]
+
+        return None
+
+
+class ScheduleIndex:
+    """ An ``IntervalIndex`` of the events synchronised with the database
+
+    Writes done by this worker are applied at once by the ORM events of
+    ``Model.Event``, so a transaction sees its own events. When a
+    transaction which wrote events is rolled back, its writes may still be
+    in the index and the index is reloaded on the next lookup. Writes done
+    by other workers are fetched at most every ``sync_interval`` seconds
+    with a query on the ``edited_at`` column. Rows deleted by others are
+    dropped when a lookup finds them missing.
+    """
+
+    max_attempts = 10
+
+    def __init__(self, sync_interval=5, sync_margin=60):
+        self.sync_interval = sync_interval
+        self.sync_margin = timedelta(seconds=sync_margin)
+        self.index = IntervalIndex()
+        self.loaded = False
+        self.watermark = None
+        self.synced_at = None
+        self._lock = RLock()
+
+    def written(self, session):
+        """ Note that the current transaction of ``session`` changed the
+        index
+        """
+        if session is None:
+            return
+
+        if not session.info.get(LISTENED):
+            session.info[LISTENED] = True
+            event.listen(session, 'after_commit', self.committed)
+            event.listen(session, 'after_soft_rollback', self.rolled_back)
+
+        session.info[WRITTEN] = True
+
+    def committed(self, session):
+        session.info.pop(WRITTEN, None)
+
+    def rolled_back(self, session, previous_transaction):
+        if session.info.pop(WRITTEN, None):
+            # a savepoint rollback may only cancel part of the writes, the
+            # index is reloaded anyway
+            self.loaded = False
+            if session.in_transaction():
+                # the writes kept by the outer transaction are seen by the
+                # reload, they may be rolled back later too
+                session.info[WRITTEN] = True
+
+    def add(self, event):
+        self.add_interval(event.uuid, event.start, event.end)
+
+    def add_interval(self, uuid, start, end):
+        if not self.loaded or start is None or end is None:
+            return
+
+        with self._lock:
+            self.index.add(uuid, to_timestamp(start), to_timestamp(end))
+
+    def remove(self, event):
+        with self._lock:
+            self.index.remove(event.uuid)
+
+    def overlaps(self, start, end):
+        """ True if an indexed event overlaps ``[start, end]``
+        """
+        with self._lock:
+            return self.index.overlapping(
+                to_timestamp(start), to_timestamp(end)) is not None
+
+    def sync(self, Event):
+        now = time.monotonic()
+        if self.loaded and now - self.synced_at < self.sync_interval:
+            return
+
+        with self._lock:
+            query = Event.query('uuid', 'start', 'end', 'edited_at').filter(
+                Event.start.isnot(None), Event.end.isnot(None))
+            if self.loaded:
+                query = query.filter(
+                    Event.edited_at >= self.watermark - self.sync_margin)
+            else:
+                self.index = IntervalIndex()
+
+            for uuid, start, end, edited_at in query.all():
+                self.index.add(uuid, to_timestamp(start), to_timestamp(end))
+                if self.watermark is None or edited_at > self.watermark:
+                    self.watermark = edited_at
+
+            self.loaded = True
+            self.synced_at = now
+
+    def lookup(self, Event, finder, at, fallback):
+        """ Returns the event found by ``finder`` (``current``, ``next`` or
+        ``previous``) at the datetime ``at``
+
+        Each candidate is checked against the database, an outdated entry is
+        fixed and the lookup done again. If the index does not settle it is
+        reloaded on the next call and ``fallback`` answers this one.
+        """
+        self.sync(Event)
+        at = to_timestamp(at)
+        for _ in range(self.max_attempts):
+            with self._lock:
+                key = getattr(self.index, finder)(at)
+
+            if key is None:
+                return None
+
+            event = Event.query().get(key)
+            if event is None:
+                # deleted by another worker or rolled back
+                with self._lock:
+                    self.index.remove(key)
+            elif event.start is None or event.end is None:
+                self.remove(event)
+            elif self.index.intervals.get(key) != (
+                    to_timestamp(event.start), to_timestamp(event.end)):
+                self.add(event)
+            else:
+                return event
+
+        self.loaded = False
+        return fallback()
+
+
+_indexes = {}
+
+
+def get_schedule_index(registry):
+    """ Returns the schedule index of the current worker for ``registry``
+    """
+    key = (os.getpid(), registry.db_name)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes.setdefault(key, ScheduleIndex(
+            sync_interval=Configuration.get('schedule_sync_interval', 5)))
+
+    return index
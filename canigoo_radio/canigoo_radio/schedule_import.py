@@ -0,0 +1,202 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Readers of schedule grids for ``Model.Event.bulk_insert``
+
+Each reader returns a list of dict with ``name``, ``start``, ``end`` and
+``show``, a show name or uuid resolved later by ``resolve_shows``.
+"""
+import csv
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from dateutil.parser import isoparse
+from dateutil.tz import gettz
+
+
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                    '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M',
+                    '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def parse_datetime(value):
+    """ Parse a local datetime of ``DATETIME_FORMATS`` or an ISO 8601
+    datetime with an UTC offset, returned aware
+    """
+    if isinstance(value, datetime):
+        return value
+
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            pass
+
+    try:
+        return isoparse(value.strip())
+    except ValueError:
+        raise ValueError("Unknown datetime format %r" % value)
+
+
+def make_row(name, start, end, show=None):
+    return dict(name=name, start=parse_datetime(start),
+                end=parse_datetime(end), show=show or None)
+
+
+def read_csv(fileobj):
+    """ Rows of a csv file with a ``name,start,end,show`` header
+    """
+    return [make_row(line['name'], line['start'], line['end'],
+                     line.get('show'))
+            for line in csv.DictReader(fileobj)]
+
+
+def read_json(fileobj):
+    """ Rows of a json list of ``{name, start, end, show}`` objects
+    """
+    return [make_row(obj['name'], obj['start'], obj['end'], obj.get('show'))
+            for obj in json.load(fileobj)]
+
+
+def parse_ical_datetime(value, tzid=None):
+    """ Parse an iCalendar DATE-TIME, UTC values and values with a TZID
+    parameter are returned aware, floating ones are read as local time
+    """
+    if value.endswith('Z'):
+        return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(
+            tzinfo=timezone.utc)
+
+    at = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    if tzid:
+        tz = gettz(tzid)
+        if tz is None:
+            raise ValueError("Unknown time zone %r" % tzid)
+        at = at.replace(tzinfo=tz)
+
+    return at
+
+
+ICAL_DURATION = re.compile(
+    r'^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?'
+    r'(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?'
+    r'(?:(?P<seconds>\d+)S)?)?$')
+
+
+def parse_ical_duration(value):
+    """ Parse an iCalendar DURATION such as ``PT1H30M``
+    """
+    match = ICAL_DURATION.match(value)
+    if not match or value.endswith(('P', 'T')):
+        raise ValueError("Unknown duration format %r" % value)
+
+    parts = match.groupdict()
+    sign = -1 if parts.pop('sign') == '-' else 1
+    return sign * timedelta(**{key: int(amount or 0)
+                               for key, amount in parts.items()})
+
+
+def read_ical(fileobj):
+    """ Rows of the VEVENT of an iCalendar file, the first CATEGORIES value
+    is used as show. The end is DTEND or DTSTART + DURATION.
+    """
+    lines = []
+    for line in fileobj.read().splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+
+    rows = []
+    vevent = None
+    for line in lines:
+        name, _, value = line.partition(':')
+        name, *params = name.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value == 'VEVENT':
+            vevent = {}
+        elif name == 'END' and value == 'VEVENT':
+            rows.append(make_vevent_row(vevent))
+            vevent = None
+        elif vevent is not None:
+            params = dict(param.partition('=')[::2] for param in params)
+            vevent[name] = (
+                value.replace('\\,', ',').replace('\\n', '\n'),
+                params.get('TZID', '').strip('"') or None)
+
+    return rows
+
+
+def make_vevent_row(vevent):
+    summary = vevent.get('SUMMARY', ('', None))[0]
+    if 'DTSTART' not in vevent:
+        raise ValueError("The VEVENT %r has no DTSTART" % summary)
+
+    start = parse_ical_datetime(*vevent['DTSTART'])
+    if 'DTEND' in vevent:
+        end = parse_ical_datetime(*vevent['DTEND'])
+    elif 'DURATION' in vevent:
+        end = start + parse_ical_duration(vevent['DURATION'][0])
+    else:
+        raise ValueError("The VEVENT %r has no DTEND or DURATION" % summary)
+
+    return make_row(summary, start, end,
+                    vevent.get('CATEGORIES', ('', None))[0].split(',')[0])
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.ics': read_ical,
+}
+
+
+def read_schedule(path, fmt=None):
+    """ Read the schedule file ``path``, the format is guessed from the
+    file extension unless ``fmt`` (``csv``, ``json`` or ``ics``) is given
+    """
+    ext = '.%s' % fmt if fmt else os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError("Unknown schedule format %r" % ext)
+
+    with open(path, 'r', encoding='utf-8', newline='') as fileobj:
+        try:
+            return READERS[ext](fileobj)
+        except KeyError as e:
+            raise ValueError("Missing field %s in %r" % (e, path))
+
+
+def resolve_shows(registry, rows):
+    """ Replace the show name or uuid of ``rows`` by the show uuid with one
+    query
+    """
+    Show = registry.Show
+    refs = {row['show'] for row in rows if row['show']}
+    uuids = set()
+    for ref in refs:
+        try:
+            uuids.add(UUID(ref))
+        except ValueError:
+            pass
+
+    shows = {}
+    if refs:
+        query = Show.query('uuid', 'name').filter(
+            Show.name.in_(list(refs)) | Show.uuid.in_(list(uuids)))
+        for uuid, name in query.all():
+            shows[name] = shows[str(uuid)] = uuid
+
+    for row in rows:
+        if row['show']:
+            if row['show'] not in shows:
+                raise ValueError("Unknown show %r" % row['show'])
+
+            row['show'] = shows[row['show']]
+
+    return rows
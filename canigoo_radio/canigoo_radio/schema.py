@@ -35,3 +35,9 @@ class EventSchema(SchemaWrapper):
     """Schema for 'Model.Event'
     """
     model = 'Model.Event'
+
+
+class RecurrenceSchema(SchemaWrapper):
+    """Schema for 'Model.Recurrence'
+    """
+    model = 'Model.Recurrence'
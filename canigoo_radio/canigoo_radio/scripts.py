@@ -0,0 +1,49 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Canigoo radio console scripts
+"""
+import sys
+from logging import getLogger
+
+import anyblok
+from anyblok.config import Configuration
+
+from .exception import EventOverlapException
+from .schedule_import import read_schedule, resolve_shows
+
+
+logger = getLogger(__name__)
+
+
+def import_events():
+    """ Import schedule files with ``Model.Event.bulk_insert``, nothing is
+    imported if any overlap is found
+    """
+    registry = anyblok.start(
+        'canigoo_import_events',
+        configuration_groups=['config', 'database', 'logging',
+                              'canigoo-import'],
+        loadwithoutmigration=True)
+    if not registry:
+        sys.exit("No database to import in, check db_name")
+
+    try:
+        rows = []
+        for path in Configuration.get('import_files') or []:
+            rows.extend(read_schedule(
+                path, fmt=Configuration.get('import_format')))
+
+        registry.Event.bulk_insert(resolve_shows(registry, rows))
+        registry.commit()
+    except (EventOverlapException, ValueError) as e:
+        registry.rollback()
+        sys.exit(str(e))
+    finally:
+        registry.close()
+
+    logger.info("%d event(s) imported", len(rows))
@@ -37,3 +37,18 @@ def create_event(
         end=end,
         show=show
     )
+
+
+def create_recurrence(
+        self, rrule="FREQ=WEEKLY", dtstart=None, duration=3600,
+        name="FooRecurrence", show=None, exdates=None, properties=None):
+    dtstart = dtstart or datetime.datetime.now().replace(microsecond=0)
+    return self.registry.Recurrence.insert(
+        name=name,
+        rrule=rrule,
+        dtstart=dtstart,
+        duration=duration,
+        exdates=exdates or [],
+        show=show,
+        properties=properties or {}
+    )
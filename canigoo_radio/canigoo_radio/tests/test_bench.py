@@ -0,0 +1,60 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ..bench import (
+    bench_beets, bench_events, bench_liquidsoap, compare, format_comparison,
+    measure, parse_sizes, read_results, write_results)
+
+
+class TestBench(TestCase):
+    """ Test the benchmark suite helpers"""
+
+    def test_measure(self):
+        calls = []
+        stats = measure(lambda: calls.append(1), repeat=3, number=10)
+        self.assertEqual(len(calls), 30)
+        self.assertEqual(stats['number'], 10)
+        self.assertLessEqual(stats['min'], stats['median'])
+
+    def test_compare(self):
+        baseline = {'a': {'median': 1.0}, 'b': {'median': 1.0},
+                    'c': {'median': 1.0}}
+        results = {'a': {'median': 1.1}, 'b': {'median': 1.5},
+                   'c': {'median': 0.5}, 'd': {'median': 1.0}}
+        self.assertEqual(
+            [(row[0], row[4]) for row in compare(results, baseline)],
+            [('a', 'ok'), ('b', 'regression'), ('c', 'improvement'),
+             ('d', 'new')])
+        self.assertIn('regression', format_comparison(
+            compare(results, baseline)))
+
+    def test_results_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'bench', 'results.json')
+        write_results(path, {'a': {'median': 1.0}})
+        self.assertEqual(read_results(path), {'a': {'median': 1.0}})
+
+    def test_bench_events(self):
+        events = list(bench_events(3))
+        self.assertEqual(events[0]['end'], events[1]['start'])
+        self.assertEqual(parse_sizes('10, 100,'), [10, 100])
+
+    def test_bench_liquidsoap(self):
+        results = bench_liquidsoap(pipeline=3)
+        self.assertEqual(set(results),
+                         {'liquidsoap.send', 'liquidsoap.send_many[3]'})
+
+    def test_bench_beets(self):
+        results = bench_beets(100)
+        self.assertEqual(set(results), {
+            'beets.search[100]', 'beets.page[100]', 'beets.typeahead[100]'})
@@ -0,0 +1,107 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from ..cache import LRUCache
+from ..pages import PageCache
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+    """ Test the in process LRU cache"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_set(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIn('a', self.cache)
+
+    def test_ttl(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=20)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_discard_if(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.discard_if(lambda v: v == 1), 1)
+        self.assertNotIn('a', self.cache)
+        self.assertIn('b', self.cache)
+
+    def test_weight_eviction(self):
+        cache = LRUCache(maxsize=10, maxweight=5, weigh=len)
+        cache.set('a', [1, 2])
+        cache.set('b', [1, 2])
+        cache.set('b', [1, 2, 3])
+        self.assertEqual(cache.weight, 5)
+        cache.set('c', [1])
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.weight, 4)
+        cache.set('d', list(range(6)))
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.pop('b'), [1, 2, 3])
+        self.assertEqual(cache.weight, 1)
+
+
+class TestPageCache(TestCase):
+    """ Test the cache of rendered pages"""
+
+    def setUp(self):
+        self.now = datetime(2017, 10, 2, 20, 0)
+        self.cache = PageCache(ttl=60)
+
+    def test_expires_at_boundary(self):
+        self.cache.set('home', '<p/>', expires=self.now + timedelta(
+            seconds=10), now=self.now)
+        self.assertEqual(self.cache.get('home', now=self.now).html, '<p/>')
+        self.assertIsNone(self.cache.get(
+            'home', now=self.now + timedelta(seconds=10)))
+
+    def test_expires_after_ttl(self):
+        page = self.cache.set('home', '<p/>', now=self.now)
+        self.assertEqual(page.expires, self.now.timestamp() + 60)
+        page = self.cache.set('home', '<p/>', expires=self.now + timedelta(
+            days=1), now=self.now)
+        self.assertEqual(page.expires, self.now.timestamp() + 60)
+
+    def test_aware_expires(self):
+        expires = self.now.astimezone(timezone.utc) + timedelta(seconds=10)
+        page = self.cache.set('home', '<p/>', expires=expires, now=self.now)
+        self.assertEqual(page.expires, self.now.timestamp() + 10)
+        self.assertIsNotNone(self.cache.get(
+            'home', now=self.now + timedelta(seconds=9)))
+        self.assertIsNone(self.cache.get('home', now=expires))
+
+    def test_invalidate(self):
+        self.cache.set('home', '<p/>', now=self.now)
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get('home', now=self.now))
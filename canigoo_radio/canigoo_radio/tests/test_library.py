@@ -0,0 +1,102 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+import beets.library
+
+from ..library import BeetsLibrary
+
+
+class TestBeetsLibrary(TestCase):
+    """ Test the shared Beets library handle and its search cache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'library.db')
+        self.writer = beets.library.Library(self.path)
+        self.addCleanup(self.writer._close)
+        self.writer.add(beets.library.Item(artist="Foo", title="Bar"))
+        self.library = BeetsLibrary(self.path)
+        self.addCleanup(lambda: self.library.library._close())
+
+    def test_search(self):
+        items = self.library.search('Foo')
+        self.assertEqual([item['title'] for item in items], ["Bar"])
+        self.assertEqual(self.library.search('Nothing'), [])
+
+    def test_search_is_cached(self):
+        items = self.library.search('Foo')
+        self.assertIs(self.library.search('Foo'), items)
+
+    def test_large_results_not_cached(self):
+        library = BeetsLibrary(self.path, cache_items=1)
+        self.addCleanup(lambda: library.library._close())
+        self.writer.add(beets.library.Item(artist="Foo", title="Baz"))
+        items = library.search('Foo')
+        self.assertEqual(len(items), 2)
+        self.assertIsNot(library.search('Foo'), items)
+        self.assertEqual(library.cache.weight, 0)
+
+    def test_cache_invalidated_by_writes(self):
+        self.assertEqual(len(self.library.search('Foo')), 1)
+        key = self.library.modification_key()
+        self.writer.add(beets.library.Item(artist="Foo", title="Baz"))
+        os.utime(self.path, ns=(1, max(key[0], 0) + 1))
+        self.assertEqual(len(self.library.search('Foo')), 2)
+
+    def test_read_only(self):
+        self.library.search('Foo')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.library.library._connection().execute('DELETE FROM items')
+
+    def test_page(self):
+        for title in ("Baz", "Qux"):
+            self.writer.add(beets.library.Item(artist="Foo", title=title))
+        items, after = self.library.page('Foo', ['title'], limit=2)
+        self.assertEqual([item['title'] for item in items], ["Bar", "Baz"])
+        self.assertEqual(list(items[0].keys()), ['id', 'title'])
+        items, after = self.library.page('Foo', ['title'], after, limit=2)
+        self.assertEqual([item['title'] for item in items], ["Qux"])
+        self.assertIsNone(after)
+
+    def test_page_unknown_field(self):
+        with self.assertRaises(ValueError):
+            self.library.page('Foo', ['nothing'])
+
+    def test_iter_items(self):
+        for i in range(4):
+            self.writer.add(beets.library.Item(artist="Foo", title=str(i)))
+        self.library.page_size = 2
+        self.assertEqual(
+            [item['title'] for item in self.library.iter_items(
+                'Foo', ['title'])],
+            ["Bar", "0", "1", "2", "3"])
+
+    def test_iter_items_not_sql(self):
+        for i in range(4):
+            self.writer.add(beets.library.Item(
+                artist="Foo", title=str(i), mood='calm' if i % 2 else 'sad'))
+        self.library.page_size = 1
+        searches = []
+        items = self.library.library.items
+
+        def count_items(*args, **kwargs):
+            searches.append(args)
+            return items(*args, **kwargs)
+
+        self.library.library.items = count_items
+        self.assertEqual(
+            [item['title'] for item in self.library.iter_items(
+                'mood:calm', ['title'])],
+            ["1", "3"])
+        self.assertEqual(len(searches), 1)
@@ -0,0 +1,67 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import beets.library
+
+from ..library_search import SearchIndex, match_expression
+
+
+class TestSearchIndex(TestCase):
+    """ Test the full text search index of the library"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'library.db')
+        self.library = beets.library.Library(self.path)
+        self.addCleanup(self.library._close)
+        self.first = self.add("Björk", "Homogenic", "Jóga")
+        self.add("Boards of Canada", "Geogaddi", "Julie and Candy")
+        self.index = SearchIndex(self.path)
+
+    def add(self, artist, album, title):
+        item = beets.library.Item(artist=artist, album=album, title=title)
+        self.library.add(item)
+        return item
+
+    def touch(self):
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('boards of'),
+                         '"boards" AND "of"*')
+        self.assertEqual(match_expression('boards o'), '"boards"*')
+        self.assertIsNone(match_expression(' "* '))
+        self.assertIsNone(match_expression('b'))
+
+    def test_prefix_search(self):
+        self.assertEqual(
+            [item['title'] for item in self.index.search('jul')],
+            ["Julie and Candy"])
+        self.assertEqual(
+            [item['artist'] for item in self.index.search('bjo')],
+            ["Björk"])
+
+    def test_incremental_sync(self):
+        self.assertEqual(len(self.index.search('homo')), 1)
+        self.add("Foo", "Homogeneous", "Bar")
+        self.first.title = "Hunter"
+        self.first.store()
+        self.touch()
+        self.assertEqual(self.index.sync(), 2)
+        self.assertEqual(len(self.index.search('homo')), 2)
+        self.assertEqual(len(self.index.search('hunt')), 1)
+        self.first.remove()
+        self.touch()
+        self.assertEqual(self.index.sync(), 1)
+        self.assertEqual(self.index.search('hunt'), [])
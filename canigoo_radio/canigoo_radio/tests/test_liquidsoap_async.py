@@ -0,0 +1,110 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ..liquidsoap_async import AsyncLiquidsoapClient
+
+
+class TestAsyncLiquidsoapClient(TestCase):
+    """ Test the asyncio Liquidsoap client against a fake telnet server"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'liquidsoap.sock')
+        self.sessions = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            cmd = line.decode().strip()
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            if cmd == 'hang':
+                await asyncio.sleep(10)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            writer.write(('%s\r\nEND\r\n' % cmd.upper()).encode())
+            await writer.drain()
+
+        writer.close()
+
+    def serve(self, coroutine_function):
+        async def main():
+            server = await asyncio.start_unix_server(
+                self.handle, path=self.path)
+            try:
+                return await coroutine_function()
+            finally:
+                server.close()
+
+        return asyncio.run(main())
+
+    def test_send(self):
+        client = AsyncLiquidsoapClient(self.path, timeout=1)
+
+        async def send():
+            replies = [await client.send('version'),
+                       await client.send_many(['uptime', 'list'])]
+            client.close()
+            return replies
+
+        self.assertEqual(self.serve(send), ['VERSION', ['UPTIME', 'LIST']])
+        self.assertEqual(self.sessions, 1)
+
+    def test_timeout(self):
+        client = AsyncLiquidsoapClient(self.path, timeout=0.05)
+
+        async def send():
+            reply = await client.send('hang')
+            return reply, client._idle
+
+        reply, idle = self.serve(send)
+        self.assertEqual(reply['error'][0], "liquidsoap timeout")
+        self.assertEqual(idle, [])
+
+    def test_concurrency(self):
+        client = AsyncLiquidsoapClient(self.path, timeout=1, concurrency=2)
+
+        async def send():
+            replies = await asyncio.gather(
+                *[client.send('cmd%d' % i) for i in range(6)])
+            client.close()
+            return replies
+
+        self.assertEqual(self.serve(send), ['CMD%d' % i for i in range(6)])
+        self.assertEqual(self.max_active, 2)
+
+    def test_unreachable(self):
+        client = AsyncLiquidsoapClient(self.path + '.missing', timeout=1)
+        reply = asyncio.run(client.send('version'))
+        self.assertEqual(reply['error'][0], "liquidsoap socket error")
+
+    def test_cancel(self):
+        client = AsyncLiquidsoapClient(self.path, timeout=5)
+
+        async def send():
+            task = asyncio.ensure_future(client.send('hang'))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            return client._idle
+
+        self.assertEqual(self.serve(send), [])
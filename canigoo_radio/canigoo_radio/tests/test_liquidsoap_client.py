@@ -0,0 +1,135 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import socket
+import tempfile
+import time
+from unittest import TestCase
+
+from ..exception import LiquidsoapException
+from ..liquidsoap_client import (
+    LiquidsoapClient, LiquidsoapConnectionPool, split_reply)
+from ..liquidsoap_fake import FakeLiquidsoap
+from ..liquidsoap_status import fetch_status
+
+
+class TestLiquidsoapClient(TestCase):
+    """ Test the Liquidsoap client against the fake telnet server"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'liquidsoap.sock')
+
+    def start(self, timeout=2, **kwargs):
+        fake = FakeLiquidsoap(self.path, seed=0, **kwargs).start()
+        self.addCleanup(fake.stop)
+        pool = LiquidsoapConnectionPool(self.path, timeout=timeout)
+        self.addCleanup(pool.close)
+        return fake, pool, LiquidsoapClient(pool=pool)
+
+    def test_commands(self):
+        fake, pool, client = self.start()
+        self.assertEqual(client.send('version'), 'Liquidsoap 1.3.3')
+        self.assertEqual(client.send('list'), {
+            'icecast': 'output.icecast', 'request': 'request.queue'})
+        self.assertEqual(client.send('request.on_air'), '1')
+        self.assertEqual(client.send('unknown')[:6], 'ERROR:')
+
+    def test_fetch_status(self):
+        fake, pool, client = self.start()
+        status = fetch_status(client)
+        self.assertFalse(status['error'])
+        self.assertEqual(status['icecast_status'], 'on')
+        self.assertEqual(status['on_air']['title'], 'Canigoo test title')
+        self.assertEqual(fake.commands, 6)
+
+    def test_reused_session(self):
+        fake, pool, client = self.start()
+        self.assertEqual(client.send('version'), 'Liquidsoap 1.3.3')
+        conn = pool._idle[0]
+        start = time.monotonic()
+        self.assertEqual(client.send('icecast.status'), 'on')
+        # the health check of the idle session must not wait for data
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(pool._idle, [conn])
+        self.assertEqual(conn.sock.gettimeout(), 2)
+
+    def test_stale_session(self):
+        fake, pool, client = self.start()
+        client.send('version')
+        conn = pool._idle[0]
+        # the server closes the session when it reads EOF
+        conn.sock.shutdown(socket.SHUT_WR)
+        deadline = time.monotonic() + 1
+        while conn.is_alive() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(conn.is_alive())
+        self.assertEqual(client.send('icecast.status'), 'on')
+        self.assertEqual(len(pool._idle), 1)
+        self.assertIsNot(pool._idle[0], conn)
+
+    def test_backoff(self):
+        pool = LiquidsoapConnectionPool(self.path, backoff_min=0.2)
+        self.addCleanup(pool.close)
+        with self.assertRaises(OSError):
+            pool.execute(b"version\n")
+        with self.assertRaisesRegex(LiquidsoapException, "unreachable"):
+            pool.execute(b"version\n")
+        fake = FakeLiquidsoap(self.path).start()
+        self.addCleanup(fake.stop)
+        time.sleep(0.2)
+        self.assertEqual(pool.execute(b"version\n"), b"Liquidsoap 1.3.3")
+
+    def test_split_reply(self):
+        buffer = bytearray(b"on\r\nEN")
+        self.assertIsNone(split_reply(buffer))
+        buffer.extend(b"D\r\nEND\r\n")
+        self.assertEqual(split_reply(buffer, 7), (b"on", 9))
+        self.assertEqual(split_reply(buffer[9:]), (b"", 5))
+
+    def test_multi_chunk_replies(self):
+        fake, pool, client = self.start(chunk_size=1, chunk_delay=0.001)
+        self.assertEqual(
+            pool.execute_many([b"icecast.status\n", b"request.on_air\n",
+                               b"unknown\n"])[:2], [b"on", b"1"])
+        self.assertEqual(client.send('version'), 'Liquidsoap 1.3.3')
+
+    def test_large_partial_reply(self):
+        fake, pool, client = self.start(metadata_size=8192, chunk_size=100)
+        metadata = client.parse_metadatas(client.send('request.metadata 1'))
+        self.assertEqual(metadata['title'], 'Canigoo test title')
+        self.assertGreater(len(metadata['comment']), 7000)
+
+    def test_pipeline(self):
+        fake, pool, client = self.start(chunk_size=7)
+        self.assertEqual(
+            client.send_many(['version', 'icecast.status', 'request.on_air']),
+            ['Liquidsoap 1.3.3', 'on', '1'])
+
+    def test_dropped_connection(self):
+        fake, pool, client = self.start(drop_rate=1)
+        reply = client.send('version')
+        self.assertEqual(reply['error'][0], "liquidsoap socket error")
+        self.assertEqual(fake.dropped, 1)
+        self.assertEqual(pool._idle, [])
+
+    def test_hang(self):
+        fake, pool, client = self.start(timeout=0.2, hang_rate=1)
+        start = time.monotonic()
+        reply = client.send('version')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(reply['error'][0], "liquidsoap socket error")
+        self.assertEqual(fake.hung, 1)
+
+    def test_latency(self):
+        fake, pool, client = self.start(latency=0.1)
+        start = time.monotonic()
+        client.send('version')
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
@@ -0,0 +1,70 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import time
+from threading import Thread
+from unittest import TestCase
+
+from ..liquidsoap_client import LiquidsoapClient
+from ..liquidsoap_status import LiquidsoapStatus
+
+
+class FakeClient:
+
+    calls = 0
+
+    def send_many(self, cmds):
+        FakeClient.calls += 1
+        time.sleep(0.05)
+        return ['ok', '1.3.3', '0j 00h 01m 00s', ['output.icecast'], '1']
+
+    def send(self, cmd):
+        return 'artist="Foo"\ntitle="Bar"'
+
+    parse_metadatas = staticmethod(LiquidsoapClient.parse_metadatas)
+
+
+class TestLiquidsoapStatus(TestCase):
+    """ Test the shared Liquidsoap status snapshot"""
+
+    def setUp(self):
+        FakeClient.calls = 0
+        self.status = LiquidsoapStatus(ttl=60, client_factory=FakeClient)
+
+    def test_get(self):
+        snapshot, age = self.status.get()
+        self.assertEqual(snapshot['version'], '1.3.3')
+        self.assertEqual(snapshot['on_air'], dict(artist='Foo', title='Bar'))
+        self.assertFalse(snapshot['error'])
+        self.assertLess(age, 1)
+        self.status.get()
+        self.assertEqual(FakeClient.calls, 1)
+
+    def test_get_outdated(self):
+        self.status.get()
+        self.status.get(max_age=0)
+        self.assertEqual(FakeClient.calls, 2)
+
+    def test_concurrent_misses_are_coalesced(self):
+        threads = [Thread(target=self.status.get) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(FakeClient.calls, 1)
+
+    def test_listeners(self):
+        snapshots = []
+        self.status.add_listener(snapshots.append)
+        self.status.add_listener(snapshots.append)
+        self.status.add_listener(lambda snapshot: 1 / 0)
+        with self.assertLogs(level='ERROR'):
+            self.status.get()
+        self.status.get()
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0]['version'], '1.3.3')
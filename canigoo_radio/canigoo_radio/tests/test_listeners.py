@@ -0,0 +1,167 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+import numpy as np
+
+from ..listeners import (
+    MISSING, ListenerSampler, ListenerStats, audience_stats, year_start)
+from ..metrics import LISTENERS_SAMPLES, REGISTRY
+
+
+T0 = datetime(2017, 3, 1, 12, 0)
+
+
+def row(uuid, start, end, show=None, aware=False):
+    t0 = T0.astimezone(timezone.utc) if aware else T0
+    return (uuid, uuid, t0 + timedelta(minutes=start),
+            t0 + timedelta(minutes=end), show, show and show.upper())
+
+
+class TestListenerStats(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stats = ListenerStats(self.directory, writable=True)
+
+    def record(self, values, start=T0):
+        for minute, value in enumerate(values):
+            self.stats.record(start + timedelta(minutes=minute), value)
+
+    def test_record_rollups(self):
+        self.record(range(120))
+        self.stats.record(T0 + timedelta(minutes=1, seconds=30), 61)
+        series = self.stats.series(T0 - timedelta(hours=1),
+                                   T0 + timedelta(hours=3))
+        self.assertEqual(series['start'],
+                         (T0 - timedelta(hours=1)).astimezone())
+        self.assertEqual(series['step'], 3600)
+        self.assertEqual(series['mean'], [None, 30.5, 89.5, None])
+        self.assertEqual(series['max'], [None, 61, 119, None])
+        day = self.stats.series(T0, T0 + timedelta(hours=1), 'day')
+        self.assertEqual(day['start'], T0.astimezone(timezone.utc).replace(
+            hour=0, minute=0))
+        self.assertEqual(day['mean'], [60.0])
+
+    def test_reader(self):
+        reader = ListenerStats(self.directory)
+        self.assertEqual(reader.series(T0, T0 + timedelta(minutes=2),
+                                       'minute')['mean'], [None, None])
+        self.record([3, 4])
+        self.assertEqual(reader.series(T0, T0 + timedelta(minutes=2),
+                                       'minute')['mean'], [3, 4])
+
+    def test_read_across_years(self):
+        end = datetime(2018, 1, 1, tzinfo=timezone.utc)
+        self.record([1, 2, 3, 4], start=end - timedelta(minutes=2))
+        values = self.stats.read(end - timedelta(minutes=3),
+                                 end + timedelta(minutes=3))
+        self.assertEqual(values.tolist(), [MISSING, 1, 2, 3, 4, MISSING])
+
+    def test_audience(self):
+        self.record([10, 20, MISSING, 40, 50, 60])
+        self.stats.record(T0 + timedelta(minutes=2), 30)
+        rows = [row('a', 0, 2, 'news'), row('b', 2, 4),
+                row('c', 4, 6, 'news'), row('d', 6, 8, 'news')]
+        stats = audience_stats(self.stats, rows)
+        self.assertEqual(
+            [(s['uuid'], s['mean'], s['max'], s['listener_minutes'])
+             for s in stats],
+            [('a', 15.0, 20, 30), ('b', 35.0, 40, 70),
+             ('c', 55.0, 60, 110), ('d', None, None, 0)])
+        shows = audience_stats(self.stats, rows, group='show')
+        self.assertEqual(shows, [dict(
+            uuid='news', name='NEWS', events=3, mean=35.0, max=60,
+            listener_minutes=140, sampled_minutes=4)])
+
+    def test_aware_datetimes(self):
+        self.record([10, 20, 30])
+        self.stats.record(T0.astimezone(timezone.utc) + timedelta(minutes=3),
+                          40)
+        rows = [row('a', 0, 2, aware=True), row('b', 2, 4, aware=True)]
+        self.assertEqual(
+            [(s['uuid'], s['mean'], s['max'])
+             for s in audience_stats(self.stats, rows)],
+            [('a', 15.0, 20), ('b', 35.0, 40)])
+        series = self.stats.series(
+            T0.astimezone(timezone(timedelta(hours=1))),
+            T0.astimezone(timezone.utc) + timedelta(minutes=4), 'minute')
+        self.assertEqual(series['start'], T0.astimezone())
+        self.assertEqual(series['mean'], [10, 20, 30, 40])
+
+    def test_daylight_saving_changes(self):
+        self.addCleanup(time.tzset)
+        self.addCleanup(os.environ.__setitem__, 'TZ',
+                        os.environ.get('TZ', 'UTC'))
+        os.environ['TZ'] = 'Europe/Paris'
+        time.tzset()
+        for day in (datetime(2017, 3, 26, tzinfo=timezone.utc),
+                    datetime(2017, 10, 29, tzinfo=timezone.utc)):
+            # 00:30 and 01:30 UTC are 01:30 and 03:30 in march, twice
+            # 02:30 in october
+            start = day + timedelta(minutes=30)
+            for hour, value in enumerate((10, 20)):
+                self.stats.record(start + timedelta(hours=hour), value)
+            series = self.stats.series(day, day + timedelta(hours=2),
+                                       'hour')
+            self.assertEqual(series['mean'], [10, 20])
+            self.assertEqual(series['start'], day)
+            self.assertEqual(
+                self.stats.series(day, day + timedelta(days=1),
+                                  'day')['mean'], [15])
+
+    def test_year_of_events(self):
+        minutes, hours, days = self.stats.open(2017)
+        rng = np.random.RandomState(0)
+        minutes[:] = rng.randint(0, 500, len(minutes))
+        start = year_start(2017).replace(tzinfo=timezone.utc)
+        rows = [(i, str(i), start + timedelta(hours=i),
+                 start + timedelta(hours=i + 1), i % 20, str(i % 20))
+                for i in range(365 * 24)]
+        began = time.perf_counter()
+        stats = audience_stats(self.stats, rows, group='show')
+        elapsed = time.perf_counter() - began
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(len(stats), 20)
+        expected = minutes[:60].mean()
+        events = audience_stats(self.stats, rows[:1])
+        self.assertAlmostEqual(events[0]['mean'], expected, places=2)
+        self.assertEqual(events[0]['max'], minutes[:60].max())
+
+
+class TestListenerSampler(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stats = ListenerStats(self.directory, writable=True)
+
+    def test_sample(self):
+        counts = iter([12, ConnectionError('refused')])
+
+        def fetch():
+            value = next(counts)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        sampler = ListenerSampler(self.stats, fetch, now=lambda: T0)
+        self.assertEqual(sampler.sample(), 12)
+        self.assertIsNone(sampler.sample())
+        self.assertTrue(sampler.failing)
+        self.assertEqual(self.stats.read(T0, T0 + timedelta(minutes=1))
+                         .tolist(), [12])
+        self.assertEqual(LISTENERS_SAMPLES.get('ok'), 1)
+        self.assertEqual(LISTENERS_SAMPLES.get('error'), 1)
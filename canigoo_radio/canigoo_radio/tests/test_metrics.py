@@ -0,0 +1,133 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import socket
+from unittest import TestCase
+
+from ..exception import LiquidsoapException
+from ..liquidsoap_client import LiquidsoapClient, logger
+from ..metrics import (
+    LIQUIDSOAP_BYTES_RECEIVED, LIQUIDSOAP_BYTES_SENT, LIQUIDSOAP_FAILURES,
+    LIQUIDSOAP_SECONDS, MetricsRegistry, REGISTRY, command_name,
+    failure_cause, timed)
+
+
+class FakePool:
+
+    def __init__(self, replies=None, error=None):
+        self.replies = replies
+        self.error = error
+
+    def execute_many(self, payloads):
+        if self.error:
+            raise self.error
+
+        return self.replies
+
+
+class TestMetrics(TestCase):
+    """ Test the Prometheus metrics"""
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        REGISTRY.clear()
+
+    def test_counter(self):
+        counter = self.registry.counter('hits_total', "Hits", ('path',))
+        counter.inc('/a')
+        counter.inc('/a', amount=2)
+        counter.inc('/"b"')
+        self.assertEqual(counter.get('/a'), 3)
+        self.assertEqual(self.registry.expose(), (
+            '# HELP hits_total Hits\n'
+            '# TYPE hits_total counter\n'
+            'hits_total{path="/\\"b\\""} 1\n'
+            'hits_total{path="/a"} 3\n'))
+
+    def test_expose_labels(self):
+        counter = self.registry.counter('hits_total', "Hits", ('path',))
+        counter.inc('/a')
+        self.assertEqual(self.registry.expose((('pid', 42),)), (
+            '# HELP hits_total Hits\n'
+            '# TYPE hits_total counter\n'
+            'hits_total{pid="42",path="/a"} 1\n'))
+
+    def test_counter_labels(self):
+        counter = self.registry.counter('hits_total', "Hits", ('path',))
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            'latency_seconds', "Latency", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(5)
+        self.assertEqual(self.registry.expose(), (
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="0.1"} 2\n'
+            'latency_seconds_bucket{le="1"} 2\n'
+            'latency_seconds_bucket{le="+Inf"} 3\n'
+            'latency_seconds_sum 5.15\n'
+            'latency_seconds_count 3\n'))
+
+    def test_timed(self):
+        histogram = self.registry.histogram('call_seconds', "Calls", ('f',))
+
+        @timed(histogram, 'fail')
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            fail()
+
+        with histogram.time('block'):
+            pass
+
+        self.assertEqual(histogram.get_count('fail'), 1)
+        self.assertEqual(histogram.get_count('block'), 1)
+
+    def test_command_name(self):
+        self.assertEqual(command_name([b'request.queue 1\n']),
+                         'request.queue')
+        self.assertEqual(command_name([b'a\n', b'b\n']), 'pipeline')
+
+    def test_failure_cause(self):
+        self.assertEqual(failure_cause(socket.timeout()), 'timeout')
+        self.assertEqual(failure_cause(ConnectionRefusedError()),
+                         'unreachable')
+        self.assertEqual(failure_cause(LiquidsoapException(
+            "liquidsoap unreachable, next attempt in 1.0s")), 'unreachable')
+        self.assertEqual(failure_cause(LiquidsoapException(
+            "liquidsoap closed the connection")), 'closed')
+        self.assertEqual(failure_cause(BrokenPipeError()), 'socket_error')
+
+    def test_liquidsoap_client(self):
+        client = LiquidsoapClient(pool=FakePool(replies=[b'1.4.1']))
+        self.assertEqual(client.send('version'), '1.4.1')
+        self.assertEqual(LIQUIDSOAP_SECONDS.get_count('version'), 1)
+        self.assertEqual(LIQUIDSOAP_BYTES_SENT.get('version'), 8)
+        self.assertEqual(LIQUIDSOAP_BYTES_RECEIVED.get('version'), 5)
+
+    def test_liquidsoap_client_failure(self):
+        client = LiquidsoapClient(pool=FakePool(error=socket.timeout()))
+        self.assertIn('error', client.send('version'))
+        self.assertEqual(LIQUIDSOAP_FAILURES.get('version', 'timeout'), 1)
+        self.assertIn(
+            'canigoo_liquidsoap_failures_total{command="version",'
+            'cause="timeout"} 1', REGISTRY.expose())
+
+    def test_liquidsoap_debug(self):
+        client = LiquidsoapClient(pool=FakePool(replies=[b'']))
+        self.assertFalse(client.debug)
+        with self.assertNoLogs(logger, 'INFO'):
+            client.send('version')
+
+        client = LiquidsoapClient(pool=FakePool(replies=[b'']), debug=True)
+        with self.assertLogs(logger, 'INFO'):
+            client.send('version')
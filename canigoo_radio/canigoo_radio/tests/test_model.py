@@ -8,8 +8,19 @@
 
 from anyblok.tests.testcase import BlokTestCase
 import datetime
+import io
+from sqlalchemy.exc import IntegrityError
 from ..exception import EventOverlapException
-from . import create_user, create_presenter, create_show, create_event
+from ..playlog import create_partitions
+from ..playlist import PlaylistGenerator, generate_playlists
+from ..playout import PlayoutScheduler, load_events
+from ..recurrence import get_recurrence_set
+from ..rotation import RotationRules
+from ..schedule import to_utc
+from ..schedule_import import read_csv, read_ical
+from . import (
+    create_user, create_presenter, create_show, create_event,
+    create_recurrence)
 
 
 class TestCanigooBlok(BlokTestCase):
@@ -75,6 +86,126 @@ class TestCanigooBlok(BlokTestCase):
             event2
         )
 
+    def test_event_get_current_after_update(self):
+        self.assertEqual(self.registry.Event.get_current(), self.event)
+        self.event.update(
+            start=self.event.start + datetime.timedelta(hours=2),
+            end=self.event.end + datetime.timedelta(hours=2))
+        self.assertIsNone(self.registry.Event.get_current())
+        self.assertEqual(self.registry.Event.get_next(), self.event)
+
+    def test_event_get_current_after_delete(self):
+        self.assertEqual(self.registry.Event.get_current(), self.event)
+        self.event.delete()
+        self.assertIsNone(self.registry.Event.get_current())
+
+    def test_event_insert_integrity_error(self):
+        with self.assertRaises(IntegrityError):
+            self.registry.Event.insert(name=None, show=self.show)
+
+    def test_event_get_next_after_rollback(self):
+        savepoint = self.registry.begin_nested()
+        event2 = create_event(self,
+                              start=self.event.end,
+                              end=self.event.end + datetime.timedelta(hours=1),
+                              name="FooEvent #2",
+                              show=self.show)
+        self.assertEqual(self.registry.Event.get_next(), event2)
+        savepoint.rollback()
+        self.assertIsNone(self.registry.Event.get_next())
+        self.assertEqual(self.registry.Event.get_current(), self.event)
+
+    def test_playout_scheduler_loads_events(self):
+        start = self.event.end
+        create_event(self, start=start,
+                     end=start + datetime.timedelta(hours=1),
+                     name="FooEvent #2", show=self.show).properties = dict(
+                         live={})
+        sent = []
+
+        class Client:
+
+            def send_many(self, cmds):
+                sent.append(list(cmds))
+                return ['' for _ in cmds]
+
+        clock = [0]
+        origin = datetime.datetime.now()
+        scheduler = PlayoutScheduler(
+            lambda start, end: load_events(self.registry, start, end),
+            Client(), clock=lambda: clock[0],
+            now=lambda: origin + datetime.timedelta(seconds=clock[0]))
+        scheduler.reload()
+        self.assertEqual(sent, [['var.set source = "auto"']])
+        clock[0] = start.timestamp() - origin.timestamp()
+        scheduler.run_pending()
+        self.assertEqual(sent[-1], ['var.set source = "live"'])
+
+    def test_load_events_with_occurrences(self):
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        start = to_utc(self.event.start.replace(microsecond=0))
+        create_recurrence(self, rrule="FREQ=DAILY;COUNT=3", dtstart=start,
+                          properties=dict(live={}))
+        events = load_events(self.registry, start,
+                             start + datetime.timedelta(days=3))
+        self.assertEqual([event.uuid for event in events][0], self.event.uuid)
+        self.assertEqual([event.start for event in events[1:]],
+                         [start + datetime.timedelta(days=1),
+                          start + datetime.timedelta(days=2)])
+        self.assertEqual(events[1].properties, dict(live={}))
+
+    def test_generate_playlists(self):
+        class Library:
+
+            def select(self, query, fields):
+                return [dict(id=i, path='/music/%d.flac' % i, length=300,
+                             artist='artist %d' % i, album=None)
+                        for i in range(30)]
+
+        self.event.properties = dict(auto=dict(
+            query='', tracklisting=['/music/0.flac']))
+        start = self.event.end
+        event = create_event(self, start=start,
+                             end=start + datetime.timedelta(hours=1),
+                             name="FooEvent #2", show=self.show)
+        event.properties = dict(auto=dict(query=''))
+        generator = PlaylistGenerator(
+            Library(), rules=RotationRules(artist=2 * 3600))
+        self.assertEqual(generate_playlists(
+            self.registry, generator, datetime.datetime.now(),
+            start + datetime.timedelta(hours=2)), 1)
+        tracks = event.properties['auto']['tracklisting']
+        self.assertEqual(len(tracks), 12)
+        self.assertNotIn('/music/0.flac', tracks)
+        self.assertEqual(self.event.properties['auto']['tracklisting'],
+                         ['/music/0.flac'])
+
+    def test_generate_playlists_of_occurrences(self):
+        class Library:
+
+            def select(self, query, fields):
+                return [dict(id=i, path='/music/%d.flac' % i, length=300,
+                             artist='artist %d' % i, album=None)
+                        for i in range(30)]
+
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        start = to_utc(self.event.end.replace(microsecond=0))
+        create_recurrence(self, rrule="FREQ=DAILY;COUNT=2", dtstart=start,
+                          show=self.show, properties=dict(auto=dict(query='')))
+        generator = PlaylistGenerator(
+            Library(), rules=RotationRules(artist=2 * 3600))
+        end = start + datetime.timedelta(hours=2)
+        self.assertEqual(generate_playlists(
+            self.registry, generator, datetime.datetime.now(), end), 1)
+        self.assertEqual(self.registry.Event.get_occurrences(start, end), [])
+        event = self.registry.Event.get_next()
+        self.assertFalse(getattr(event, 'is_occurrence', False))
+        self.assertEqual(event.start, start)
+        self.assertEqual(event.show, self.show)
+        self.assertEqual(len(event.properties['auto']['tracklisting']), 12)
+        self.assertEqual(generate_playlists(
+            self.registry, generator, datetime.datetime.now(), end), 0)
+
     def test_event_overlap(self):
         with self.assertRaises(EventOverlapException):
             create_event(
@@ -102,3 +233,123 @@ class TestCanigooBlok(BlokTestCase):
                     minutes=100),
                 end=datetime.datetime.now() + datetime.timedelta(minutes=200)
                 ), None)
+
+    def test_event_bulk_insert(self):
+        start = self.event.end
+        rows = [dict(name="FooEvent #%d" % i,
+                     start=start + datetime.timedelta(hours=i),
+                     end=start + datetime.timedelta(hours=i + 1),
+                     show=self.show.uuid)
+                for i in range(3)]
+        uuids = self.registry.Event.bulk_insert(rows)
+        self.assertEqual(len(uuids), 3)
+        self.assertEqual(self.registry.Event.query().count(), 4)
+        self.assertEqual(self.registry.Event.get_next().uuid, uuids[0])
+
+    def test_event_bulk_insert_overlaps(self):
+        start = self.event.start
+        rows = [dict(name="FooEvent #2",
+                     start=start + datetime.timedelta(minutes=30),
+                     end=start + datetime.timedelta(hours=2),
+                     show=self.show.uuid),
+                dict(name="FooEvent #3",
+                     start=start + datetime.timedelta(hours=1, minutes=30),
+                     end=start + datetime.timedelta(hours=3),
+                     show=self.show.uuid)]
+        with self.assertRaises(EventOverlapException) as ctx:
+            self.registry.Event.bulk_insert(rows)
+
+        self.assertEqual(len(ctx.exception.conflicts), 2)
+        self.assertEqual(self.registry.Event.query().count(), 1)
+
+    def test_event_bulk_insert_naive_rows(self):
+        start = datetime.datetime(2017, 10, 20, 8)
+        create_event(self, start=start.astimezone(datetime.timezone.utc),
+                     show=self.show)
+        rows = read_csv(io.StringIO(
+            "name,start,end,show\n"
+            "Morning,2017-10-20 09:00,2017-10-20 10:00,\n"))
+        rows += read_ical(io.StringIO(
+            "BEGIN:VEVENT\r\nSUMMARY:News\r\n"
+            "DTSTART:20171020T100000\r\nDURATION:PT1H\r\n"
+            "END:VEVENT\r\n"))
+        self.assertEqual(len(self.registry.Event.bulk_insert(rows)), 2)
+        rows = read_csv(io.StringIO(
+            "name,start,end,show\n"
+            "Overlap,2017-10-20 08:30,2017-10-20 09:30,\n"))
+        with self.assertRaises(EventOverlapException) as ctx:
+            self.registry.Event.bulk_insert(rows)
+
+        self.assertEqual(len(ctx.exception.conflicts), 2)
+        self.assertEqual(self.registry.Event.query().count(), 4)
+
+    def test_recurrence_get_current_and_next(self):
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        start = to_utc(self.event.end.replace(microsecond=0))
+        create_recurrence(self, rrule="FREQ=DAILY", dtstart=start,
+                          show=self.show)
+        self.assertEqual(self.registry.Event.get_current(), self.event)
+        occurrence = self.registry.Event.get_next()
+        self.assertEqual(occurrence.start, start)
+        self.assertEqual(occurrence.show, self.show)
+        current = self.registry.Event.get_current(
+            at=start + datetime.timedelta(days=1, minutes=5))
+        self.assertEqual(
+            current.start, start + datetime.timedelta(days=1))
+
+    def test_recurrence_occurrences_replaced_by_events(self):
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        start = to_utc(self.event.start.replace(microsecond=0))
+        create_recurrence(self, rrule="FREQ=DAILY;COUNT=3", dtstart=start)
+        occurrences = self.registry.Event.get_occurrences(
+            start, start + datetime.timedelta(days=7))
+        self.assertEqual([o.start for o in occurrences],
+                         [start + datetime.timedelta(days=1),
+                          start + datetime.timedelta(days=2)])
+
+    def test_recurrence_aware_values(self):
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        paris = datetime.timezone(datetime.timedelta(hours=2))
+        start = datetime.datetime(2017, 10, 2, 20, 0, tzinfo=paris)
+        exdate = start + datetime.timedelta(days=1)
+        create_recurrence(
+            self, rrule="FREQ=DAILY;UNTIL=20171005T235959Z", dtstart=start,
+            exdates=[exdate.isoformat()])
+        Event = self.registry.Event
+        occurrences = Event.get_occurrences(
+            start, start + datetime.timedelta(days=7))
+        self.assertEqual([o.start for o in occurrences],
+                         [start, start + datetime.timedelta(days=2),
+                          start + datetime.timedelta(days=3)])
+        self.assertEqual(occurrences[0].start.tzinfo, datetime.timezone.utc)
+        at = start + datetime.timedelta(days=1, minutes=5)
+        self.assertIsNone(Event.get_current(at=at))
+        self.assertEqual(Event.get_next(at=at).start,
+                         start + datetime.timedelta(days=2))
+        self.assertEqual(Event.get_previous(at=at).start, start)
+        local_at = (at + datetime.timedelta(days=1)).astimezone()
+        self.assertEqual(
+            Event.get_current(at=local_at.replace(tzinfo=None)).start,
+            start + datetime.timedelta(days=2))
+
+    def test_recurrence_invalid_rrule(self):
+        with self.assertRaises(ValueError):
+            create_recurrence(self, rrule="FREQ=SOMETIMES")
+
+    def test_playlog_recent(self):
+        start = datetime.datetime(2017, 1, 31, 23, 0)
+        create_partitions(self.registry.execute, start, months=2)
+        for i in range(5):
+            self.registry.PlayLog.insert(
+                played_at=start + datetime.timedelta(minutes=20 * i),
+                artist="Foo", title="Track %d" % i,
+                filename="/music/%d.flac" % i)
+        rows, more = self.registry.PlayLog.recent(limit=3)
+        self.assertTrue(more)
+        self.assertEqual([row.title for row in rows],
+                         ["Track 4", "Track 3", "Track 2"])
+        rows, more = self.registry.PlayLog.recent(
+            before=(rows[-1].played_at, rows[-1].uuid), limit=3)
+        self.assertFalse(more)
+        self.assertEqual([row.title for row in rows],
+                         ["Track 1", "Track 0"])
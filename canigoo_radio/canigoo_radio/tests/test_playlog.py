@@ -0,0 +1,116 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import JSON, Column, DateTime, MetaData, String, Table, Text
+from sqlalchemy.dialects.postgresql import UUID
+
+from ..metrics import PLAYLOG_ROWS, REGISTRY
+from ..playlog import (
+    PlayLogWriter, next_month, partition_ddl, play_row)
+
+
+NOW = datetime(2017, 12, 31, 23, 59, 30)
+
+TABLE = Table('playlog', MetaData(), Column('uuid', UUID),
+              Column('played_at', DateTime), Column('artist', Text),
+              Column('title', Text), Column('album', Text),
+              Column('filename', Text), Column('source', String(64)),
+              Column('meta', JSON))
+
+
+def on_air(title, at='2017/12/31 23:50:00'):
+    return dict(title=title, artist='Foo', filename='/%s.flac' % title,
+                source='request', on_air=at)
+
+
+class FakeEngine:
+
+    def __init__(self):
+        self.statements = []
+        self.fail = False
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement):
+        if self.fail:
+            raise OSError("database down")
+        self.statements.append(str(statement))
+
+
+class TestPartitions(TestCase):
+
+    def test_next_month(self):
+        self.assertEqual(next_month(datetime(2017, 11, 1)),
+                         datetime(2017, 12, 1))
+        self.assertEqual(next_month(datetime(2017, 12, 1)),
+                         datetime(2018, 1, 1))
+
+    def test_partition_ddl(self):
+        self.assertEqual(
+            partition_ddl(datetime(2017, 12, 1)),
+            "CREATE TABLE IF NOT EXISTS playlog_y2017m12 PARTITION OF "
+            "playlog FOR VALUES FROM ('2017-12-01 00:00:00') TO "
+            "('2018-01-01 00:00:00')")
+
+    def test_play_row(self):
+        row = play_row(on_air('a'), NOW)
+        self.assertEqual(row['played_at'], datetime(2017, 12, 31, 23, 50))
+        self.assertEqual(row['filename'], '/a.flac')
+        self.assertEqual(row['meta']['title'], 'a')
+        row = play_row(dict(title='b', on_air='garbage'), NOW)
+        self.assertEqual(row['played_at'], NOW)
+
+
+class TestPlayLogWriter(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.engine = FakeEngine()
+        self.writer = PlayLogWriter(self.engine, TABLE, batch_size=2,
+                                    max_pending=3, now=lambda: NOW)
+
+    def test_track_changes(self):
+        self.writer.on_status(dict(on_air=on_air('a')))
+        self.writer.on_status(dict(on_air=on_air('a')))
+        self.writer.on_status(dict(on_air={}))
+        self.assertEqual(len(self.writer.pending), 1)
+        self.assertFalse(self.writer._wake.is_set())
+        self.writer.on_status(dict(on_air=on_air('b', '2017/12/31 23:54:00')))
+        self.assertTrue(self.writer._wake.is_set())
+
+    def test_flush(self):
+        self.writer.on_status(dict(on_air=on_air('a')))
+        self.writer.on_status(dict(on_air=on_air('b', '2018/01/01 00:01:00')))
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(len(self.engine.statements), 3)
+        self.assertIn('playlog_y2017m12', self.engine.statements[0])
+        self.assertIn('playlog_y2018m01', self.engine.statements[1])
+        self.assertIn('ON CONFLICT DO NOTHING', self.engine.statements[2])
+        self.assertEqual(PLAYLOG_ROWS.get('written'), 2)
+        self.writer.on_status(dict(on_air=on_air('c', '2018/01/01 00:05:00')))
+        self.writer.flush()
+        self.assertEqual(len(self.engine.statements), 4)
+        self.assertEqual(self.writer.flush(), 0)
+
+    def test_failed_flush_keeps_rows(self):
+        self.engine.fail = True
+        for i in range(3):
+            self.writer.on_status(dict(on_air=on_air(str(i))))
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.writer.flush(), 0)
+        self.writer.on_status(dict(on_air=on_air('3')))
+        self.assertEqual([row['title'] for row in self.writer.pending],
+                         ['1', '2', '3'])
+        self.assertEqual(PLAYLOG_ROWS.get('dropped'), 1)
+        self.engine.fail = False
+        self.assertEqual(self.writer.flush(), 3)
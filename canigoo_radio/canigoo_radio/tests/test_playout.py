@@ -0,0 +1,186 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from ..metrics import PLAYOUT_LATENESS, REGISTRY
+from ..playout import PlayoutScheduler, plan_transitions, source_of
+
+
+Row = namedtuple('Row', ['uuid', 'name', 'start', 'end', 'properties'])
+
+T0 = datetime(2017, 1, 1, 12, 0)
+
+
+def row(uuid, start, end, properties=None, aware=False):
+    t0 = T0.astimezone() if aware else T0
+    return Row(uuid, uuid, t0 + timedelta(minutes=start),
+               t0 + timedelta(minutes=end), properties or {})
+
+
+def ts(minutes):
+    return (T0 + timedelta(minutes=minutes)).timestamp()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def monotonic(self):
+        return self.seconds
+
+    def now(self):
+        return T0 + timedelta(seconds=self.seconds)
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def send_many(self, cmds):
+        self.sent.append(list(cmds))
+        if self.fail:
+            return [dict(error=("liquidsoap socket error", "down"))]
+        return ['' for _ in cmds]
+
+
+class TestPlanTransitions(TestCase):
+
+    def test_source_of(self):
+        self.assertEqual(source_of({'live': {}}), 'live')
+        self.assertEqual(source_of({'auto': {}, 'playlist': {}}), 'playlist')
+        self.assertEqual(source_of({}, default='jingles'), 'jingles')
+        self.assertEqual(source_of(None), 'auto')
+
+    def test_plan(self):
+        events = [row('a', 0, 60), row('b', 60, 90), row('c', 120, 150)]
+        transitions = plan_transitions(events, ts(-1))
+        self.assertEqual(
+            [(t.uuid, t.kind, t.at) for t in transitions],
+            [('a', 'start', ts(0)),
+             ('b', 'start', ts(60)),
+             ('b', 'end', ts(90)),
+             ('c', 'start', ts(120)),
+             ('c', 'end', ts(150))])
+
+    def test_plan_since(self):
+        events = [row('a', 0, 60)]
+        transitions = plan_transitions(events, ts(1))
+        self.assertEqual([t.kind for t in transitions], ['end'])
+
+    def test_plan_aware(self):
+        utc = T0.astimezone(timezone.utc)
+        events = [row('a', 0, 60, aware=True),
+                  Row('b', 'b', utc + timedelta(minutes=60),
+                      utc + timedelta(minutes=90), {})]
+        transitions = plan_transitions(events, ts(-1))
+        self.assertEqual([(t.uuid, t.kind, t.at) for t in transitions],
+                         [('a', 'start', ts(0)), ('b', 'start', ts(60)),
+                          ('b', 'end', ts(90))])
+
+
+class TestPlayoutScheduler(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.clock = FakeClock()
+        self.client = FakeClient()
+        self.events = []
+        self.scheduler = PlayoutScheduler(
+            self.load, self.client, sync_interval=600,
+            clock=self.clock.monotonic, now=self.clock.now)
+
+    def load(self, start, end):
+        # compared as the database does, naive values being local
+        return [event for event in self.events
+                if event.start.timestamp() < end.timestamp() and
+                event.end.timestamp() > start.timestamp()]
+
+    def wait_until(self, minutes, changed=False):
+        def wait(timeout):
+            self.clock.seconds += timeout
+            if self.clock.seconds >= minutes * 60:
+                self.scheduler.stop()
+            return changed
+
+        return wait
+
+    def test_transitions(self):
+        self.events = [
+            row('a', 1, 2, dict(playlist=dict(tracklisting=['/a.flac',
+                                                            '/b.flac']))),
+            row('b', 2, 3, dict(live={})),
+        ]
+        self.scheduler.run(self.wait_until(5))
+        self.assertEqual(self.client.sent, [
+            ['var.set source = "auto"'],
+            ['request.push /a.flac', 'request.push /b.flac',
+             'var.set source = "playlist"'],
+            ['var.set source = "live"'],
+            ['var.set source = "auto"'],
+        ])
+        self.assertEqual(PLAYOUT_LATENESS.get_count('start'), 2)
+        self.assertEqual(PLAYOUT_LATENESS.get_count('end'), 1)
+
+    def test_transitions_aware(self):
+        self.events = [row('a', 1, 2, dict(live={}), aware=True)]
+        self.scheduler.run(self.wait_until(3))
+        self.assertEqual(self.client.sent, [
+            ['var.set source = "auto"'], ['var.set source = "live"'],
+            ['var.set source = "auto"']])
+        self.assertEqual(PLAYOUT_LATENESS.get_count('start'), 1)
+
+    def test_generated_auto_playlist(self):
+        self.events = [row('a', 1, 2, dict(auto=dict(
+            query='genre:jazz', tracklisting=['/a.flac', '/b.flac'])))]
+        self.scheduler.run(self.wait_until(1))
+        self.assertEqual(self.client.sent[-1], [
+            'auto.push /a.flac', 'auto.push /b.flac',
+            'var.set source = "auto"'])
+
+    def test_catch_up_event_on_air(self):
+        self.events = [row('a', -10, 10, dict(
+            playlist=dict(tracklisting=['/a.flac'])))]
+        self.scheduler.reload()
+        self.scheduler.run_pending()
+        self.assertEqual(self.client.sent, [['var.set source = "playlist"']])
+
+    def test_edit_reloads_heap(self):
+        self.events = [row('a', 10, 20, dict(live={}))]
+        self.scheduler.reload()
+        self.assertEqual(self.scheduler.timeout(), 600)
+        self.events = [row('a', 5, 20, dict(live={}))]
+        self.scheduler.reload()
+        self.assertEqual(self.scheduler.timeout(), 300)
+
+    def test_due_transition_kept_by_reload(self):
+        self.events = [row('a', 1, 2, dict(live={}))]
+        self.scheduler.reload()
+        self.clock.seconds = 61
+        self.scheduler.reload()
+        self.scheduler.run_pending()
+        self.scheduler.reload()
+        self.scheduler.run_pending()
+        self.assertEqual(self.client.sent, [
+            ['var.set source = "auto"'], ['var.set source = "live"']])
+
+    def test_failure_reconciled(self):
+        self.events = [row('a', 1, 10, dict(live={}))]
+        self.scheduler.reload()
+        self.client.fail = True
+        self.clock.seconds = 60
+        self.scheduler.run_pending()
+        self.assertEqual(self.scheduler.timeout(), 5)
+        self.client.fail = False
+        self.clock.seconds = 65
+        self.scheduler.reload()
+        self.assertEqual(self.client.sent[-1], ['var.set source = "live"'])
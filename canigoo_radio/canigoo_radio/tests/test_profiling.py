@@ -0,0 +1,93 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from anyblok.config import Configuration
+from pyramid.config import Configurator
+from pyramid.renderers import JSON
+from pyramid.request import Request
+from sqlalchemy import create_engine, text
+
+from ..profiling import (
+    RequestProfile, TimedRenderer, profiling_tween_factory, timed_view,
+    timing)
+
+
+class TestProfiling(TestCase):
+    """ Test the request profiling tween"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.engine = create_engine('sqlite://')
+
+    def set_configuration(self, **values):
+        for key, value in values.items():
+            previous = Configuration.get(key)
+            self.addCleanup(Configuration.set, key, previous)
+            Configuration.set(key, value)
+
+    def make_app(self):
+        engine = self.engine
+
+        def events(request):
+            with engine.connect() as conn:
+                for _ in range(3):
+                    conn.execute(text('SELECT 1'))
+
+            return {'events': []}
+
+        with Configurator() as config:
+            config.add_renderer('json', TimedRenderer(JSON()))
+            config.add_view_deriver(
+                timed_view, under='rendered_view', over='mapped_view')
+            config.add_tween(profiling_tween_factory.__module__ +
+                             '.profiling_tween_factory')
+            config.add_route('events', '/api/v1/events')
+            config.add_view(events, route_name='events', renderer='json')
+            return config.make_wsgi_app()
+
+    def server_timing(self, response):
+        return dict(
+            (metric.strip().split(';')[0], metric.strip().split(';')[1:])
+            for metric in response.headers['Server-Timing'].split(','))
+
+    def test_server_timing(self):
+        self.set_configuration(profiling_sample_rate=0,
+                               profiling_dir=self.directory)
+        response = Request.blank('/api/v1/events').get_response(
+            self.make_app())
+        self.assertEqual(response.json, {'events': []})
+        timings = self.server_timing(response)
+        self.assertEqual(set(timings), {'sql', 'view', 'render', 'total'})
+        self.assertEqual(timings['sql'][1], 'desc="3 queries"')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sampled_profile(self):
+        self.set_configuration(profiling_sample_rate=1,
+                               profiling_dir=self.directory)
+        Request.blank('/api/v1/events').get_response(self.make_app())
+        dumps = os.listdir(self.directory)
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith('GET-api_v1_events-'))
+
+    def test_timing_outside_request(self):
+        with timing('sql'):
+            with self.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+
+    def test_request_profile(self):
+        profile = RequestProfile()
+        profile.add('sql', 0.001)
+        profile.add('sql', 0.002)
+        profile.add('view', 0.01)
+        self.assertEqual(profile.server_timing(),
+                         'sql;dur=3.00;desc="2 queries", view;dur=10.00')
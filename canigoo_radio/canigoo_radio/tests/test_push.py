@@ -0,0 +1,74 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from unittest import TestCase
+
+from ..push import Broadcaster, Subscriber, event_stream
+
+
+class TestBroadcaster(TestCase):
+    """ Test the push channel producer"""
+
+    def setUp(self):
+        self.track = dict(artist="Foo", title="Bar")
+        self.polls = 0
+        self.broadcaster = Broadcaster(dict(on_air=self.on_air),
+                                       queue_size=2)
+
+    def on_air(self):
+        self.polls += 1
+        return dict(self.track)
+
+    def test_publish_changes_only(self):
+        subscriber = self.broadcaster.subscribe()
+        self.broadcaster.poll()
+        self.broadcaster.poll()
+        messages = subscriber.get(timeout=0)
+        self.assertEqual(len(messages), 1)
+        self.assertIn(b'event: on_air\n', messages[0])
+        self.assertIn(b'"title": "Bar"', messages[0])
+        self.track['title'] = "Baz"
+        self.broadcaster.poll()
+        self.assertEqual(len(subscriber.get(timeout=0)), 1)
+
+    def test_one_poll_for_all_subscribers(self):
+        subscribers = [self.broadcaster.subscribe() for _ in range(10)]
+        self.broadcaster.poll()
+        self.assertEqual(self.polls, 1)
+        for subscriber in subscribers:
+            self.assertEqual(len(subscriber.get(timeout=0)), 1)
+
+    def test_new_subscriber_gets_last_state(self):
+        self.broadcaster.poll()
+        subscriber = self.broadcaster.subscribe()
+        self.assertEqual(len(subscriber.get(timeout=0)), 1)
+
+    def test_slow_subscriber_drops_oldest(self):
+        subscriber = self.broadcaster.subscribe()
+        for title in ("A", "B", "C"):
+            self.track['title'] = title
+            self.broadcaster.poll()
+
+        messages = subscriber.get(timeout=0)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(subscriber.dropped, 1)
+        self.assertIn(b'"title": "C"', messages[-1])
+
+    def test_event_stream_unsubscribes(self):
+        subscriber = self.broadcaster.subscribe()
+        stream = event_stream(self.broadcaster, subscriber, keepalive=0)
+        self.assertEqual(next(stream), b'retry: 5000\n\n')
+        self.assertEqual(next(stream), b': keepalive\n\n')
+        stream.close()
+        self.assertNotIn(subscriber, self.broadcaster.subscribers)
+
+
+class TestSubscriber(TestCase):
+    """ Test the bounded queue of a push client"""
+
+    def test_get_timeout(self):
+        self.assertEqual(Subscriber().get(timeout=0.01), [])
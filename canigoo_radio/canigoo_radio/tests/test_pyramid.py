@@ -7,10 +7,19 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 import base64
 import datetime
+import os
+import shutil
+import tempfile
 
+from anyblok.config import Configuration
 from anyblok_pyramid.tests.testcase import PyramidBlokTestCase
 
-from . import create_user, create_presenter, create_show, create_event
+from ..listeners import ListenerStats, _stats
+from ..playlog import create_partitions
+from ..recurrence import get_recurrence_set
+from . import (
+    create_user, create_presenter, create_show, create_event,
+    create_recurrence)
 
 
 def get_basic_auth_headers(user, password='secret'):
@@ -78,6 +87,31 @@ class TestApiBasicAuthLogin(PyramidBlokTestCase):
         self.assertIsNone(
             response_protected.json_body[0].get('password', None))
 
+    def test_get_protected_view_after_password_change(self):
+        headers = get_basic_auth_headers(self.user.username, password='pop')
+        self.webserver.get('/api/v1/users', headers=headers)
+        self.user.update(password='pop2')
+        self.webserver.get('/api/v1/users', headers=headers, status=401)
+        self.webserver.get(
+            '/api/v1/users',
+            headers=get_basic_auth_headers(
+                self.user.username, password='pop2'))
+
+    def test_get_protected_view_after_user_delete(self):
+        headers = get_basic_auth_headers(self.user.username, password='pop')
+        self.webserver.get('/api/v1/users', headers=headers)
+        self.user.delete()
+        self.webserver.get('/api/v1/users', headers=headers, status=401)
+
+    def test_get_protected_view_after_change_by_another_worker(self):
+        headers = get_basic_auth_headers(self.user.username, password='pop')
+        self.webserver.get('/api/v1/users', headers=headers)
+        # written without the ORM, as another worker would
+        table = self.registry.User.__table__
+        self.registry.execute(table.update().where(
+            table.c.uuid == self.user.uuid).values(username='renamed'))
+        self.webserver.get('/api/v1/users', headers=headers, status=401)
+
     def test_get_protected_view_without_credentials(self):
         response_protected = self.webserver.get(
             '/api/v1/users', status=401)
@@ -275,6 +309,19 @@ class TestApiEvent(PyramidBlokTestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.json_body), 1)
 
+    def test_get_events_view_raw(self):
+        res = self.webserver.get(
+                '/api/v1/events?raw=1',
+                headers=get_basic_auth_headers(
+                    self.user.username, password='pop'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json_body), 1)
+        self.assertEqual(set(res.json_body[0]),
+                         {'uuid', 'name', 'start', 'end', 'show_uuid'})
+        self.assertEqual(res.json_body[0]['name'], self.event.name)
+        self.assertEqual(res.json_body[0]['uuid'], str(self.event.uuid))
+        self.assertEqual(res.json_body[0]['show_uuid'], str(self.show.uuid))
+
     def test_post_event_view(self):
         start = self.event.start + datetime.timedelta(hours=1)
         end = start + datetime.timedelta(hours=1)
@@ -292,6 +339,38 @@ class TestApiEvent(PyramidBlokTestCase):
             response.json_body.get('name'),
             "GooGoo Radio Show #2")
 
+    def test_post_overlapping_event_view(self):
+        start = self.event.start + datetime.timedelta(minutes=30)
+        end = start + datetime.timedelta(hours=1)
+
+        response = self.webserver.post_json(
+                '/api/v1/events',
+                params={'name': 'GooGoo Radio Show #2',
+                        'start': '%s' % start.isoformat(),
+                        'end': '%s' % end.isoformat(),
+                        'show': '%s' % self.show.uuid},
+                headers=get_basic_auth_headers('bob', password='pop'),
+                status=409,
+            )
+        self.assertEqual(response.status_code, 409)
+        errors = response.json_body.get('errors')
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].get('name'), 'overlap')
+        self.assertEqual(errors[0].get('conflicts')[0][1].get('uuid'),
+                         str(self.event.uuid))
+
+    def test_put_overlapping_event_view(self):
+        start = self.event.end
+        end = start + datetime.timedelta(hours=1)
+        event2 = create_event(self, start=start, end=end, show=self.show)
+        response = self.webserver.put_json(
+                '/api/v1/events/%s' % event2.uuid,
+                params={'start': '%s' % self.event.start.isoformat()},
+                headers=get_basic_auth_headers('bob', password='pop'),
+                status=409,
+            )
+        self.assertEqual(response.status_code, 409)
+
     def test_post_bad_key_event_view(self):
         response = self.webserver.post_json(
                 '/api/v1/events',
@@ -318,3 +397,190 @@ class TestApiEvent(PyramidBlokTestCase):
                     )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json_body, None)
+
+    def test_get_timeline_view(self):
+        event2 = create_event(
+            self, start=self.event.end,
+            end=self.event.end + datetime.timedelta(hours=1),
+            name="FooEvent #2", show=self.show)
+        params = {'from': self.event.start.isoformat(),
+                  'to': event2.end.isoformat()}
+        res = self.webserver.get(
+                '/api/v1/timeline', params=dict(params, limit=1),
+                headers=get_basic_auth_headers('bob', password='pop'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json_body['columns'][:2], ['uuid', 'name'])
+        self.assertEqual(res.json_body['rows'][0][0], str(self.event.uuid))
+        self.assertEqual(res.json_body['rows'][0][5], self.show.name)
+        res = self.webserver.get(
+                '/api/v1/timeline',
+                params=dict(params, limit=1, after=res.json_body['next']),
+                headers=get_basic_auth_headers('bob', password='pop'))
+        self.assertEqual(
+            [row[0] for row in res.json_body['rows']], [str(event2.uuid)])
+        self.assertIsNone(res.json_body['next'])
+
+    def test_get_timeline_view_follow_next(self):
+        self.addCleanup(get_recurrence_set(self.registry).invalidate)
+        start = self.event.end.replace(microsecond=0).astimezone(
+            datetime.timezone(datetime.timedelta(hours=2)))
+        recurrence = create_recurrence(
+            self, rrule="FREQ=DAILY;COUNT=2", dtstart=start)
+        params = {'from': self.event.start.astimezone(
+                      datetime.timezone.utc).isoformat(),
+                  'to': (start + datetime.timedelta(days=2)).isoformat(),
+                  'limit': 1}
+        uuids = []
+        while True:
+            res = self.webserver.get(
+                    '/api/v1/timeline', params=params,
+                    headers=get_basic_auth_headers('bob', password='pop'))
+            self.assertEqual(res.status_code, 200)
+            uuids.extend(row[0] for row in res.json_body['rows'])
+            if res.json_body['next'] is None:
+                break
+            self.assertNotIn('+', res.json_body['next'])
+            params['after'] = res.json_body['next']
+
+        self.assertEqual(len(uuids), 3)
+        self.assertEqual(uuids[0], str(self.event.uuid))
+        self.assertEqual(len(set(uuids)), 3)
+        self.assertEqual(
+            self.registry.Event.timeline(
+                start, start + datetime.timedelta(days=2))[0][0][8],
+            recurrence.uuid)
+
+    def test_get_plays_view_pages(self):
+        start = datetime.datetime(2017, 1, 31, 23, 0)
+        create_partitions(self.registry.execute, start, months=2)
+        for i in range(5):
+            self.registry.PlayLog.insert(
+                played_at=start + datetime.timedelta(minutes=20 * i),
+                artist="Foo", title="Track %d" % i,
+                filename="/music/%d.flac" % i)
+        headers = get_basic_auth_headers('bob', password='pop')
+        res = self.webserver.get(
+                '/api/v1/plays', params={'limit': 3}, headers=headers)
+        self.assertEqual([item['title'] for item in res.json_body['items']],
+                         ["Track 4", "Track 3", "Track 2"])
+        self.assertIsNotNone(res.json_body['next'])
+        res = self.webserver.get(
+                '/api/v1/plays',
+                params={'limit': 3, 'before': res.json_body['next']},
+                headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([item['title'] for item in res.json_body['items']],
+                         ["Track 1", "Track 0"])
+        self.assertIsNone(res.json_body['next'])
+
+    def test_get_timeline_view_not_modified(self):
+        headers = get_basic_auth_headers('bob', password='pop')
+        res = self.webserver.get('/api/v1/timeline', headers=headers)
+        self.assertIsNotNone(res.etag)
+        headers['If-None-Match'] = '"%s"' % res.etag
+        res = self.webserver.get(
+            '/api/v1/timeline', headers=headers, status=304)
+        self.assertEqual(res.status_code, 304)
+
+
+class TestApiListeners(PyramidBlokTestCase):
+    """Listeners api test class
+    """
+
+    def setUp(self):
+        super(TestApiListeners, self).setUp()
+        self.user = create_user(self)
+        self.presenter = create_presenter(self)
+        self.show = create_show(self, presenter=self.presenter)
+        self.start = datetime.datetime.now().replace(
+            second=0, microsecond=0) - datetime.timedelta(minutes=1)
+        self.event = create_event(self, start=self.start, show=self.show)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(Configuration.set, 'listeners_dir',
+                        Configuration.get('listeners_dir'))
+        Configuration.set('listeners_dir', directory)
+        self.addCleanup(_stats.clear)
+        _stats.clear()
+        stats = ListenerStats(directory, writable=True)
+        for minute in range(60):
+            stats.record(
+                self.start + datetime.timedelta(minutes=minute), 10 + minute)
+
+    def test_get_audience_view(self):
+        start = self.start.astimezone(datetime.timezone.utc)
+        res = self.webserver.get(
+                '/api/v1/listeners/audience',
+                params={'from': (start - datetime.timedelta(
+                            hours=1)).isoformat(),
+                        'to': (start + datetime.timedelta(
+                            hours=2)).isoformat()},
+                headers=get_basic_auth_headers('bob', password='pop'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json_body['items'], [dict(
+            uuid=str(self.event.uuid), name=self.event.name, events=1,
+            mean=39.5, max=69, listener_minutes=2370, sampled_minutes=60)])
+        res = self.webserver.get(
+                '/api/v1/listeners/audience',
+                params={'from': (start - datetime.timedelta(
+                            hours=1)).isoformat(), 'group': 'show'},
+                headers=get_basic_auth_headers('bob', password='pop'))
+        self.assertEqual(
+            [item['name'] for item in res.json_body['items']],
+            [self.show.name])
+
+    def test_get_listeners_view_utc_offset(self):
+        start = self.start.astimezone(
+            datetime.timezone(datetime.timedelta(hours=1)))
+        res = self.webserver.get(
+                '/api/v1/listeners',
+                params={'from': start.isoformat(), 'resolution': 'minute'},
+                headers=get_basic_auth_headers('bob', password='pop'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json_body['start'],
+                         self.start.astimezone().isoformat())
+        self.assertEqual(res.json_body['mean'][0], 10)
+
+
+class TestWebsite(PyramidBlokTestCase):
+    """Website test class
+    """
+
+    def setUp(self):
+        super(TestWebsite, self).setUp()
+        self.presenter = create_presenter(self)
+        self.show = create_show(self, presenter=self.presenter)
+        self.event = create_event(self, show=self.show)
+
+    def test_homepage(self):
+        res = self.webserver.get('/')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(self.event.name, res.text)
+        self.assertIn(self.show.name, res.text)
+        self.assertTrue(res.cache_control.public)
+        res = self.webserver.get(
+            '/', headers={'If-None-Match': '"%s"' % res.etag}, status=304)
+        self.assertEqual(res.status_code, 304)
+
+    def test_push_disabled(self):
+        res = self.webserver.get('/')
+        self.assertNotIn('EventSource(', res.text)
+        res = self.webserver.get('/api/v1/push', status=404)
+        self.assertEqual(res.status_code, 404)
+
+    def test_homepage_after_show_update(self):
+        self.webserver.get('/')
+        self.show.name = "GooGoo radio show"
+        self.registry.flush()
+        res = self.webserver.get('/')
+        self.assertIn("GooGoo radio show", res.text)
+
+    def test_metrics(self):
+        self.webserver.get('/')
+        res = self.webserver.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn(
+            'canigoo_schedule_lookup_seconds_count{pid="%d",lookup="current"}'
+            % os.getpid(),
+            res.text)
@@ -0,0 +1,167 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+from uuid import uuid4
+
+from ..recurrence import Occurrence, RecurrenceRule, RecurrenceSet
+
+
+LOCAL_START = datetime(2017, 10, 2, 20, 0)  # a monday
+START = LOCAL_START.astimezone(timezone.utc)
+
+
+def make_rule(rrule="FREQ=WEEKLY;BYDAY=MO,WE", duration=3600, exdates=(),
+              dtstart=START):
+    return RecurrenceRule(uuid4(), "Weekly", rrule, dtstart, duration,
+                          list(exdates), None, dtstart)
+
+
+class TestRecurrenceRule(TestCase):
+    """ Test the expansion of a recurrence rule"""
+
+    def test_iter_between(self):
+        rule = make_rule()
+        self.assertEqual(
+            list(rule.iter_between(START, START + timedelta(days=7))),
+            [START, START + timedelta(days=2)])
+
+    def test_iter_between_includes_started_occurrence(self):
+        rule = make_rule()
+        self.assertEqual(
+            list(rule.iter_between(START + timedelta(minutes=30),
+                                   START + timedelta(days=1))),
+            [START])
+
+    def test_exdates(self):
+        rule = make_rule(exdates=["2017-10-04T20:00:00"])
+        self.assertEqual(
+            list(rule.iter_between(START, START + timedelta(days=7))),
+            [START])
+        self.assertEqual(rule.after(START), START + timedelta(days=7))
+
+    def test_aware_exdates(self):
+        exdate = (START + timedelta(days=2)).astimezone(
+            timezone(timedelta(hours=2)))
+        rule = make_rule(exdates=[exdate.isoformat()])
+        self.assertEqual(rule.after(START), START + timedelta(days=7))
+
+    def test_naive_bounds(self):
+        rule = make_rule()
+        self.assertEqual(
+            list(rule.iter_between(LOCAL_START,
+                                   LOCAL_START + timedelta(days=7))),
+            [START, START + timedelta(days=2)])
+        self.assertEqual(rule.before(LOCAL_START + timedelta(days=1)), START)
+        self.assertEqual(rule.after(LOCAL_START).tzinfo, timezone.utc)
+
+    def test_utc_until(self):
+        rule = make_rule(rrule="FREQ=DAILY;UNTIL=20171004T235959Z")
+        self.assertEqual(
+            len(list(rule.iter_between(START, START + timedelta(days=7)))),
+            3)
+
+    def test_local_hour_across_dst(self):
+        self.addCleanup(time.tzset)
+        self.addCleanup(os.environ.__setitem__, 'TZ',
+                        os.environ.get('TZ', 'UTC'))
+        os.environ['TZ'] = 'Europe/Paris'
+        time.tzset()
+        start = datetime(2017, 10, 23, 20, 0)
+        rule = make_rule(rrule="FREQ=WEEKLY",
+                         dtstart=start.astimezone(timezone.utc))
+        occurrences = list(rule.iter_between(start, start + timedelta(days=8)))
+        self.assertEqual(
+            [o.hour for o in occurrences], [18, 19])
+        self.assertEqual(
+            [o.astimezone().hour for o in occurrences], [20, 20])
+
+    def test_occurrence_properties(self):
+        rule = RecurrenceRule(uuid4(), "Weekly", "FREQ=WEEKLY", START, 3600,
+                              [], None, START, dict(live={}))
+        occurrence = Occurrence(rule, START, None)
+        self.assertEqual(occurrence.properties, dict(live={}))
+        self.assertEqual(Occurrence(make_rule(), START, None).properties, {})
+
+    def test_invalid_rrule(self):
+        with self.assertRaises(ValueError):
+            make_rule(rrule="FREQ=SOMETIMES")
+
+
+class TestRecurrenceSet(TestCase):
+    """ Test the lookups of a set of recurrences"""
+
+    def setUp(self):
+        self.weekly = make_rule()
+        self.daily = make_rule(rrule="FREQ=DAILY;BYHOUR=8", duration=1800)
+        self.recurrences = RecurrenceSet(sync_interval=3600)
+        self.recurrences.rules = [self.weekly, self.daily]
+        self.recurrences.loaded_at = time.monotonic()
+
+    def test_expand(self):
+        occurrences = self.recurrences.expand(
+            None, START, START + timedelta(days=2))
+        self.assertEqual(
+            [o.start for o in occurrences],
+            [START, START + timedelta(hours=12),
+             START + timedelta(days=1, hours=12)])
+        self.assertEqual(len(self.recurrences.windows), 2)
+
+    def test_expand_windows_share_cached_days(self):
+        for minutes in range(0, 120, 7):
+            at = START + timedelta(minutes=minutes)
+            end = at + timedelta(days=2)
+            occurrences = self.recurrences.expand(None, at, end)
+            self.assertEqual(
+                [o.start for o in occurrences],
+                sorted(list(self.weekly.iter_between(at, end)) +
+                       list(self.daily.iter_between(at, end))))
+            self.assertEqual(occurrences[0].start == START, minutes < 60)
+
+        self.assertEqual(len(self.recurrences.windows), 2)
+
+    def test_expand_is_cached_until_invalidated(self):
+        self.recurrences.expand(None, START, START + timedelta(days=2))
+        self.recurrences.invalidate(self.weekly.uuid)
+        self.assertEqual(len(self.recurrences.windows), 1)
+        self.assertIsNone(self.recurrences.rules)
+
+    def test_current(self):
+        occurrence = self.recurrences.current(
+            None, START + timedelta(minutes=10))
+        self.assertEqual(occurrence.start, START)
+        self.assertEqual(occurrence.recurrence_uuid, self.weekly.uuid)
+        self.assertIsNone(
+            self.recurrences.current(None, START + timedelta(hours=2)))
+
+    def test_next_and_previous(self):
+        at = START + timedelta(hours=2)
+        self.assertEqual(self.recurrences.next(None, at).start,
+                         START + timedelta(hours=12))
+        self.assertEqual(self.recurrences.previous(None, at).start, START)
+
+    def test_next_skip(self):
+        at = START + timedelta(hours=2)
+        occurrence = self.recurrences.next(
+            None, at, skip=lambda o: o.start.day == 3)
+        self.assertEqual(occurrence.start, START + timedelta(days=1, hours=12))
+
+    def test_next_skip_is_bounded(self):
+        self.recurrences.rules = [self.daily]
+        self.assertIsNone(self.recurrences.next(
+            None, START, skip=lambda o: True))
+
+    def test_occurrence_uuid_is_stable(self):
+        first = self.recurrences.current(None, START)
+        self.assertIsNone(first)
+        first = self.recurrences.current(None, START + timedelta(minutes=1))
+        again = self.recurrences.expand(
+            None, START, START + timedelta(hours=1))[0]
+        self.assertEqual(first, again)
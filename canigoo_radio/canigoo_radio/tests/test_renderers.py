@@ -0,0 +1,67 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from datetime import datetime
+from unittest import TestCase
+from uuid import uuid1
+
+from anyblok.config import Configuration
+from anyblok_pyramid.adapter import datetime_adapter, uuid_adapter
+from pyramid.config import Configurator
+from pyramid.renderers import JSON
+from pyramid.request import Request
+
+from ..renderers import OrjsonRenderer, get_json_renderer
+
+
+class Jsonable:
+
+    def __json__(self, request):
+        return {'json': True}
+
+
+class TestOrjsonRenderer(TestCase):
+    """ Test the orjson api renderer"""
+
+    def render(self, renderer, value):
+        renderer.add_adapter(datetime, datetime_adapter)
+        renderer.add_adapter(bytes, lambda obj, request: obj.decode())
+        with Configurator() as config:
+            config.add_renderer('json', renderer)
+            config.add_route('value', '/value')
+            config.add_view(lambda request: value, route_name='value',
+                            renderer='json')
+            app = config.make_wsgi_app()
+
+        return Request.blank('/value').get_response(app)
+
+    def test_same_output(self):
+        value = dict(uuid=uuid1(), start=datetime(2017, 1, 2, 3, 4, 5),
+                     path=b'/music', items=[1, 2.5, None, 'é'],
+                     jsonable=Jsonable())
+        stock = JSON()
+        stock.add_adapter(type(value['uuid']), uuid_adapter)
+        expected = self.render(stock, value)
+        response = self.render(OrjsonRenderer(JSON()), value)
+        self.assertEqual(response.content_type, 'application/json')
+        rendered, expected = response.json, expected.json
+        # canonical form, like the marshmallow schemas
+        self.assertEqual(rendered.pop('uuid'), str(value['uuid']))
+        self.assertEqual(expected.pop('uuid'), value['uuid'].hex)
+        self.assertEqual(rendered, expected)
+
+    def test_fallback(self):
+        response = self.render(OrjsonRenderer(JSON()), {1: 'one'})
+        self.assertEqual(response.json, {'1': 'one'})
+
+    def test_get_json_renderer(self):
+        previous = Configuration.get('json_renderer')
+        self.addCleanup(Configuration.set, 'json_renderer', previous)
+        Configuration.set('json_renderer', 'orjson')
+        self.assertIsInstance(get_json_renderer(), OrjsonRenderer)
+        Configuration.set('json_renderer', 'json')
+        self.assertIsInstance(get_json_renderer(), JSON)
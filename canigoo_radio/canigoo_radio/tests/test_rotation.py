@@ -0,0 +1,101 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import random
+import time
+from collections import Counter
+from unittest import TestCase
+
+from ..playlist import fit_tracks
+from ..rotation import RotationRules, SlidingWindow
+
+
+def item(id, artist, album=None):
+    return dict(id=id, artist=artist, album=album, path='/%d.flac' % id)
+
+
+class TestSlidingWindow(TestCase):
+
+    def test_expire(self):
+        window = SlidingWindow(60)
+        window.add(0, 'a')
+        window.add(30, 'b')
+        window.add(40, 'a')
+        window.expire(59)
+        self.assertIn('a', window)
+        window.expire(60)
+        self.assertEqual(len(window), 2)
+        self.assertIn('a', window)
+        window.expire(100)
+        self.assertNotIn('a', window)
+        self.assertEqual(len(window.counts), 0)
+
+
+class TestRotationRules(TestCase):
+
+    def test_allows(self):
+        rules = RotationRules(artist=3600, track=3 * 86400)
+        rules.add(item(1, 'Foo'), 0)
+        self.assertFalse(rules.allows(item(2, 'foo '), 1800))
+        self.assertTrue(rules.allows(item(2, 'Bar'), 1800))
+        self.assertTrue(rules.allows(item(2, 'Foo'), 3600))
+        self.assertFalse(rules.allows(item(1, 'Bar'), 86400))
+        self.assertTrue(rules.allows(item(1, 'Bar'), 3 * 86400))
+        self.assertEqual(rules.rejected, 2)
+
+    def test_disabled_rule_and_missing_key(self):
+        rules = RotationRules(artist=3600)
+        rules.add(item(1, ''), 0)
+        self.assertTrue(rules.allows(item(1, ''), 1))
+        self.assertEqual(rules.span, 3600)
+
+    def test_snapshot_restore(self):
+        rules = RotationRules(artist=3600)
+        rules.add(item(1, 'Foo'), 0)
+        snapshot = rules.snapshot()
+        rules.add(item(2, 'Bar'), 60)
+        rules.allows(item(3, 'Baz'), 3600)
+        rules.restore(snapshot)
+        self.assertFalse(rules.allows(item(3, 'Foo'), 120))
+        self.assertTrue(rules.allows(item(3, 'Bar'), 120))
+
+    def test_redraw_keeps_plays_of_closest_draw(self):
+        tracks = [(181 + 2 * i, item(i, 'artist %d' % i)) for i in range(30)]
+        rules = RotationRules(artist=3600)
+        playlist = fit_tracks(tracks[:6], 3600, rng=random.Random(0),
+                              rules=rules)
+        self.assertEqual(len(playlist.tracks), 6)
+        self.assertEqual(
+            rules.windows[0][1].counts,
+            Counter(track['artist'] for track in playlist.tracks))
+
+    def test_day_of_programming(self):
+        rng = random.Random(0)
+        tracks = [(rng.uniform(120, 420), item(i, 'artist %d' % (i // 10),
+                                               'album %d' % (i // 10)))
+                  for i in range(200000)]
+        rules = RotationRules(artist=3600, album=3 * 3600,
+                              track=3 * 86400)
+        plays = []
+        begin = time.perf_counter()
+        for hour in range(24):
+            playlist = fit_tracks(tracks, 3600, rng=random.Random(hour),
+                                  rules=rules, start=hour * 3600)
+            self.assertLess(abs(playlist.length - 3600), 5)
+            at = hour * 3600
+            for track in playlist.tracks:
+                plays.append((at, track))
+                at += tracks[track['id']][0]
+        self.assertLess(time.perf_counter() - begin, 30)
+
+        last = {}
+        for at, track in plays:
+            artist = track['artist']
+            self.assertGreaterEqual(at - last.get(artist, -3600), 3600)
+            last[artist] = at
+        ids = [track['id'] for _, track in plays]
+        self.assertEqual(len(ids), len(set(ids)))
@@ -0,0 +1,165 @@
+# This file is a part of the Canigoo Radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from ..schedule import IntervalIndex, ScheduleIndex, find_overlaps
+from ..schedule_import import read_csv, read_ical, parse_ical_duration
+
+
+class TestIntervalIndex(TestCase):
+    """ Test the in memory schedule index"""
+
+    def setUp(self):
+        self.index = IntervalIndex()
+        self.index.add('b', 20, 30)
+        self.index.add('a', 10, 20)
+        self.index.add('c', 40, 50)
+
+    def test_current(self):
+        self.assertEqual(self.index.current(15), 'a')
+        self.assertEqual(self.index.current(25), 'b')
+        self.assertIsNone(self.index.current(35))
+        self.assertIsNone(self.index.current(5))
+
+    def test_next(self):
+        self.assertEqual(self.index.next(5), 'a')
+        self.assertEqual(self.index.next(25), 'c')
+        self.assertIsNone(self.index.next(45))
+
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(15, 25), 'b')
+        self.assertEqual(self.index.overlapping(5, 12), 'a')
+        self.assertIsNone(self.index.overlapping(30, 40))
+        self.assertIsNone(self.index.overlapping(55, 60))
+
+    def test_previous(self):
+        self.assertIsNone(self.index.previous(15))
+        self.assertEqual(self.index.previous(35), 'b')
+        self.assertEqual(self.index.previous(55), 'c')
+
+    def test_move_and_remove(self):
+        self.index.add('a', 60, 70)
+        self.assertEqual(self.index.next(55), 'a')
+        self.assertIsNone(self.index.current(15))
+        self.index.remove('a')
+        self.assertNotIn('a', self.index)
+        self.assertEqual(len(self.index), 2)
+        self.assertIsNone(self.index.next(55))
+
+
+class TestScheduleIndexRollback(TestCase):
+    """ Test the reload of the index after a rolled back write"""
+
+    def setUp(self):
+        self.session = Session(create_engine('sqlite://'))
+        self.addCleanup(self.session.close)
+        self.index = ScheduleIndex()
+        self.index.loaded = True
+
+    def write(self, key):
+        self.session.execute(text('SELECT 1'))
+        self.index.written(self.session)
+        self.index.add_interval(key, datetime(2017, 1, 1, 10),
+                                datetime(2017, 1, 1, 11))
+
+    def test_commit(self):
+        self.write('a')
+        self.session.commit()
+        self.session.execute(text('SELECT 1'))
+        self.session.rollback()
+        self.assertTrue(self.index.loaded)
+        self.assertIn('a', self.index.index)
+
+    def test_rollback(self):
+        self.write('a')
+        self.session.rollback()
+        self.assertFalse(self.index.loaded)
+
+    def test_savepoint_rollback(self):
+        self.session.execute(text('SELECT 1'))
+        savepoint = self.session.begin_nested()
+        self.write('a')
+        savepoint.rollback()
+        self.assertFalse(self.index.loaded)
+        self.index.loaded = True
+        self.session.rollback()
+        self.assertFalse(self.index.loaded)
+
+
+class TestFindOverlaps(TestCase):
+    """ Test the sweep line overlap detection"""
+
+    def test_no_overlap(self):
+        self.assertEqual(
+            find_overlaps([(0, 10, 'a'), (10, 20, 'b')], [(20, 30, 'c')]),
+            [])
+
+    def test_overlaps_in_batch_and_with_existing(self):
+        self.assertEqual(
+            find_overlaps([(0, 10, 'a'), (5, 15, 'b'), (25, 35, 'c')],
+                          [(12, 30, 'x'), (29, 40, 'y')]),
+            [('a', 'b'), ('b', 'x'), ('x', 'c'), ('c', 'y')])
+
+
+class TestScheduleImport(TestCase):
+    """ Test the schedule grid readers"""
+
+    def test_read_csv(self):
+        rows = read_csv(StringIO(
+            "name,start,end,show\n"
+            "Morning,2017-10-20 08:00,2017-10-20T10:00:00,Wake up\n"))
+        self.assertEqual(rows, [dict(name='Morning',
+                                     start=datetime(2017, 10, 20, 8),
+                                     end=datetime(2017, 10, 20, 10),
+                                     show='Wake up')])
+
+    def test_read_ical(self):
+        rows = read_ical(StringIO(
+            "BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\n"
+            "SUMMARY:Late\r\n  night\r\n"
+            "DTSTART;TZID=Europe/Paris:20171020T230000\r\n"
+            "DTEND:20171021T010000\r\n"
+            "END:VEVENT\r\nEND:VCALENDAR\r\n"))
+        self.assertEqual(rows, [dict(
+            name='Late night',
+            start=datetime(2017, 10, 20, 21, tzinfo=timezone.utc),
+            end=datetime(2017, 10, 21, 1),
+            show=None)])
+        self.assertIsNotNone(rows[0]['start'].tzinfo)
+
+    def test_read_ical_duration(self):
+        rows = read_ical(StringIO(
+            "BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\n"
+            "SUMMARY:Morning\r\nCATEGORIES:Wake up,News\r\n"
+            "DTSTART:20171020T060000Z\r\nDURATION:PT1H30M\r\n"
+            "END:VEVENT\r\nEND:VCALENDAR\r\n"))
+        start = datetime(2017, 10, 20, 6, tzinfo=timezone.utc)
+        self.assertEqual(rows, [dict(name='Morning', start=start,
+                                     end=start + timedelta(minutes=90),
+                                     show='Wake up')])
+
+    def test_read_ical_without_end(self):
+        with self.assertRaises(ValueError):
+            read_ical(StringIO(
+                "BEGIN:VEVENT\r\nSUMMARY:Morning\r\n"
+                "DTSTART:20171020T060000\r\nEND:VEVENT\r\n"))
+
+    def test_parse_ical_duration(self):
+        self.assertEqual(parse_ical_duration('P1W'), timedelta(days=7))
+        self.assertEqual(parse_ical_duration('P1DT2H3M4S'),
+                         timedelta(days=1, hours=2, minutes=3, seconds=4))
+        self.assertEqual(parse_ical_duration('-PT15M'),
+                         timedelta(minutes=-15))
+        for value in ('P', 'PT', '1H', 'PT1H30'):
+            with self.assertRaises(ValueError):
+                parse_ical_duration(value)
@@ -0,0 +1,25 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+""" Prometheus metrics endpoint
+"""
+import os
+
+from pyramid.response import Response
+from pyramid.view import view_config
+
+from ..metrics import CONTENT_TYPE, REGISTRY
+
+
+@view_config(route_name='metrics')
+def metrics(request):
+    """ The metrics of the worker answering the request, labelled by its
+    pid
+    """
+    response = Response(REGISTRY.expose((('pid', os.getpid()),)))
+    response.headers['Content-Type'] = CONTENT_TYPE
+    return response
@@ -0,0 +1,34 @@
+# This file is a part of the Canigoo radio project
+#
+#    Copyright (C) 2017 Franck Bret <franckbret@gmail.com>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+""" Server-Sent Events endpoint
+"""
+from anyblok.config import Configuration
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.view import view_config
+
+from ..push import event_stream, get_broadcaster
+
+
+@view_config(route_name='push')
+def push(request):
+    """ Stream the ``on_air`` and ``event`` messages as Server-Sent Events,
+    answered at once by a 404 unless ``push_enabled``
+    """
+    if not Configuration.get('push_enabled', False):
+        raise HTTPNotFound()
+
+    broadcaster = get_broadcaster(request.anyblok.registry)
+    response = request.response
+    response.content_type = 'text/event-stream'
+    response.cache_control.no_cache = True
+    # let nginx send the messages as they come
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.app_iter = event_stream(
+        broadcaster, broadcaster.subscribe(),
+        keepalive=Configuration.get('push_keepalive', 15))
+    return response
@@ -7,41 +7,97 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 """ A set of http endpoints for rest api backend
 """
+import hashlib
+import json
 import os
-import beets.library
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from uuid import UUID
 
-from cornice.resource import resource
+from cornice.resource import resource, view
 from cornice import Service
 
+from pyramid.httpexceptions import HTTPNotModified
+
 from anyblok.config import Configuration
 
 from anyblok_pyramid import current_blok
 
 from anyblok_pyramid_rest_api.crud_resource import (
-    CrudResource
+    CrudResource,
+    update_from_query_string,
 )
 from anyblok_pyramid_rest_api.validator import (
     base_validator,
+    collection_get_validator,
 )
 
 from . validators import RootAcl
+from .. exception import EventOverlapException
+from .. library import check_fields, get_beets_library
+from .. library_search import get_search_index
+from .. listeners import RESOLUTIONS, audience_stats, get_listener_stats
 from .. liquidsoap_client import LiquidsoapClient
+from .. liquidsoap_status import get_liquidsoap_status
+from .. profiling import timing
+from .. schedule import to_utc
+from .. schedule_import import parse_datetime
 from .. schema import (
     UserSchema,
     PresenterSchema,
     ShowSchema,
-    EventSchema
+    EventSchema,
+    RecurrenceSchema
 )
 
 
-_BEETS_DB = os.path.expanduser(Configuration.get('beets_db', "~/canigoo.db"))
+def is_raw(request):
+    return request.params.get('raw') in ('1', 'true')
+
+
+class CanigooResource(CrudResource):
+    """ Crud resource timing the schema serialisation of profiled requests
+
+    A resource declaring ``raw_fields`` answers ``?raw=1`` collection
+    requests with these columns read by one query and rendered as they
+    are, UUIDs aside, without loading the entries nor the marshmallow round
+    trip.
+    """
+
+    raw_fields = None
+
+    def serialize(self, rest_action, entry):
+        with timing('serialize'):
+            return super(CanigooResource, self).serialize(
+                rest_action, entry)
+
+    def raw_collection_get(self):
+        Model = self.get_model('collection_get')
+        query = self.update_collection_get_filter(
+            Model.query(*self.raw_fields))
+        query = update_from_query_string(
+            self.request, Model, query, self.adapter)
+        # UUIDs in their canonical form with every renderer, as the
+        # marshmallow schemas write them
+        return [{field: str(value) if isinstance(value, UUID) else value
+                 for field, value in zip(self.raw_fields, row)}
+                for row in query]
+
+    @view(validators=(collection_get_validator,), permission='read')
+    def collection_get(self):
+        if self.raw_fields and is_raw(self.request):
+            self.view_is_activated(self.has_collection_get)
+            if not self.request.errors:
+                return self.raw_collection_get()
+
+        return super(CanigooResource, self).collection_get()
 
 
 @resource(collection_path='/api/v1/users',
           path='/api/v1/users/{uuid}',
           permission='authenticated',
           installed_blok=current_blok())
-class UserResource(CrudResource, RootAcl):
+class UserResource(CanigooResource, RootAcl):
     model = 'Model.User'
     default_schema = UserSchema
 
@@ -50,27 +106,208 @@ class UserResource(CrudResource, RootAcl):
           path='/api/v1/presenters/{uuid}',
           permission='authenticated',
           installed_blok=current_blok())
-class PresenterResource(CrudResource, RootAcl):
+class PresenterResource(CanigooResource, RootAcl):
     model = 'Model.Presenter'
     default_schema = PresenterSchema
+    raw_fields = ('uuid', 'name')
 
 
 @resource(collection_path='/api/v1/shows',
           path='/api/v1/shows/{uuid}',
           permission='authenticated',
           installed_blok=current_blok())
-class ShowResource(CrudResource, RootAcl):
+class ShowResource(CanigooResource, RootAcl):
     model = 'Model.Show'
     default_schema = ShowSchema
+    raw_fields = ('uuid', 'name', 'presenter_uuid')
 
 
 @resource(collection_path='/api/v1/events',
           path='/api/v1/events/{uuid}',
           permission='authenticated',
           installed_blok=current_blok())
-class EventResource(CrudResource, RootAcl):
+class EventResource(CanigooResource, RootAcl):
     model = 'Model.Event'
     default_schema = EventSchema
+    raw_fields = ('uuid', 'name', 'start', 'end', 'show_uuid')
+
+    def create(self, Model, params):
+        with event_overlap_conflict(self.request):
+            return super(EventResource, self).create(Model, params)
+
+    def update(self, item, params=None):
+        with event_overlap_conflict(self.request):
+            return super(EventResource, self).update(item, params=params)
+
+    @view(validators=(collection_get_validator,), permission='read')
+    def collection_get(self):
+        """ Events followed by the occurrences of the recurrences inside the
+        ``from`` / ``to`` querystring window
+        """
+        events = super(EventResource, self).collection_get()
+        if self.request.errors or events is None:
+            return events
+
+        window = get_window(self.request)
+        if window is None:
+            return
+
+        occurrences = self.registry.Event.get_occurrences(*window)
+        if not occurrences:
+            return events
+
+        return list(events) + [serialize_occurrence(occurrence)
+                               for occurrence in occurrences]
+
+
+@resource(collection_path='/api/v1/recurrences',
+          path='/api/v1/recurrences/{uuid}',
+          permission='authenticated',
+          installed_blok=current_blok())
+class RecurrenceResource(CanigooResource, RootAcl):
+    model = 'Model.Recurrence'
+    default_schema = RecurrenceSchema
+    raw_fields = ('uuid', 'name', 'rrule', 'dtstart', 'duration', 'exdates',
+                  'show_uuid')
+
+    def create(self, Model, params):
+        with invalid_rrule(self.request):
+            return super(RecurrenceResource, self).create(Model, params)
+
+    def update(self, item, params=None):
+        with invalid_rrule(self.request):
+            return super(RecurrenceResource, self).update(item, params=params)
+
+
+@contextmanager
+def invalid_rrule(request):
+    """ Turn the ``ValueError`` raised by an invalid rrule into a 400 error
+    """
+    try:
+        yield
+    except ValueError as e:
+        request.errors.add('body', 'rrule', str(e))
+        request.errors.status = 400
+
+
+def get_window(request):
+    """ Returns the ``(from, to)`` window of the querystring, it defaults to
+    the next ``recurrence_window_days`` days
+    """
+    querystring = request.GET
+    try:
+        start = to_utc(parse_datetime(querystring['from'])
+                       if 'from' in querystring else datetime.now())
+        end = to_utc(parse_datetime(querystring['to'])) \
+            if 'to' in querystring else start + timedelta(
+                days=Configuration.get('recurrence_window_days', 7))
+    except ValueError as e:
+        request.errors.add('querystring', 'window', str(e))
+        request.errors.status = 400
+        return None
+
+    return start, end
+
+
+def serialize_occurrence(occurrence):
+    return dict(uuid=str(occurrence.uuid),
+                name=occurrence.name,
+                start=occurrence.start.isoformat(),
+                end=occurrence.end.isoformat(),
+                show=occurrence.show_uuid and dict(
+                    uuid=str(occurrence.show_uuid)),
+                recurrence=str(occurrence.recurrence_uuid))
+
+
+def serialize_event_bounds(event):
+    return dict(uuid=event['uuid'] and str(event['uuid']),
+                name=event['name'],
+                start=event['start'].isoformat(),
+                end=event['end'].isoformat())
+
+
+@contextmanager
+def event_overlap_conflict(request):
+    """ Turn an ``EventOverlapException`` into a 409 error listing the
+    conflicting events
+    """
+    try:
+        yield
+    except EventOverlapException as e:
+        request.errors.add(
+            'body', 'overlap', str(e),
+            conflicts=[[serialize_event_bounds(a), serialize_event_bounds(b)]
+                       for a, b in e.conflicts])
+        request.errors.status = 409
+
+
+timeline = Service(name='timeline',
+                   path='/api/v1/timeline',
+                   permission='authenticated',
+                   validators=(base_validator,),
+                   installed_blok=current_blok(),
+                   description='Events and occurrences of a time window')
+
+TIMELINE_COLUMNS = ['uuid', 'name', 'start', 'end', 'show_uuid', 'show',
+                    'presenter_uuid', 'presenter', 'recurrence_uuid']
+
+
+def compact_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def format_cursor(at, uuid):
+    """ Returns the cursor of the ``(datetime, uuid)`` key of a row, in UTC
+    without ``+`` to be usable unquoted in a querystring
+    """
+    return '%sZ,%s' % (to_utc(at).replace(tzinfo=None).isoformat(), uuid)
+
+
+def parse_cursor(cursor):
+    """ Returns the ``(datetime, uuid)`` key of a timeline or plays cursor
+    """
+    start, _, uuid = cursor.partition(',')
+    return to_utc(parse_datetime(start)), UUID(uuid)
+
+
+@timeline.get()
+def timeline_get(request):
+    """ Rows of the events and occurrences overlapping the ``from`` / ``to``
+    window, ``limit`` rows at most following the ``after`` cursor
+    """
+    window = get_window(request)
+    if window is None:
+        return
+
+    querystring = request.GET
+    try:
+        limit = min(int(querystring.get('limit', 200)), 1000)
+        after = parse_cursor(querystring['after']) \
+            if querystring.get('after') else None
+    except ValueError as e:
+        request.errors.add('querystring', 'cursor', str(e))
+        request.errors.status = 400
+        return
+
+    rows, more = request.anyblok.registry.Event.timeline(
+        window[0], window[1], after=after, limit=max(limit, 1))
+    res = dict(columns=TIMELINE_COLUMNS,
+               rows=[[compact_value(value) for value in row]
+                     for row in rows],
+               next=None)
+    if more:
+        res['next'] = format_cursor(rows[-1][2], rows[-1][0])
+
+    etag = hashlib.sha1(json.dumps(res).encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        return HTTPNotModified(etag=etag)
+
+    request.response.etag = etag
+    return res
 
 
 liquidsoap_client = Service(name='liquidsoap_client',
@@ -81,19 +318,21 @@ liquidsoap_client = Service(name='liquidsoap_client',
                             description='Liquidsoap client api endpoint')
 
 
+def set_age_header(request, age):
+    request.response.headers['Age'] = str(int(age))
+    return round(age, 3)
+
+
 @liquidsoap_client.get()
 def liquidsoap_client_get(request):
     """ Retrieve for now status for icecast and Liquidsoap
     """
-    sock = LiquidsoapClient()
-    icecast_status = sock.send("icecast.status")
-    version = sock.send("version")
-    uptime = sock.send("uptime")
-    operators = sock.send("list")
-    res = dict(version=version,
-               icecast_status=icecast_status,
-               uptime=uptime,
-               operators=operators)
+    snapshot, age = get_liquidsoap_status().get()
+    res = dict(version=snapshot['version'],
+               icecast_status=snapshot['icecast_status'],
+               uptime=snapshot['uptime'],
+               operators=snapshot['operators'],
+               age=set_age_header(request, age))
     return res
 
 
@@ -134,15 +373,95 @@ library_item = Service(name='library_item',
                        description='Library Item')
 
 
+def json_default(value):
+    if isinstance(value, bytes):
+        return os.fsdecode(value)
+    return str(value)
+
+
+def iter_json_array(items, chunk_size=100):
+    """ Yield the json array of ``items`` by chunks of encoded items
+    """
+    yield b'['
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(json.dumps(item, default=json_default))
+        if len(chunk) == chunk_size:
+            yield (('' if first else ',') + ','.join(chunk)).encode('utf-8')
+            chunk, first = [], False
+
+    if chunk:
+        yield (('' if first else ',') + ','.join(chunk)).encode('utf-8')
+
+    yield b']'
+
+
 @library_item.get()
 def library_item_collection_get(request):
     """ Returns a collection of library items from Beets
+
+    ``fields`` is a comma separated list of the returned item columns. With
+    ``limit`` or ``after`` a page ``{items, next}`` is returned, ``next``
+    being the ``after`` cursor of the following page. With ``stream`` every
+    matching item is written out while it is read from the library.
     """
-    search = request.validated['querystring'].get('search', '')
-    lib = beets.library.Library(_BEETS_DB)
-    q = lib.items(search)
-    res = [dict(item) for item in q.rows]
-    return res
+    querystring = request.validated['querystring']
+    search = querystring.get('search', '')
+    library = get_beets_library()
+    try:
+        fields = check_fields([
+            field for field in querystring.get('fields', '').split(',')
+            if field])
+        after = int(querystring['after']) if querystring.get('after') \
+            else None
+        limit = int(querystring['limit']) if querystring.get('limit') \
+            else None
+    except ValueError as e:
+        request.errors.add('querystring', 'library', str(e))
+        request.errors.status = 400
+        return
+
+    if querystring.get('stream') in ('1', 'true'):
+        response = request.response
+        response.content_type = 'application/json'
+        response.app_iter = iter_json_array(
+            library.iter_items(search, fields))
+        return response
+
+    if limit is not None or after is not None:
+        items, after = library.page(
+            search, fields, after, min(max(limit or 100, 1), 1000))
+        return dict(items=items, next=after)
+
+    if fields:
+        return library.select(search, fields)
+
+    return library.search(search)
+
+
+library_typeahead = Service(name='library_typeahead',
+                            path='/api/v1/library/typeahead',
+                            permission='authenticated',
+                            validators=(base_validator,),
+                            installed_blok=current_blok(),
+                            description='Library full text search')
+
+
+@library_typeahead.get()
+def library_typeahead_get(request):
+    """ Returns the library items best matching the words of ``q``, the
+    last word being a prefix
+    """
+    querystring = request.validated['querystring']
+    try:
+        limit = min(max(int(querystring.get('limit', 10)), 1), 50)
+    except ValueError as e:
+        request.errors.add('querystring', 'limit', str(e))
+        request.errors.status = 400
+        return
+
+    return get_search_index().search(querystring.get('q', ''), limit=limit)
 
 
 on_air = Service(name='on_air',
@@ -152,12 +471,155 @@ on_air = Service(name='on_air',
 
 @on_air.get()
 def on_air_get(request):
-    sock = LiquidsoapClient()
-    current = sock.send("request.on_air")
-    if type(current) == str:
-        meta = sock.send('request.metadata %s' % current)
-        return dict(meta=sock.parse_metadatas(meta)) if meta else dict()
-    elif type(current) == dict() and "error" in current.keys():
-        request.errors.add('body', "liquidsoap socket connection failed")
+    snapshot, age = get_liquidsoap_status().get()
+    age = set_age_header(request, age)
+    if snapshot['error'] and not snapshot['on_air']:
+        request.errors.add(
+            'body', 'liquidsoap', 'liquidsoap socket connection failed')
+        request.errors.status = 503
+        return
+
+    if snapshot['on_air']:
+        return dict(meta=snapshot['on_air'], age=age)
     else:
-        return dict()
+        return dict(age=age)
+
+
+plays = Service(name='plays',
+                path='/api/v1/plays',
+                validators=(base_validator,),
+                installed_blok=current_blok(),
+                description="Tracks played by Liquidsoap, most recent first")
+
+PLAYS_COLUMNS = ['uuid', 'played_at', 'artist', 'title', 'album', 'source']
+
+
+@plays.get()
+def plays_get(request):
+    """ The ``limit`` plays preceding the ``before`` cursor, ``next`` is the
+    cursor of the following page
+    """
+    registry = request.anyblok.registry
+    querystring = request.GET
+    try:
+        limit = min(max(int(querystring.get('limit', 50)), 1), 500)
+        before = parse_cursor(querystring['before']) \
+            if querystring.get('before') else None
+    except ValueError as e:
+        request.errors.add('querystring', 'cursor', str(e))
+        request.errors.status = 400
+        return
+
+    rows, more = registry.PlayLog.recent(before=before, limit=limit)
+    res = dict(items=[{column: compact_value(value)
+                       for column, value in zip(PLAYS_COLUMNS, row)}
+                      for row in rows],
+               next=None)
+    if more:
+        res['next'] = format_cursor(rows[-1][1], rows[-1][0])
+
+    return res
+
+
+listeners = Service(name='listeners',
+                    path='/api/v1/listeners',
+                    permission='authenticated',
+                    validators=(base_validator,),
+                    installed_blok=current_blok(),
+                    description="Listener counts history")
+
+listeners_audience = Service(name='listeners_audience',
+                             path='/api/v1/listeners/audience',
+                             permission='authenticated',
+                             validators=(base_validator,),
+                             installed_blok=current_blok(),
+                             description="Audience of the events or shows")
+
+# the minutes of a longer window are read from the hourly rollups
+MAX_MINUTE_WINDOW = timedelta(days=31)
+
+# bound of the events of an audience window
+MAX_AUDIENCE_EVENTS = 100000
+
+
+def get_past_window(request):
+    """ Returns the ``(from, to)`` window of the querystring, it defaults to
+    the ``recurrence_window_days`` days until now
+    """
+    querystring = request.GET
+    try:
+        end = to_utc(parse_datetime(querystring['to'])
+                     if 'to' in querystring else datetime.now())
+        start = to_utc(parse_datetime(querystring['from'])) \
+            if 'from' in querystring else end - timedelta(
+                days=Configuration.get('recurrence_window_days', 7))
+    except ValueError as e:
+        request.errors.add('querystring', 'window', str(e))
+        request.errors.status = 400
+        return None
+
+    if start >= end:
+        request.errors.add('querystring', 'window', "from must precede to")
+        request.errors.status = 400
+        return None
+
+    return start, end
+
+
+@listeners.get()
+def listeners_get(request):
+    """ Mean and maximum listeners of the ``from`` / ``to`` window by
+    ``resolution`` (minute, hour or day), slot ``i`` starts ``i * step``
+    seconds after ``start``
+    """
+    window = get_past_window(request)
+    if window is None:
+        return
+
+    resolution = request.GET.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS:
+        request.errors.add('querystring', 'resolution',
+                           "resolution must be minute, hour or day")
+        request.errors.status = 400
+        return
+
+    if resolution == 'minute' and window[1] - window[0] > MAX_MINUTE_WINDOW:
+        request.errors.add('querystring', 'resolution',
+                           "minute resolution is limited to 31 days")
+        request.errors.status = 400
+        return
+
+    res = get_listener_stats().series(window[0], window[1], resolution)
+    res['start'] = res['start'].isoformat()
+    return res
+
+
+@listeners_audience.get()
+def listeners_audience_get(request):
+    """ Listeners of the events and occurrences of the ``from`` / ``to``
+    window, or of their shows when ``group`` is show
+    """
+    window = get_past_window(request)
+    if window is None:
+        return
+
+    group = request.GET.get('group', 'event')
+    if group not in ('event', 'show'):
+        request.errors.add('querystring', 'group',
+                           "group must be event or show")
+        request.errors.status = 400
+        return
+
+    rows, more = request.anyblok.registry.Event.timeline(
+        window[0], window[1], limit=MAX_AUDIENCE_EVENTS)
+    if more:
+        request.errors.add('querystring', 'window',
+                           "more than %d events" % MAX_AUDIENCE_EVENTS)
+        request.errors.status = 400
+        return
+
+    items = audience_stats(get_listener_stats(), rows, group=group)
+    for item in items:
+        item['uuid'] = compact_value(item['uuid'])
+
+    return dict(items=items)
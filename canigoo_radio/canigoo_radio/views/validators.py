@@ -10,15 +10,32 @@ from pyramid.security import ALL_PERMISSIONS
 from pyramid.security import Allow
 from pyramid.security import Authenticated
 
+from ..credentials import (
+    forget_credentials, get_verified_user, password_stamp, set_verified_user)
+from ..profiling import timing
 
-def check_basic_auth_credentials(username, password, request):
-
-    registry = request.anyblok.registry
-    user = registry.User.query().filter_by(username=username).first()
 
-    if user and user.password == password:
-        # an empty list is enough to indicate logged-in
-        return []
+def check_basic_auth_credentials(username, password, request):
+    with timing('auth'):
+        User = request.anyblok.registry.User
+        verified = get_verified_user(username, password)
+        if verified is not None:
+            uuid, stamp = verified
+            row = User.query('username', 'password').filter_by(
+                uuid=uuid).first()
+            if row is not None and row.username == username and \
+                    password_stamp(row.password) == stamp:
+                return []
+
+            forget_credentials(username, password)
+
+        user = User.query().filter_by(username=username).first()
+
+        if user and user.password == password:
+            set_verified_user(username, password, user.uuid,
+                              password_stamp(user.password))
+            # an empty list is enough to indicate logged-in
+            return []
 
 
 class RootAcl:
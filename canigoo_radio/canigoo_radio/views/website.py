@@ -1,19 +1,84 @@
-from pyramid.view import view_config 
+import hashlib
+from datetime import datetime
 
+from anyblok.config import Configuration
+from markupsafe import escape
+from pyramid.renderers import render
+from pyramid.view import view_config
 
-@view_config(route_name='homepage', renderer='../templates/home.jinja2')
-def homepage(request):
+from ..liquidsoap_status import get_liquidsoap_status
+from ..pages import get_page_cache
+from ..schedule import to_timestamp
+
+
+# replaced by the current track in the cached homepage
+ON_AIR_MARKER = "__canigoo_on_air__"
+
+
+def on_air_title(request):
+    """ Returns the current track as shown by the player, from the shared
+    Liquidsoap status snapshot
+    """
+    snapshot, age = get_liquidsoap_status().get()
+    request.response.headers['Age'] = str(int(age))
+    track = snapshot['on_air']
+    if 'title' in track:
+        return "%s - %s" % (track.get('artist', ''), track['title'])
+
+    return None
+
+
+def render_homepage(request, now):
+    """ Returns the homepage html and the datetime of the next schedule
+    boundary, the current track is left as ``ON_AIR_MARKER``
+    """
     registry = request.anyblok.registry
     model = registry.get('Model.Event')
     title = "Canigoo radio station - Hi-Fidelity Music from the Center of the World!"
-    current = model.get_current()
+    current = model.get_current(at=now)
     if current:
-        return dict(name=current.name,
-                    show=current.show.name,
-                    presenter=current.show.presenter.name,
-                    title=title)
+        values = dict(name=current.name,
+                      show=current.show.name,
+                      presenter=current.show.presenter.name,
+                      title=title,
+                      on_air=ON_AIR_MARKER)
+        expires = current.end
     else:
-        return dict(show="Random memories are made of this!",
-                    name="",
-                    presenter="Canigoo Bot! 🤖",
-                    title=title)
+        values = dict(show="Random memories are made of this!",
+                      name="",
+                      presenter="Canigoo Bot! 🤖",
+                      title=title,
+                      on_air=ON_AIR_MARKER)
+        following = model.get_next(at=now)
+        expires = following.start if following else None
+
+    values['push_enabled'] = Configuration.get('push_enabled', False)
+    html = render('../templates/home.jinja2', values, request=request)
+    return html, expires
+
+
+@view_config(route_name='homepage')
+def homepage(request):
+    """ The homepage is rendered once per schedule boundary, only the
+    current track is written in for each request
+    """
+    now = datetime.now()
+    cache = get_page_cache()
+    page = cache.get('homepage', now=now)
+    if page is None:
+        html, expires = render_homepage(request, now)
+        page = cache.set('homepage', html, expires=expires, now=now)
+
+    on_air = on_air_title(request)
+    response = request.response
+    response.content_type = 'text/html'
+    response.charset = 'utf-8'
+    response.text = page.html.replace(
+        ON_AIR_MARKER, str(escape(on_air or "Artist - Title")))
+    response.etag = hashlib.sha1(response.body).hexdigest()
+    response.cache_control.public = True
+    response.cache_control.max_age = max(0, min(
+        int(page.expires - to_timestamp(now)),
+        int(Configuration.get('liquidsoap_status_ttl', 2))))
+    response.conditional_response = True
+    return response
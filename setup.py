@@ -28,6 +28,8 @@ requirements = [
     'anyblok-pyramid-rest-api',
     'cornice_swagger',
     'gunicorn',
+    'python-dateutil>=2.7',
+    'numpy',
 ]
 
 test_requirements = []
@@ -44,10 +46,29 @@ setup(
     entry_points={
         'bloks': [
             'canigoo_radio=canigoo_radio.canigoo_radio:Canigoo_radio'
-            ]
+            ],
+        'console_scripts': [
+            'canigoo_import_events='
+            'canigoo_radio.canigoo_radio.scripts:import_events',
+            'canigoo_playout='
+            'canigoo_radio.canigoo_radio.playout:run_playout',
+            'canigoo_generate_playlists='
+            'canigoo_radio.canigoo_radio.playlist:run_generate_playlists',
+            'canigoo_bench=canigoo_radio.canigoo_radio.bench:run_bench',
+            'canigoo_fake_liquidsoap='
+            'canigoo_radio.canigoo_radio.liquidsoap_fake:run_fake_liquidsoap',
+            ],
+        'anyblok.init': [
+            'canigoo_radio_config='
+            'canigoo_radio.canigoo_radio:anyblok_init_config'
+            ],
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'async': ['gevent'],
+        'fast': ['orjson'],
+    },
     zip_safe=False,
     keywords='canigoo-radio',
     classifiers=[